@@ -6,7 +6,7 @@ import sys
 import time
 
 from channel import channel_factory
-from common import const
+from common import const, tokenizer
 from config import load_config
 from plugins import *
 import threading
@@ -44,6 +44,8 @@ def run():
     try:
         # load config
         load_config()
+        # 后台预加载模型的tokenizer
+        threading.Thread(target=tokenizer.preload, args=([conf().get("model")],), daemon=True).start()
         # ctrl + c
         sigterm_handler_wrap(signal.SIGINT)
         # kill signal
@@ -2,6 +2,7 @@
 Auto-replay chat robot abstract class
 """
 
+import asyncio
 
 from bridge.context import Context
 from bridge.reply import Reply
@@ -15,3 +16,21 @@ class Bot(object):
         :return: reply content
         """
         raise NotImplementedError
+
+    async def areply(self, query, context: Context = None) -> Reply:
+        """
+        async version of reply, used by the asyncio message pipeline.
+        bots with a native async client should override it, the default runs the blocking reply in a thread executor
+        :param req: received message
+        :return: reply content
+        """
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(None, self.reply, query, context)
+
+    def reply_stream(self, query, context: Context = None):
+        """
+        streaming version of reply, used by channels in stream reply mode
+        :return: an iterator of chunks like {"content": delta, "token_usage": {...}}, or a Reply when no streaming is needed
+            (e.g. admin commands), or None when the bot does not support streaming
+        """
+        return None
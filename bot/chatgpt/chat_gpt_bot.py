@@ -1,5 +1,6 @@
 # encoding:utf-8
 
+import asyncio
 import time
 
 import openai
@@ -14,7 +15,7 @@ from bridge.context import ContextType
 from bridge.reply import Reply, ReplyType
 from common.log import logger
 from common.token_bucket import TokenBucket
-from config import conf, load_config
+from config import conf, conf_snapshot, load_config
 from bot.baidu.baidu_wenxin_session import BaiduWenxinSession
 
 # OpenAI对话模型API (可用)
@@ -54,53 +55,11 @@ class ChatGPTBot(Bot, OpenAIImage):
     def reply(self, query, context=None):
         # acquire reply content
         if context.type == ContextType.TEXT:
-            logger.info("[CHATGPT] query={}".format(query))
-
-            session_id = context["session_id"]
-            reply = None
-            clear_memory_commands = conf().get("clear_memory_commands", ["#清除记忆"])
-            if query in clear_memory_commands:
-                self.sessions.clear_session(session_id)
-                reply = Reply(ReplyType.INFO, "记忆已清除")
-            elif query == "#清除所有":
-                self.sessions.clear_all_session()
-                reply = Reply(ReplyType.INFO, "所有人记忆已清除")
-            elif query == "#更新配置":
-                load_config()
-                reply = Reply(ReplyType.INFO, "配置已更新")
+            reply, session, api_key, new_args = self._prepare_text_query(query, context)
             if reply:
                 return reply
-            session = self.sessions.session_query(query, session_id)
-            logger.debug("[CHATGPT] session query={}".format(session.messages))
-
-            api_key = context.get("openai_api_key")
-            model = context.get("gpt_model")
-            new_args = None
-            if model:
-                new_args = self.args.copy()
-                new_args["model"] = model
-            # if context.get('stream'):
-            #     # reply in stream
-            #     return self.reply_text_stream(query, new_query, session_id)
-
             reply_content = self.reply_text(session, api_key, args=new_args)
-            logger.debug(
-                "[CHATGPT] new_query={}, session_id={}, reply_cont={}, completion_tokens={}".format(
-                    session.messages,
-                    session_id,
-                    reply_content["content"],
-                    reply_content["completion_tokens"],
-                )
-            )
-            if reply_content["completion_tokens"] == 0 and len(reply_content["content"]) > 0:
-                reply = Reply(ReplyType.ERROR, reply_content["content"])
-            elif reply_content["completion_tokens"] > 0:
-                self.sessions.session_reply(reply_content["content"], session_id, reply_content["total_tokens"])
-                reply = Reply(ReplyType.TEXT, reply_content["content"])
-            else:
-                reply = Reply(ReplyType.ERROR, reply_content["content"])
-                logger.debug("[CHATGPT] reply {} used 0 tokens.".format(reply_content))
-            return reply
+            return self._build_text_reply(session, reply_content)
 
         elif context.type == ContextType.IMAGE_CREATE:
             ok, retstring = self.create_img(query, 0)
@@ -114,6 +73,116 @@ class ChatGPTBot(Bot, OpenAIImage):
             reply = Reply(ReplyType.ERROR, "Bot不支持处理{}类型的消息".format(context.type))
             return reply
 
+    async def areply(self, query, context=None):
+        # 文本对话使用异步接口，其余类型(图片生成等)在线程池中执行
+        if context.type != ContextType.TEXT:
+            return await super().areply(query, context)
+        reply, session, api_key, new_args = self._prepare_text_query(query, context)
+        if reply:
+            return reply
+        reply_content = await self.areply_text(session, api_key, args=new_args)
+        return self._build_text_reply(session, reply_content)
+
+    def _prepare_text_query(self, query, context):
+        """
+        处理管理指令并将query加入会话
+        :return: (指令的回复, session, api_key, 请求参数)，指令的回复不为空时直接返回该回复
+        """
+        logger.info("[CHATGPT] query={}".format(query))
+
+        session_id = context["session_id"]
+        reply = None
+        clear_memory_commands = conf_snapshot().get("clear_memory_commands", ["#清除记忆"])
+        if query in clear_memory_commands:
+            self.sessions.clear_session(session_id)
+            reply = Reply(ReplyType.INFO, "记忆已清除")
+        elif query == "#清除所有":
+            self.sessions.clear_all_session()
+            reply = Reply(ReplyType.INFO, "所有人记忆已清除")
+        elif query == "#更新配置":
+            load_config()
+            reply = Reply(ReplyType.INFO, "配置已更新")
+        if reply:
+            return reply, None, None, None
+        session = self.sessions.session_query(query, session_id)
+        logger.debug("[CHATGPT] session query={}".format(session.messages))
+
+        api_key = context.get("openai_api_key")
+        model = context.get("gpt_model")
+        new_args = None
+        if model:
+            new_args = self.args.copy()
+            new_args["model"] = model
+        return None, session, api_key, new_args
+
+    def reply_stream(self, query, context=None):
+        """
+        流式回复，管理指令直接返回Reply，其余返回逐块产出内容的生成器
+        """
+        if context.type != ContextType.TEXT:
+            return None
+        reply, session, api_key, new_args = self._prepare_text_query(query, context)
+        if reply:
+            return reply
+        return self.reply_text_stream(session, api_key, args=new_args)
+
+    def reply_text_stream(self, session: ChatGPTSession, api_key=None, args=None):
+        """
+        call openai's ChatCompletion with stream=True
+        产出 {"content": 增量}，出错时产出 {"error": 提示语}；收到第一块内容之前出错会按reply_text的规则重试，
+        结束后把完整回复写入会话
+        """
+        if args is None:
+            args = self.args
+        parts = []
+        retry_count = 0
+        while True:
+            try:
+                if conf_snapshot().rate_limit_chatgpt and not self.tb4chatgpt.get_token():
+                    raise openai.error.RateLimitError("RateLimitError: rate limit exceeded")
+                response = openai.ChatCompletion.create(api_key=api_key, messages=session.messages, stream=True, **args)
+                for chunk in response:
+                    if not chunk.choices:
+                        continue
+                    content = chunk.choices[0]["delta"].get("content")
+                    if content:
+                        parts.append(content)
+                        yield {"content": content}
+                break
+            except Exception as e:
+                result, retry_delay = self._handle_reply_error(e, session, retry_count)
+                if retry_delay is None or parts:
+                    # 已经输出的内容无法撤回，不再重试
+                    yield {"error": result["content"]}
+                    return
+                time.sleep(retry_delay)
+                retry_count += 1
+                logger.warn("[CHATGPT] 第{}次重试".format(retry_count))
+        reply_content = "".join(parts)
+        logger.info("[ChatGPT] stream reply={}".format(reply_content))
+        if reply_content:
+            self.sessions.session_reply(reply_content, session.session_id)
+
+    def _build_text_reply(self, session: ChatGPTSession, reply_content: dict) -> Reply:
+        session_id = session.session_id
+        logger.debug(
+            "[CHATGPT] new_query={}, session_id={}, reply_cont={}, completion_tokens={}".format(
+                session.messages,
+                session_id,
+                reply_content["content"],
+                reply_content["completion_tokens"],
+            )
+        )
+        if reply_content["completion_tokens"] == 0 and len(reply_content["content"]) > 0:
+            reply = Reply(ReplyType.ERROR, reply_content["content"])
+        elif reply_content["completion_tokens"] > 0:
+            self.sessions.session_reply(reply_content["content"], session_id, reply_content["total_tokens"])
+            reply = Reply(ReplyType.TEXT, reply_content["content"])
+        else:
+            reply = Reply(ReplyType.ERROR, reply_content["content"])
+            logger.debug("[CHATGPT] reply {} used 0 tokens.".format(reply_content))
+        return reply
+
     def reply_text(self, session: ChatGPTSession, api_key=None, args=None, retry_count=0) -> dict:
         """
         call openai's ChatCompletion to get the answer
@@ -123,53 +192,82 @@ class ChatGPTBot(Bot, OpenAIImage):
         :return: {}
         """
         try:
-            if conf().get("rate_limit_chatgpt") and not self.tb4chatgpt.get_token():
+            if conf_snapshot().rate_limit_chatgpt and not self.tb4chatgpt.get_token():
                 raise openai.error.RateLimitError("RateLimitError: rate limit exceeded")
             # if api_key == None, the default openai.api_key will be used
             if args is None:
                 args = self.args
             response = openai.ChatCompletion.create(api_key=api_key, messages=session.messages, **args)
             # logger.debug("[CHATGPT] response={}".format(response))
-            logger.info("[ChatGPT] reply={}, total_tokens={}".format(response.choices[0]['message']['content'], response["usage"]["total_tokens"]))
-            return {
-                "total_tokens": response["usage"]["total_tokens"],
-                "completion_tokens": response["usage"]["completion_tokens"],
-                "content": response.choices[0]["message"]["content"],
-            }
+            return self._parse_response(response)
         except Exception as e:
-            need_retry = retry_count < 2
-            result = {"completion_tokens": 0, "content": "我现在有点累了，等会再来吧"}
-            if isinstance(e, openai.error.RateLimitError):
-                logger.warn("[CHATGPT] RateLimitError: {}".format(e))
-                result["content"] = "提问太快啦，请休息一下再问我吧"
-                if need_retry:
-                    time.sleep(20)
-            elif isinstance(e, openai.error.Timeout):
-                logger.warn("[CHATGPT] Timeout: {}".format(e))
-                result["content"] = "我没有收到你的消息"
-                if need_retry:
-                    time.sleep(5)
-            elif isinstance(e, openai.error.APIError):
-                logger.warn("[CHATGPT] Bad Gateway: {}".format(e))
-                result["content"] = "请再问我一次"
-                if need_retry:
-                    time.sleep(10)
-            elif isinstance(e, openai.error.APIConnectionError):
-                logger.warn("[CHATGPT] APIConnectionError: {}".format(e))
-                result["content"] = "我连接不到你的网络"
-                if need_retry:
-                    time.sleep(5)
+            result, retry_delay = self._handle_reply_error(e, session, retry_count)
+            if retry_delay is not None:
+                time.sleep(retry_delay)
+                logger.warn("[CHATGPT] 第{}次重试".format(retry_count + 1))
+                return self.reply_text(session, api_key, args, retry_count + 1)
             else:
-                logger.exception("[CHATGPT] Exception: {}".format(e))
-                need_retry = False
-                self.sessions.clear_session(session.session_id)
+                return result
 
-            if need_retry:
+    async def areply_text(self, session: ChatGPTSession, api_key=None, args=None, retry_count=0) -> dict:
+        """
+        async version of reply_text, use openai's ChatCompletion.acreate
+        """
+        try:
+            if conf_snapshot().rate_limit_chatgpt:
+                loop = asyncio.get_running_loop()
+                if not await loop.run_in_executor(None, self.tb4chatgpt.get_token):
+                    raise openai.error.RateLimitError("RateLimitError: rate limit exceeded")
+            if args is None:
+                args = self.args
+            response = await openai.ChatCompletion.acreate(api_key=api_key, messages=session.messages, **args)
+            return self._parse_response(response)
+        except Exception as e:
+            result, retry_delay = self._handle_reply_error(e, session, retry_count)
+            if retry_delay is not None:
+                await asyncio.sleep(retry_delay)
                 logger.warn("[CHATGPT] 第{}次重试".format(retry_count + 1))
-                return self.reply_text(session, api_key, args, retry_count + 1)
+                return await self.areply_text(session, api_key, args, retry_count + 1)
             else:
                 return result
 
+    def _parse_response(self, response) -> dict:
+        logger.info("[ChatGPT] reply={}, total_tokens={}".format(response.choices[0]['message']['content'], response["usage"]["total_tokens"]))
+        return {
+            "total_tokens": response["usage"]["total_tokens"],
+            "completion_tokens": response["usage"]["completion_tokens"],
+            "content": response.choices[0]["message"]["content"],
+        }
+
+    def _handle_reply_error(self, e, session: ChatGPTSession, retry_count):
+        """
+        :return: (失败时的结果, 重试前等待的秒数)，不需要重试时等待秒数为None
+        """
+        need_retry = retry_count < 2
+        retry_delay = 0
+        result = {"completion_tokens": 0, "content": "我现在有点累了，等会再来吧"}
+        if isinstance(e, openai.error.RateLimitError):
+            logger.warn("[CHATGPT] RateLimitError: {}".format(e))
+            result["content"] = "提问太快啦，请休息一下再问我吧"
+            retry_delay = 20
+        elif isinstance(e, openai.error.Timeout):
+            logger.warn("[CHATGPT] Timeout: {}".format(e))
+            result["content"] = "我没有收到你的消息"
+            retry_delay = 5
+        elif isinstance(e, openai.error.APIError):
+            logger.warn("[CHATGPT] Bad Gateway: {}".format(e))
+            result["content"] = "请再问我一次"
+            retry_delay = 10
+        elif isinstance(e, openai.error.APIConnectionError):
+            logger.warn("[CHATGPT] APIConnectionError: {}".format(e))
+            result["content"] = "我连接不到你的网络"
+            retry_delay = 5
+        else:
+            logger.exception("[CHATGPT] Exception: {}".format(e))
+            need_retry = False
+            self.sessions.clear_session(session.session_id)
+        return result, retry_delay if need_retry else None
+
 
 class AzureChatGPTBot(ChatGPTBot):
     def __init__(self):
@@ -1,5 +1,6 @@
 from bot.session_manager import Session
 from common.log import logger
+from common.tokenizer import get_encoding
 
 
 class OpenAISession(Session):
@@ -17,12 +18,7 @@ class OpenAISession(Session):
         """
         prompt = ""
         for item in self.messages:
-            if item["role"] == "system":
-                prompt += item["content"] + "<|endoftext|>\n\n\n"
-            elif item["role"] == "user":
-                prompt += "Q: " + item["content"] + "\n"
-            elif item["role"] == "assistant":
-                prompt += "\n\nA: " + item["content"] + "<|endoftext|>\n"
+            prompt += prompt_of_message(item)
 
         if len(self.messages) > 0 and self.messages[-1]["role"] == "user":
             prompt += "A: "
@@ -39,9 +35,9 @@ class OpenAISession(Session):
             logger.debug("Exception when counting tokens precisely for query: {}".format(e))
         while cur_tokens > max_tokens:
             if len(self.messages) > 1:
-                self.messages.pop(0)
+                self.pop_message(0)
             elif len(self.messages) == 1 and self.messages[0]["role"] == "assistant":
-                self.messages.pop(0)
+                self.pop_message(0)
                 if precise:
                     cur_tokens = self.calc_tokens()
                 else:
@@ -60,14 +56,29 @@ class OpenAISession(Session):
         return cur_tokens
 
     def calc_tokens(self):
-        return num_tokens_from_string(str(self), self.model)
+        tokens = self.cached_tokens()
+        if len(self.messages) > 0 and self.messages[-1]["role"] == "user":
+            tokens += num_tokens_from_string("A: ", self.model)
+        return tokens
+
+    def count_message_tokens(self, message):
+        return num_tokens_from_string(prompt_of_message(message), self.model)
+
+
+def prompt_of_message(item) -> str:
+    """单条消息在对话模型输入中对应的文本"""
+    if item["role"] == "system":
+        return item["content"] + "<|endoftext|>\n\n\n"
+    elif item["role"] == "user":
+        return "Q: " + item["content"] + "\n"
+    elif item["role"] == "assistant":
+        return "\n\nA: " + item["content"] + "<|endoftext|>\n"
+    return ""
 
 
 # refer to https://github.com/openai/openai-cookbook/blob/main/examples/How_to_count_tokens_with_tiktoken.ipynb
 def num_tokens_from_string(string: str, model: str) -> int:
     """Returns the number of tokens in a text string."""
-    import tiktoken
-
-    encoding = tiktoken.encoding_for_model(model)
+    encoding = get_encoding(model)
     num_tokens = len(encoding.encode(string, disallowed_special=()))
     return num_tokens
@@ -0,0 +1,125 @@
+# encoding:utf-8
+
+"""
+OpenAI兼容接口的客户端注册表
+
+按 (是否异步, model_url, api_key) 复用 OpenAI/AsyncOpenAI 客户端，每个客户端持有有上限的keep-alive连接池，
+避免每次请求重新建立连接和TLS握手。客户端按LRU淘汰，空闲超过TTL的客户端会被回收，
+正在被使用的客户端在最后一个请求结束后才会关闭。
+"""
+
+import asyncio
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+
+import httpx
+from openai import AsyncOpenAI, OpenAI
+
+from common.log import logger
+from common.singleton import singleton
+from config import conf
+
+
+class _ClientEntry(object):
+    def __init__(self, client, is_async):
+        self.client = client
+        self.is_async = is_async
+        self.last_used = time.monotonic()
+        self.in_use = 0
+        self.evicted = False
+
+
+@singleton
+class OpenAIClientPool(object):
+    def __init__(self):
+        self.max_clients = conf().get("openai_client_pool_size", 32)  # 最多缓存的客户端数量
+        self.idle_ttl = conf().get("openai_client_idle_ttl", 300)  # 客户端空闲多少秒后回收
+        self.limits = httpx.Limits(
+            max_connections=conf().get("openai_client_max_connections", 20),
+            max_keepalive_connections=conf().get("openai_client_max_keepalive", 10),
+            keepalive_expiry=conf().get("openai_client_keepalive_expiry", 60),
+        )
+        self._clients = OrderedDict()
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def client(self, base_url, api_key, is_async=False):
+        """
+        借用一个客户端，with块结束后归还
+        :param base_url: 模型服务地址
+        :param api_key: api key
+        :param is_async: 是否返回AsyncOpenAI客户端
+        """
+        entry = self._acquire(base_url, api_key, is_async)
+        try:
+            yield entry.client
+        finally:
+            self._release(entry)
+
+    def _acquire(self, base_url, api_key, is_async) -> _ClientEntry:
+        key = (is_async, base_url, api_key)
+        with self._lock:
+            now = time.monotonic()
+            self._evict_idle(now)
+            entry = self._clients.get(key)
+            if entry is None:
+                entry = _ClientEntry(self._create_client(base_url, api_key, is_async), is_async)
+                self._clients[key] = entry
+                logger.debug("[OpenAIClientPool] create client for {}, total={}".format(base_url, len(self._clients)))
+                while len(self._clients) > self.max_clients:
+                    _, lru_entry = self._clients.popitem(last=False)
+                    self._evict(lru_entry)
+            else:
+                self._clients.move_to_end(key)
+            entry.in_use += 1
+            entry.last_used = now
+            return entry
+
+    def _release(self, entry: _ClientEntry):
+        with self._lock:
+            entry.in_use -= 1
+            entry.last_used = time.monotonic()
+            need_close = entry.evicted and entry.in_use == 0
+        if need_close:
+            self._close(entry)
+
+    def _evict_idle(self, now):
+        # OrderedDict按最近使用排序，队首空闲时间最长
+        while self._clients:
+            key, entry = next(iter(self._clients.items()))
+            if entry.in_use > 0 or now - entry.last_used < self.idle_ttl:
+                break
+            del self._clients[key]
+            self._evict(entry)
+
+    def _evict(self, entry: _ClientEntry):
+        entry.evicted = True
+        if entry.in_use == 0:
+            self._close(entry)
+
+    def _create_client(self, base_url, api_key, is_async):
+        if is_async:
+            return AsyncOpenAI(base_url=base_url, api_key=api_key, http_client=httpx.AsyncClient(limits=self.limits))
+        return OpenAI(base_url=base_url, api_key=api_key, http_client=httpx.Client(limits=self.limits))
+
+    def _close(self, entry: _ClientEntry):
+        try:
+            if not entry.is_async:
+                entry.client.close()
+                return
+            # 异步客户端需要在其所属的事件循环中关闭，不在事件循环中时交给GC回收
+            try:
+                asyncio.get_running_loop().create_task(entry.client.close())
+            except RuntimeError:
+                pass
+        except Exception as e:
+            logger.warning("[OpenAIClientPool] close client error: {}".format(e))
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "clients": len(self._clients),
+                "in_use": sum(entry.in_use for entry in self._clients.values()),
+            }
@@ -1,12 +1,17 @@
-from common.expired_dict import ExpiredDict
+from bot.session_store import create_session_store
 from common.log import logger
-from config import conf
+from config import conf, conf_snapshot
 
 
 class Session(object):
     def __init__(self, session_id, system_prompt=None):
         self.session_id = session_id
         self.messages = []
+        # 每条消息的token数缓存，与messages一一对应，避免每次裁剪历史时重新计算全部消息
+        self._token_cache = []
+        self._token_total = 0
+        # 加载或保存过该会话的持久化存储(SqliteSessionStore)，reset等整体修改后直接保存，内存存储为None
+        self.store = None
         if system_prompt is None:
             self.system_prompt = conf().get("character_desc", "")
         else:
@@ -16,6 +21,10 @@ class Session(object):
     def reset(self):
         system_item = {"role": "system", "content": self.system_prompt}
         self.messages = [system_item]
+        # 插件(如Role)直接调用reset/set_system_prompt，不经过SessionManager，在这里保存
+        store = getattr(self, "store", None)
+        if store is not None:
+            store.save(self)
 
     def set_system_prompt(self, system_prompt):
         self.system_prompt = system_prompt
@@ -35,14 +44,42 @@ class Session(object):
     def calc_tokens(self):
         raise NotImplementedError
 
+    def count_message_tokens(self, message) -> int:
+        """计算单条消息的token数，使用cached_tokens的子类需要实现"""
+        raise NotImplementedError
+
+    def cached_tokens(self):
+        """
+        返回所有消息token数之和，只计算新追加的消息，已计算过的消息使用缓存
+        messages被外部替换或修改时自动重新计算
+        """
+        cache = self._token_cache
+        cached_cnt = len(cache)
+        if cached_cnt > len(self.messages) or (cached_cnt > 0 and cache[-1][0] is not self.messages[cached_cnt - 1]):
+            cache.clear()
+            self._token_total = 0
+        for message in self.messages[len(cache):]:
+            tokens = self.count_message_tokens(message)
+            cache.append((message, tokens))
+            self._token_total += tokens
+        return self._token_total
+
+    def pop_message(self, index):
+        """删除一条消息，同时从缓存的token总数中减去该消息的token数"""
+        message = self.messages.pop(index)
+        if index < len(self._token_cache):
+            if self._token_cache[index][0] is message:
+                self._token_total -= self._token_cache.pop(index)[1]
+            else:  # 缓存与messages不一致，下次重新计算
+                self._token_cache.clear()
+                self._token_total = 0
+        return message
+
 
 class SessionManager(object):
     def __init__(self, sessioncls, **session_args):
-        if conf().get("expires_in_seconds"):
-            sessions = ExpiredDict(conf().get("expires_in_seconds"))
-        else:
-            sessions = dict()
-        self.sessions = sessions
+        # 会话存储，根据session_store配置使用内存或SQLite
+        self.sessions = create_session_store(sessioncls, session_args)
         self.sessioncls = sessioncls
         self.session_args = session_args
 
@@ -55,32 +92,38 @@ class SessionManager(object):
             return self.sessioncls(session_id, system_prompt, **self.session_args)
 
         if session_id not in self.sessions:
-            self.sessions[session_id] = self.sessioncls(session_id, system_prompt, **self.session_args)
+            session = self.sessioncls(session_id, system_prompt, **self.session_args)
+            self.sessions[session_id] = session
         elif system_prompt is not None:  # 如果有新的system_prompt，更新并重置session
-            self.sessions[session_id].set_system_prompt(system_prompt)
-        session = self.sessions[session_id]
+            session = self.sessions[session_id]
+            session.set_system_prompt(system_prompt)
+            self.sessions.save(session)
+        else:
+            session = self.sessions[session_id]
         return session
 
     def session_query(self, query, session_id):
         session = self.build_session(session_id)
         session.add_query(query)
         try:
-            max_tokens = conf().get("conversation_max_tokens", 1000)
+            max_tokens = conf_snapshot().get("conversation_max_tokens", 1000)
             total_tokens = session.discard_exceeding(max_tokens, None)
             logger.debug("prompt tokens used={}".format(total_tokens))
         except Exception as e:
             logger.warning("Exception when counting tokens precisely for prompt: {}".format(str(e)))
+        self.sessions.save(session)
         return session
 
     def session_reply(self, reply, session_id, total_tokens=None):
         session = self.build_session(session_id)
         session.add_reply(reply)
         try:
-            max_tokens = conf().get("conversation_max_tokens", 1000)
+            max_tokens = conf_snapshot().get("conversation_max_tokens", 1000)
             tokens_cnt = session.discard_exceeding(max_tokens, total_tokens)
             logger.debug("raw total_tokens={}, savesession tokens={}".format(total_tokens, tokens_cnt))
         except Exception as e:
             logger.warning("Exception when counting tokens precisely for session: {}".format(str(e)))
+        self.sessions.save(session)
         return session
 
     def clear_session(self, session_id):
@@ -0,0 +1,276 @@
+"""
+会话存储
+
+SessionManager通过dict风格的接口(in / [] / del / clear)访问会话，另外在会话内容变化后调用save持久化。
+- memory: 会话保存在进程内存中(dict或ExpiredDict)，重启后丢失
+- sqlite: 会话保存在SQLite(WAL模式)中，按需加载，每次保存只写入新增和删除的消息
+- sqlite_lru: 在sqlite前增加一个有容量上限的LRU内存缓存
+"""
+
+import json
+import os
+import sqlite3
+import threading
+import time
+import weakref
+from collections import OrderedDict
+
+from common.expired_dict import ExpiredDict
+from common.log import logger
+from config import conf, get_appdata_dir
+
+
+class SessionStore(object):
+    def __contains__(self, session_id):
+        raise NotImplementedError
+
+    def __getitem__(self, session_id):
+        raise NotImplementedError
+
+    def __setitem__(self, session_id, session):
+        raise NotImplementedError
+
+    def __delitem__(self, session_id):
+        raise NotImplementedError
+
+    def clear(self):
+        raise NotImplementedError
+
+    def save(self, session):
+        """会话内容发生变化后调用，持久化变化的部分"""
+        pass
+
+
+class MemorySessionStore(SessionStore):
+    def __init__(self, expires_in_seconds=None):
+        if expires_in_seconds:
+            self.sessions = ExpiredDict(expires_in_seconds)
+        else:
+            self.sessions = dict()
+
+    def __contains__(self, session_id):
+        return session_id in self.sessions
+
+    def __getitem__(self, session_id):
+        return self.sessions[session_id]
+
+    def __setitem__(self, session_id, session):
+        self.sessions[session_id] = session
+
+    def __delitem__(self, session_id):
+        del self.sessions[session_id]
+
+    def clear(self):
+        self.sessions.clear()
+
+
+class SqliteSessionStore(SessionStore):
+    """
+    会话保存在SQLite中，messages表中每条消息一行，按自增id排序
+    保存时对比上次持久化的消息，只插入新追加的消息、删除被裁剪的消息；消息不是追加在末尾时整体重写
+    """
+
+    def __init__(self, db_path, sessioncls, session_args=None, expires_in_seconds=None):
+        self.sessioncls = sessioncls
+        self.session_args = session_args or {}
+        self.namespace = sessioncls.__name__  # 不同Bot的会话类型互不影响
+        self.expires_in_seconds = expires_in_seconds
+        self._persisted = weakref.WeakKeyDictionary()  # session -> [(message, row_id)]，上次持久化时的消息
+        # 正在使用的会话对象，同一会话在被引用期间load返回同一个对象，未保存的修改不会因重新加载而丢失
+        self._live = weakref.WeakValueDictionary()
+        self._lock = threading.RLock()
+        self.conn = sqlite3.connect(db_path, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS sessions (namespace TEXT, session_id TEXT, system_prompt TEXT, updated_at REAL, PRIMARY KEY (namespace, session_id))"
+        )
+        self.conn.execute("CREATE TABLE IF NOT EXISTS messages (id INTEGER PRIMARY KEY AUTOINCREMENT, namespace TEXT, session_id TEXT, message TEXT)")
+        self.conn.execute("CREATE INDEX IF NOT EXISTS idx_messages_session ON messages (namespace, session_id, id)")
+        self.conn.commit()
+        self.purge_expired()
+
+    def __contains__(self, session_id):
+        with self._lock:
+            row = self.conn.execute("SELECT updated_at FROM sessions WHERE namespace=? AND session_id=?", (self.namespace, session_id)).fetchone()
+        return row is not None and not self._is_expired(row[0])
+
+    def __getitem__(self, session_id):
+        session = self.load(session_id)
+        if session is None:
+            raise KeyError(session_id)
+        return session
+
+    def __setitem__(self, session_id, session):
+        with self._lock, self.conn:
+            self._delete(session_id)
+            self.conn.execute(
+                "INSERT INTO sessions (namespace, session_id, system_prompt, updated_at) VALUES (?, ?, ?, ?)",
+                (self.namespace, session_id, session.system_prompt, time.time()),
+            )
+            self._persisted[session] = self._insert_messages(session_id, session.messages)
+            self._track(session)
+
+    def __delitem__(self, session_id):
+        with self._lock, self.conn:
+            self._delete(session_id)
+
+    def clear(self):
+        with self._lock, self.conn:
+            self._live.clear()
+            self.conn.execute("DELETE FROM messages WHERE namespace=?", (self.namespace,))
+            self.conn.execute("DELETE FROM sessions WHERE namespace=?", (self.namespace,))
+
+    def load(self, session_id):
+        with self._lock:
+            row = self.conn.execute("SELECT system_prompt, updated_at FROM sessions WHERE namespace=? AND session_id=?", (self.namespace, session_id)).fetchone()
+            if row is None:
+                return None
+            if self._is_expired(row[1]):
+                with self.conn:
+                    self._delete(session_id)
+                return None
+            session = self._live.get(session_id)
+            if session is not None:
+                return session
+            rows = self.conn.execute("SELECT id, message FROM messages WHERE namespace=? AND session_id=? ORDER BY id", (self.namespace, session_id)).fetchall()
+            session = self.sessioncls(session_id, row[0], **self.session_args)
+            session.messages = [json.loads(message) for _, message in rows]
+            self._persisted[session] = [(message, row_id) for message, (row_id, _) in zip(session.messages, rows)]
+            self._track(session)
+        return session
+
+    def save(self, session):
+        session_id = session.session_id
+        with self._lock, self.conn:
+            persisted = self._persisted.get(session)
+            if persisted is None:
+                self.__setitem__(session_id, session)
+                return
+            current_ids = set(id(message) for message in session.messages)
+            kept = [(message, row_id) for message, row_id in persisted if id(message) in current_ids]
+            removed = [(row_id,) for message, row_id in persisted if id(message) not in current_ids]
+            # 保留的消息必须按原顺序位于列表开头，新消息只能追加在末尾，否则整体重写
+            if any(message is not session.messages[i] for i, (message, _) in enumerate(kept)):
+                self.__setitem__(session_id, session)
+                return
+            if removed:
+                self.conn.executemany("DELETE FROM messages WHERE id=?", removed)
+            appended = self._insert_messages(session_id, session.messages[len(kept):])
+            self.conn.execute(
+                "UPDATE sessions SET system_prompt=?, updated_at=? WHERE namespace=? AND session_id=?",
+                (session.system_prompt, time.time(), self.namespace, session_id),
+            )
+            self._persisted[session] = kept + appended
+
+    def purge_expired(self):
+        """删除所有过期的会话"""
+        if not self.expires_in_seconds:
+            return
+        deadline = time.time() - self.expires_in_seconds
+        with self._lock, self.conn:
+            self.conn.execute(
+                "DELETE FROM messages WHERE namespace=? AND session_id IN (SELECT session_id FROM sessions WHERE namespace=? AND updated_at<?)",
+                (self.namespace, self.namespace, deadline),
+            )
+            self.conn.execute("DELETE FROM sessions WHERE namespace=? AND updated_at<?", (self.namespace, deadline))
+
+    def _is_expired(self, updated_at):
+        return bool(self.expires_in_seconds) and time.time() - updated_at > self.expires_in_seconds
+
+    def _track(self, session):
+        session.store = self
+        self._live[session.session_id] = session
+
+    def _delete(self, session_id):
+        self._live.pop(session_id, None)
+        self.conn.execute("DELETE FROM messages WHERE namespace=? AND session_id=?", (self.namespace, session_id))
+        self.conn.execute("DELETE FROM sessions WHERE namespace=? AND session_id=?", (self.namespace, session_id))
+
+    def _insert_messages(self, session_id, messages):
+        rows = []
+        for message in messages:
+            cursor = self.conn.execute(
+                "INSERT INTO messages (namespace, session_id, message) VALUES (?, ?, ?)",
+                (self.namespace, session_id, json.dumps(message, ensure_ascii=False)),
+            )
+            rows.append((message, cursor.lastrowid))
+        return rows
+
+
+class LRUSqliteSessionStore(SqliteSessionStore):
+    """在SQLite前增加LRU内存缓存，最多缓存cache_size个会话，所有修改直接写入SQLite"""
+
+    def __init__(self, db_path, sessioncls, session_args=None, expires_in_seconds=None, cache_size=1000):
+        super().__init__(db_path, sessioncls, session_args, expires_in_seconds)
+        self.cache_size = cache_size
+        self.cache = OrderedDict()  # session_id -> (session, 最后保存时间)
+
+    def __contains__(self, session_id):
+        with self._lock:
+            if self._get_cached(session_id) is not None:
+                return True
+        return super().__contains__(session_id)
+
+    def __setitem__(self, session_id, session):
+        with self._lock:
+            super().__setitem__(session_id, session)
+            self._cache(session)
+
+    def __delitem__(self, session_id):
+        with self._lock:
+            self.cache.pop(session_id, None)
+            super().__delitem__(session_id)
+
+    def clear(self):
+        with self._lock:
+            self.cache.clear()
+            super().clear()
+
+    def load(self, session_id):
+        with self._lock:
+            session = self._get_cached(session_id)
+            if session is None:
+                session = super().load(session_id)
+                if session is not None:
+                    self._cache(session)
+            return session
+
+    def save(self, session):
+        with self._lock:
+            super().save(session)
+            self._cache(session)
+
+    def _get_cached(self, session_id):
+        item = self.cache.get(session_id)
+        if item is None:
+            return None
+        session, updated_at = item
+        if self._is_expired(updated_at):
+            self.__delitem__(session_id)
+            return None
+        self.cache.move_to_end(session_id)
+        return session
+
+    def _cache(self, session):
+        self.cache[session.session_id] = (session, time.time())
+        self.cache.move_to_end(session.session_id)
+        while len(self.cache) > self.cache_size:
+            self.cache.popitem(last=False)  # 已经写入SQLite，直接丢弃
+
+
+def create_session_store(sessioncls, session_args=None) -> SessionStore:
+    """根据配置创建会话存储"""
+    store_type = conf().get("session_store", "memory")
+    expires_in_seconds = conf().get("expires_in_seconds")
+    if store_type in ["sqlite", "sqlite_lru"]:
+        db_path = conf().get("session_store_path") or os.path.join(get_appdata_dir(), "sessions.db")
+        try:
+            if store_type == "sqlite_lru":
+                return LRUSqliteSessionStore(db_path, sessioncls, session_args, expires_in_seconds, conf().get("session_store_cache_size", 1000))
+            return SqliteSessionStore(db_path, sessioncls, session_args, expires_in_seconds)
+        except Exception as e:
+            logger.error("[SessionStore] open sqlite session store {} failed, use memory store: {}".format(db_path, e))
+    elif store_type != "memory":
+        logger.warning("[SessionStore] unknown session_store: {}, use memory store".format(store_type))
+    return MemorySessionStore(expires_in_seconds)
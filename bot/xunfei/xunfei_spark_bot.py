@@ -1,37 +1,28 @@
 # encoding:utf-8
 
-import requests, json
-from bot.bot import Bot
-from bot.session_manager import SessionManager
-from bot.chatgpt.chat_gpt_session import ChatGPTSession
-from bridge.context import ContextType, Context
-from bridge.reply import Reply, ReplyType
-from common.log import logger
-from config import conf
-from common import const
-import time
-import _thread as thread
-import datetime
-from datetime import datetime
-from wsgiref.handlers import format_date_time
-from urllib.parse import urlencode
 import base64
-import ssl
 import hashlib
 import hmac
 import json
-from time import mktime
-from urllib.parse import urlparse
-import websocket
-import queue
+import ssl
 import threading
-import random
+import time
+from urllib.parse import urlencode, urlparse
+from wsgiref.handlers import format_date_time
+
+import websocket
 
-# 消息队列 map
-queue_map = dict()
+from bot.bot import Bot
+from bot.chatgpt.chat_gpt_session import ChatGPTSession
+from bot.session_manager import SessionManager
+from bridge.context import ContextType, Context
+from bridge.reply import Reply, ReplyType
+from common import const
+from common.log import logger
+from config import conf
 
-# 响应队列 map
-reply_map = dict()
+# 鉴权url中的date与服务端时间相差不能超过300秒，留出余量，在此之前复用同一个签名
+SIGNATURE_TTL = 240
 
 
 class XunFeiBot(Bot):
@@ -40,7 +31,7 @@ class XunFeiBot(Bot):
         self.app_id = conf().get("xunfei_app_id")
         self.api_key = conf().get("xunfei_api_key")
         self.api_secret = conf().get("xunfei_api_secret")
-        # 默认使用v2.0版本: "generalv2"
+        # 默认使用v3.5版本: "generalv3.5"
         # Spark Lite请求地址(spark_url): wss://spark-api.xf-yun.com/v1.1/chat, 对应的domain参数为: "lite"
         # Spark V2.0请求地址(spark_url): wss://spark-api.xf-yun.com/v2.1/chat, 对应的domain参数为: "generalv2"
         # Spark Pro 请求地址(spark_url): wss://spark-api.xf-yun.com/v3.1/chat, 对应的domain参数为: "generalv3"
@@ -48,88 +39,100 @@ class XunFeiBot(Bot):
         # Spark Max 请求地址(spark_url): wss://spark-api.xf-yun.com/v3.5/chat, 对应的domain参数为: "generalv3.5"
         # Spark4.0 Ultra 请求地址(spark_url): wss://spark-api.xf-yun.com/v4.0/chat, 对应的domain参数为: "4.0Ultra"
         # 后续模型更新，对应的参数可以参考官网文档获取：https://www.xfyun.cn/doc/spark/Web.html
-        self.domain = conf().get("xunfei_domain", "generalv3.5")
-        self.spark_url = conf().get("xunfei_spark_url", "wss://spark-api.xf-yun.com/v3.5/chat")
+        self.domain = conf().get("xunfei_domain") or "generalv3.5"
+        self.spark_url = conf().get("xunfei_spark_url") or "wss://spark-api.xf-yun.com/v3.5/chat"
         self.host = urlparse(self.spark_url).netloc
         self.path = urlparse(self.spark_url).path
+        # 建立连接和等待每一帧的超时秒数
+        self.timeout = conf().get("xunfei_timeout", 60)
+        self._signed_url = None
+        self._signed_expire = 0
+        self._url_lock = threading.Lock()
         # 和wenxin使用相同的session机制
         self.sessions = SessionManager(ChatGPTSession, model=const.XUNFEI)
 
     def reply(self, query, context: Context = None) -> Reply:
         if context.type == ContextType.TEXT:
             logger.info("[XunFei] query={}".format(query))
-            session_id = context["session_id"]
-            request_id = self.gen_request_id(session_id)
-            reply_map[request_id] = ""
-            session = self.sessions.session_query(query, session_id)
-            threading.Thread(target=self.create_web_socket,
-                             args=(session.messages, request_id)).start()
-            depth = 0
-            time.sleep(0.1)
-            t1 = time.time()
-            usage = {}
-            while depth <= 300:
-                try:
-                    data_queue = queue_map.get(request_id)
-                    if not data_queue:
-                        depth += 1
-                        time.sleep(0.1)
-                        continue
-                    data_item = data_queue.get(block=True, timeout=0.1)
-                    if data_item.is_end:
-                        # 请求结束
-                        del queue_map[request_id]
-                        if data_item.reply:
-                            reply_map[request_id] += data_item.reply
-                        usage = data_item.usage
-                        break
-
-                    reply_map[request_id] += data_item.reply
-                    depth += 1
-                except Exception as e:
-                    depth += 1
-                    continue
-            t2 = time.time()
-            logger.info(
-                f"[XunFei-API] response={reply_map[request_id]}, time={t2 - t1}s, usage={usage}"
-            )
-            self.sessions.session_reply(reply_map[request_id], session_id,
-                                        usage.get("total_tokens"))
-            reply = Reply(ReplyType.TEXT, reply_map[request_id])
-            del reply_map[request_id]
-            return reply
+            session = self.sessions.session_query(query, context["session_id"])
+            parts = []
+            for chunk in self.reply_text_stream(session):
+                if chunk.get("error"):
+                    return Reply(ReplyType.ERROR, chunk["error"])
+                parts.append(chunk.get("content", ""))
+            return Reply(ReplyType.TEXT, "".join(parts))
         else:
             reply = Reply(ReplyType.ERROR,
                           "Bot不支持处理{}类型的消息".format(context.type))
             return reply
 
-    def create_web_socket(self, prompt, session_id, temperature=0.5):
-        logger.info(f"[XunFei] start connect, prompt={prompt}")
-        websocket.enableTrace(False)
-        wsUrl = self.create_url()
-        ws = websocket.WebSocketApp(wsUrl,
-                                    on_message=on_message,
-                                    on_error=on_error,
-                                    on_close=on_close,
-                                    on_open=on_open)
-        data_queue = queue.Queue(1000)
-        queue_map[session_id] = data_queue
-        ws.appid = self.app_id
-        ws.question = prompt
-        ws.domain = self.domain
-        ws.session_id = session_id
-        ws.temperature = temperature
-        ws.run_forever(sslopt={"cert_reqs": ssl.CERT_NONE})
+    def reply_stream(self, query, context: Context = None):
+        if context.type != ContextType.TEXT:
+            return None
+        logger.info("[XunFei] query={}".format(query))
+        session = self.sessions.session_query(query, context["session_id"])
+        return self.reply_text_stream(session)
 
-    def gen_request_id(self, session_id: str):
-        return session_id + "_" + str(int(time.time())) + "" + str(
-            random.randint(0, 100))
+    def reply_text_stream(self, session: ChatGPTSession, temperature=0.5):
+        """
+        每个请求一个websocket连接，在调用方线程中同步收发，收到一帧就产出一帧
+        产出 {"content": 增量}，最后一帧带 token_usage；出错时产出 {"error": 提示语}，
+        结束后把完整回复写入会话
+        """
+        t1 = time.time()
+        parts = []
+        usage = {}
+        ws = None
+        try:
+            ws = websocket.create_connection(self.create_url(), timeout=self.timeout, sslopt={"cert_reqs": ssl.CERT_NONE})
+            ws.send(json.dumps(self.gen_params(session.messages, temperature)))
+            while True:
+                data = json.loads(ws.recv())
+                header = data["header"]
+                if header["code"] != 0:
+                    logger.error("[XunFei] request error: {}, {}".format(header["code"], header.get("message")))
+                    yield {"error": "讯飞星火请求出错了：{}".format(header.get("message"))}
+                    return
+                choices = data["payload"]["choices"]
+                content = choices["text"][0]["content"]
+                parts.append(content)
+                if choices["status"] == 2:
+                    usage = data["payload"].get("usage", {}).get("text", {})
+                    yield {"content": content, "token_usage": usage}
+                    break
+                if content:
+                    yield {"content": content}
+        except websocket.WebSocketTimeoutException:
+            logger.warn("[XunFei] timeout after {}s".format(self.timeout))
+            yield {"error": "讯飞星火响应超时，请稍后再试"}
+            return
+        except Exception as e:
+            if isinstance(e, websocket.WebSocketBadStatusException):
+                # 握手失败时可能是签名过期或时钟偏差，下次重新签名
+                self._signed_expire = 0
+            logger.error("[XunFei] error: {}".format(e))
+            yield {"error": "我现在有点累了，等会再来吧"}
+            return
+        finally:
+            if ws:
+                ws.close()
+        reply_content = "".join(parts)
+        logger.info(f"[XunFei-API] response={reply_content}, time={time.time() - t1}s, usage={usage}")
+        self.sessions.session_reply(reply_content, session.session_id, usage.get("total_tokens"))
 
     # 生成url
     def create_url(self):
+        now = time.time()
+        with self._url_lock:
+            if self._signed_url and now < self._signed_expire:
+                return self._signed_url
+            self._signed_url = self._sign_url(now)
+            self._signed_expire = now + SIGNATURE_TTL
+            return self._signed_url
+
+    def _sign_url(self, now):
         # 生成RFC1123格式的时间戳
-        now = datetime.now()
-        date = format_date_time(mktime(now.timetuple()))
+        date = format_date_time(now)
 
         # 拼接字符串
         signature_origin = "host: " + self.host + "\n"
@@ -153,22 +156,21 @@ class XunFeiBot(Bot):
         # 将请求的鉴权参数组合为字典
         v = {"authorization": authorization, "date": date, "host": self.host}
         # 拼接鉴权参数，生成url
-        url = self.spark_url + '?' + urlencode(v)
-        # 此处打印出建立连接时候的url,参考本demo的时候可取消上方打印的注释，比对相同参数时生成的url与自己代码生成的url是否一致
-        return url
+        return self.spark_url + '?' + urlencode(v)
 
-    def gen_params(self, appid, domain, question):
+    def gen_params(self, question, temperature=0.5):
         """
         通过appid和用户的提问来生成请参数
         """
         data = {
             "header": {
-                "app_id": appid,
+                "app_id": self.app_id,
                 "uid": "1234"
             },
             "parameter": {
                 "chat": {
-                    "domain": domain,
+                    "domain": self.domain,
+                    "temperature": temperature,
                     "random_threshold": 0.5,
                     "max_tokens": 2048,
                     "auditing": "default"
@@ -181,89 +183,3 @@ class XunFeiBot(Bot):
             }
         }
         return data
-
-
-class ReplyItem:
-    def __init__(self, reply, usage=None, is_end=False):
-        self.is_end = is_end
-        self.reply = reply
-        self.usage = usage
-
-
-# 收到websocket错误的处理
-def on_error(ws, error):
-    logger.error(f"[XunFei] error: {str(error)}")
-
-
-# 收到websocket关闭的处理
-def on_close(ws, one, two):
-    data_queue = queue_map.get(ws.session_id)
-    data_queue.put("END")
-
-
-# 收到websocket连接建立的处理
-def on_open(ws):
-    logger.info(f"[XunFei] Start websocket, session_id={ws.session_id}")
-    thread.start_new_thread(run, (ws, ))
-
-
-def run(ws, *args):
-    data = json.dumps(
-        gen_params(appid=ws.appid,
-                   domain=ws.domain,
-                   question=ws.question,
-                   temperature=ws.temperature))
-    ws.send(data)
-
-
-# Websocket 操作
-# 收到websocket消息的处理
-def on_message(ws, message):
-    data = json.loads(message)
-    code = data['header']['code']
-    if code != 0:
-        logger.error(f'请求错误: {code}, {data}')
-        ws.close()
-    else:
-        choices = data["payload"]["choices"]
-        status = choices["status"]
-        content = choices["text"][0]["content"]
-        data_queue = queue_map.get(ws.session_id)
-        if not data_queue:
-            logger.error(
-                f"[XunFei] can't find data queue, session_id={ws.session_id}")
-            return
-        reply_item = ReplyItem(content)
-        if status == 2:
-            usage = data["payload"].get("usage")
-            reply_item = ReplyItem(content, usage)
-            reply_item.is_end = True
-            ws.close()
-        data_queue.put(reply_item)
-
-
-def gen_params(appid, domain, question, temperature=0.5):
-    """
-    通过appid和用户的提问来生成请参数
-    """
-    data = {
-        "header": {
-            "app_id": appid,
-            "uid": "1234"
-        },
-        "parameter": {
-            "chat": {
-                "domain": domain,
-                "temperature": temperature,
-                "random_threshold": 0.5,
-                "max_tokens": 2048,
-                "auditing": "default"
-            }
-        },
-        "payload": {
-            "message": {
-                "text": question
-            }
-        }
-    }
-    return data
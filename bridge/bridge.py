@@ -1,12 +1,17 @@
+import asyncio
+
 from bot.bot_factory import create_bot
 from bridge.context import Context
 from bridge.reply import Reply
+from bridge.stream_buffer import StreamBuffer
 from common import const
-from common.log import logger
+from common.log import logger, should_sample
 from common.singleton import singleton
-from config import conf
+from config import conf, conf_snapshot
 from translate.factory import create_translator
+from voice import chunked_asr
 from voice.factory import create_voice
+from voice.tts_cache import get_tts_cache
 
 
 @singleton
@@ -102,6 +107,26 @@ class Bridge(object):
             logger.debug("[Bridge] Using legacy mode with default config")
             return self.get_bot("chat").reply(query, context)
 
+    async def afetch_reply_content(self, query, context: Context) -> Reply:
+        """
+        fetch_reply_content的异步版本，实现了areply的Bot直接await，其余Bot在线程池中执行
+        """
+        model_config = context.get("model_config")
+        if model_config:
+            bot = self.create_dynamic_bot(model_config)
+            if context.get("stream_enabled", False):
+                # 流式响应需要逐块推送到channel，仍在线程池中处理
+                loop = asyncio.get_running_loop()
+                return await loop.run_in_executor(None, self._handle_stream_response, bot, query, context)
+            return await bot.areply(query, context)
+        return await self.get_bot("chat").areply(query, context)
+
+    def fetch_reply_stream(self, query, context: Context):
+        """
+        获取默认对话Bot的流式回复，返回值见Bot.reply_stream
+        """
+        return self.get_bot("chat").reply_stream(query, context)
+
     def _handle_stream_response(self, bot, query, context: Context) -> Reply:
         """
         处理流式响应
@@ -131,50 +156,39 @@ class Bridge(object):
                 logger.warning("[Bridge] Bot does not support streaming, falling back to regular mode")
                 return bot.reply(query, context)
             
-            # 处理流式数据
-            accumulated_content = ""
+            # 处理流式数据：只发送增量，完整内容在结束时发送一次
+            config = conf_snapshot()
+            buffer = StreamBuffer(config.get("stream_flush_chars", 64), config.get("stream_flush_interval", 0.1))
             token_usage = {"prompt_tokens": 0, "completion_tokens": 0, "total_tokens": 0}
-            
+
+            def send_delta(delta):
+                if delta:
+                    channel.send_chunk({"content": delta, "finished": False, "event": "chunk"}, context)
+
             for chunk in stream_generator:
                 if isinstance(chunk, dict):
                     # 处理数据块
                     chunk_content = chunk.get("content", "")
                     if chunk_content:
-                        accumulated_content += chunk_content
-
-                        # 【在这里添加打印】
-                        logger.info(f"[Bridge] Stream chunk: {repr(chunk_content)}")  # 打印每个数据块
-                        logger.debug(f"[Bridge] Accumulated so far ({len(accumulated_content)} chars): {accumulated_content[:100]}...")  # 打印累积内容的前100字符
-                                            
-                        # 发送数据块到前端
-                        chunk_data = {
-                            "content": chunk_content,
-                            "accumulated_content": accumulated_content,
-                            "finished": False,
-                            "event": "chunk"
-                        }
-                        channel.send_chunk(chunk_data, context)
-                    
+                        send_delta(buffer.append(chunk_content))
+                        # 每个数据块都打印会拖慢流式输出，按采样打印
+                        if should_sample("bridge.stream_chunk", 50):
+                            logger.debug("[Bridge] Stream chunk: %r, accumulated %d chars", chunk_content, buffer.length)
+
                     # 更新token使用情况
                     if "token_usage" in chunk:
                         token_usage.update(chunk["token_usage"])
                 
                 elif isinstance(chunk, str):
                     # 简单文本块
-                    accumulated_content += chunk
-                    chunk_data = {
-                        "content": chunk,
-                        "accumulated_content": accumulated_content,
-                        "finished": False,
-                        "event": "chunk"
-                    }
-                    channel.send_chunk(chunk_data, context)
+                    send_delta(buffer.append(chunk))
+            send_delta(buffer.flush())
             
             # 发送结束信号
+            accumulated_content = buffer.getvalue()
             final_data = {
                 "content": accumulated_content,
                 "token_usage": token_usage,
-                "accumulated_content": accumulated_content
             }
             channel.send_stream_end(context, final_data)
             
@@ -226,10 +240,14 @@ class Bridge(object):
         return DynamicOpenAIBot(model_config)
 
     def fetch_voice_to_text(self, voiceFile) -> Reply:
-        return self.get_bot("voice_to_text").voiceToText(voiceFile)
+        return chunked_asr.voice_to_text(self.btype["voice_to_text"], self.get_bot("voice_to_text"), voiceFile)
 
     def fetch_text_to_voice(self, text) -> Reply:
-        return self.get_bot("text_to_voice").textToVoice(text)
+        voice = self.get_bot("text_to_voice")
+        cache = get_tts_cache()
+        if cache is None:
+            return voice.textToVoice(text)
+        return cache.text_to_voice(self.btype["text_to_voice"], voice, text)
 
     def fetch_translate(self, text, from_lang="", to_lang="en") -> Reply:
         return self.get_bot("translate").translate(text, from_lang, to_lang)
@@ -0,0 +1,138 @@
+import re
+import time
+
+
+class StreamBuffer(object):
+    """
+    流式回复的缓冲
+
+    - 收到的数据块追加到列表中，只在需要完整文本时join一次，避免字符串反复拼接带来的O(n²)开销
+    - 数据块先合并到待发送区，待发送的字符数达到flush_chars或距上次发送超过flush_interval秒时才作为一个增量发出，
+      避免每个token都产生一帧；第一个数据块立即发出，不增加首字延迟
+    """
+
+    def __init__(self, flush_chars=64, flush_interval=0.1):
+        self.flush_chars = flush_chars
+        self.flush_interval = flush_interval
+        self.parts = []
+        self.length = 0
+        self._pending = []
+        self._pending_length = 0
+        self._last_flush = None
+
+    def append(self, text):
+        """
+        追加数据块
+        :return: 需要立即发送的增量，不需要发送时返回None
+        """
+        if not text:
+            return None
+        self.parts.append(text)
+        self.length += len(text)
+        self._pending.append(text)
+        self._pending_length += len(text)
+        if (
+            self._last_flush is None
+            or self._pending_length >= self.flush_chars
+            or time.monotonic() - self._last_flush >= self.flush_interval
+        ):
+            return self.flush()
+        return None
+
+    def flush(self):
+        """取出待发送的增量，没有时返回None"""
+        if not self._pending:
+            return None
+        delta = "".join(self._pending)
+        self._pending = []
+        self._pending_length = 0
+        self._last_flush = time.monotonic()
+        return delta
+
+    def getvalue(self):
+        """完整文本"""
+        if len(self.parts) > 1:
+            self.parts = ["".join(self.parts)]
+        return self.parts[0] if self.parts else ""
+
+
+# 句子结束的位置：中英文句末标点(可带后引号、括号)、换行、后面跟空白的英文句号
+_SENTENCE_END = re.compile(r"[。！？；!?…]+[”’」』)）\"']*|\n+|\.(?=\s)")
+_CODE_FENCE = "```"
+
+
+def complete_sentences(text):
+    """text中到最后一个句子结束位置为止的部分，没有完整句子时返回空字符串"""
+    end = 0
+    for m in _SENTENCE_END.finditer(text):
+        end = m.end()
+    return text[:end].rstrip()
+
+
+class SentenceBatcher(object):
+    """
+    按句子边界把流式回复切成若干批，用于不支持修改消息的channel分多条发送
+
+    - 第一批在出现第一个完整句子时立即发出，首条消息的等待时间只取决于第一句话
+    - 之后每批至少min_chars个字符，避免一句一条刷屏
+    - 没有句子边界的长段落超过max_chars时在空白处强制切分
+    - 不在```代码块内部切分
+    """
+
+    def __init__(self, min_chars=80, max_chars=500):
+        self.min_chars = min_chars
+        self.max_chars = max_chars
+        self._pending = ""
+        self._fences = 0  # 已发出的内容中代码块标记的个数
+        self._sent = False
+
+    def append(self, text):
+        """
+        追加数据块
+        :return: 可以发送的批次列表，可能为空
+        """
+        if not text:
+            return []
+        self._pending += text
+        batches = []
+        while self._pending:
+            threshold = self.min_chars if self._sent else 1
+            cut = self._cut_position(threshold)
+            if not cut:
+                break
+            batch = self._take(cut)
+            if batch:
+                batches.append(batch)
+        return batches
+
+    def flush(self):
+        """取出剩余的内容，没有时返回None"""
+        return self._take(len(self._pending)) or None
+
+    def _cut_position(self, threshold):
+        text = self._pending
+        if len(text) < threshold:
+            return 0
+        cut = 0
+        for m in _SENTENCE_END.finditer(text):
+            end = m.end()
+            if end >= threshold and self._outside_code(end):
+                cut = end
+        if not cut and len(text) >= self.max_chars:
+            end = text.rfind(" ", threshold, self.max_chars)
+            end = end + 1 if end > 0 else self.max_chars
+            if self._outside_code(end):
+                cut = end
+        return cut
+
+    def _outside_code(self, end):
+        return (self._fences + self._pending.count(_CODE_FENCE, 0, end)) % 2 == 0
+
+    def _take(self, cut):
+        batch = self._pending[:cut]
+        self._pending = self._pending[cut:]
+        self._fences += batch.count(_CODE_FENCE)
+        batch = batch.strip()
+        if batch:
+            self._sent = True
+        return batch
@@ -37,6 +37,12 @@ class Channel(object):
     def build_reply_content(self, query, context: Context = None) -> Reply:
         return Bridge().fetch_reply_content(query, context)
 
+    async def abuild_reply_content(self, query, context: Context = None) -> Reply:
+        return await Bridge().afetch_reply_content(query, context)
+
+    def build_reply_stream(self, query, context: Context = None):
+        return Bridge().fetch_reply_stream(query, context)
+
     def build_voice_to_text(self, voice_file) -> Reply:
         return Bridge().fetch_voice_to_text(voice_file)
 
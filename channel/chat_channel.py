@@ -1,15 +1,21 @@
+import asyncio
 import os
-import re
 import threading
 import time
-from asyncio import CancelledError
-from concurrent.futures import Future, ThreadPoolExecutor
+from collections import deque
+from concurrent.futures import CancelledError, Future, ThreadPoolExecutor
+from queue import Queue
 
+from bridge.bridge import Bridge
 from bridge.context import *
 from bridge.reply import *
+from bridge.stream_buffer import SentenceBatcher, StreamBuffer, complete_sentences
 from channel.channel import Channel
+from channel.trigger_matcher import get_trigger_matcher, mention_pattern
 from common.dequeue import Dequeue
+from common.handler_pool import OVERFLOW_DROP_OLDEST, OVERFLOW_REJECT, OVERFLOW_SHED, HandlerPool
 from common import memory
+from config import conf_snapshot
 from plugins import *
 
 try:
@@ -17,7 +23,39 @@ try:
 except Exception as e:
     pass
 
-handler_pool = ThreadPoolExecutor(max_workers=8)  # 处理消息的线程池
+handler_pool = HandlerPool(max_workers=8)  # 处理消息的线程池，所有channel共享，启动channel时根据配置调整
+_event_loop = None  # asyncio模式下处理消息的事件循环，所有channel共享
+_event_loop_lock = threading.Lock()
+STREAM_CHECK_OVERLAP = 32  # 流式回复检查插件时带上的已检查内容的字符数，跨片段的敏感词等也能被发现
+_tts_pool = None  # 流式语音回复中并发合成各句语音的线程池，与处理消息的线程池分开，避免互相等待
+_tts_pool_lock = threading.Lock()
+
+
+def _get_tts_pool():
+    global _tts_pool
+    with _tts_pool_lock:
+        if _tts_pool is None:
+            _tts_pool = ThreadPoolExecutor(max_workers=conf().get("stream_voice_concurrency", 3), thread_name_prefix="tts")
+    return _tts_pool
+
+
+def _get_event_loop():
+    global _event_loop
+    with _event_loop_lock:
+        if _event_loop is None:
+            loop = asyncio.new_event_loop()
+            # 阻塞操作在共享线程池中执行
+            loop.set_default_executor(handler_pool)
+            t = threading.Thread(target=_start_loop, args=(loop,))
+            t.setDaemon(True)
+            t.start()
+            _event_loop = loop
+    return _event_loop
+
+
+def _start_loop(loop):
+    asyncio.set_event_loop(loop)
+    loop.run_forever()
 
 
 # 抽象类, 它包含了与消息通道无关的通用处理逻辑
@@ -27,8 +65,16 @@ class ChatChannel(Channel):
     futures = {}  # 记录每个session_id提交到线程池的future对象, 用于重置会话时把没执行的future取消掉，正在执行的不会被取消
     sessions = {}  # 用于控制并发，每个session_id同时只能有一个context在处理
     lock = threading.Lock()  # 用于控制对sessions的访问
+    ready_queue = Queue()  # 有待处理消息的session_id队列，produce和任务结束时写入，consume阻塞读取
+    # 流式回复方式(配置stream_reply开启)，None: 不支持，"batch": 按句子分批发送多条消息，"card": 通过卡片增量更新
+    STREAM_REPLY_MODE = None
 
     def __init__(self):
+        handler_pool.configure(conf().get("channel_type"))
+        # asyncio模式：每条消息作为协程在同一个事件循环中处理，等待LLM响应时不占用线程
+        self.async_pipeline = conf().get("async_pipeline", False)
+        if self.async_pipeline:
+            _get_event_loop()
         _thread = threading.Thread(target=self.consume)
         _thread.setDaemon(True)
         _thread.start()
@@ -44,9 +90,10 @@ class ChatChannel(Channel):
             context["origin_ctype"] = ctype
         # context首次传入时，receiver是None，根据类型设置receiver
         first_in = "receiver" not in context
+        # 触发条件根据配置预先编译，配置变化后自动重建
+        matcher = get_trigger_matcher()
         # 群名匹配过程，设置session_id和receiver
         if first_in:  # context首次传入时，receiver是None，根据类型设置receiver
-            config = conf()
             cmsg = context["msg"]
             user_data = conf().get_user_data(cmsg.from_user_id)
             context["openai_api_key"] = user_data.get("openai_api_key")
@@ -55,23 +102,9 @@ class ChatChannel(Channel):
                 group_name = cmsg.other_user_nickname
                 group_id = cmsg.other_user_id
 
-                group_name_white_list = config.get("group_name_white_list", [])
-                group_name_keyword_white_list = config.get("group_name_keyword_white_list", [])
-                if any(
-                    [
-                        group_name in group_name_white_list,
-                        "ALL_GROUP" in group_name_white_list,
-                        check_contain(group_name, group_name_keyword_white_list),
-                    ]
-                ):
-                    group_chat_in_one_session = conf().get("group_chat_in_one_session", [])
+                if matcher.is_group_white(group_name):
                     session_id = cmsg.actual_user_id
-                    if any(
-                        [
-                            group_name in group_chat_in_one_session,
-                            "ALL_GROUP" in group_chat_in_one_session,
-                        ]
-                    ):
+                    if matcher.is_group_in_one_session(group_name):
                         session_id = group_id
                 else:
                     logger.debug(f"No need reply, groupName not in whitelist, group_name={group_name}")
@@ -85,7 +118,7 @@ class ChatChannel(Channel):
             context = e_context["context"]
             if e_context.is_pass() or context is None:
                 return context
-            if cmsg.from_user_id == self.user_id and not config.get("trigger_by_self", True):
+            if cmsg.from_user_id == self.user_id and not matcher.trigger_by_self:
                 logger.debug("[chat_channel]self message skipped")
                 return None
 
@@ -96,11 +129,10 @@ class ChatChannel(Channel):
                 logger.debug("[chat_channel]reference query skipped")
                 return None
 
-            nick_name_black_list = conf().get("nick_name_black_list", [])
             if context.get("isgroup", False):  # 群聊
                 # 校验关键字
-                match_prefix = check_prefix(content, conf().get("group_chat_prefix"))
-                match_contain = check_contain(content, conf().get("group_chat_keyword"))
+                match_prefix = matcher.match_prefix(matcher.group_chat_prefix, content)
+                match_contain = matcher.match_contain(matcher.group_chat_keyword, content)
                 flag = False
                 if context["msg"].to_user_id != context["msg"].actual_user_id:
                     if match_prefix is not None or match_contain is not None:
@@ -109,25 +141,22 @@ class ChatChannel(Channel):
                             content = content.replace(match_prefix, "", 1).strip()
                     if context["msg"].is_at:
                         nick_name = context["msg"].actual_user_nickname
-                        if nick_name and nick_name in nick_name_black_list:
+                        if matcher.is_nick_name_black(nick_name):
                             # 黑名单过滤
                             logger.warning(f"[chat_channel] Nickname {nick_name} in In BlackList, ignore")
                             return None
 
                         logger.info("[chat_channel]receive group at")
-                        if not conf().get("group_at_off", False):
+                        if not matcher.group_at_off:
                             flag = True
                         self.name = self.name if self.name is not None else ""  # 部分渠道self.name可能没有赋值
-                        pattern = f"@{re.escape(self.name)}(\u2005|\u0020)"
-                        subtract_res = re.sub(pattern, r"", content)
+                        subtract_res = mention_pattern(self.name).sub(r"", content)
                         if isinstance(context["msg"].at_list, list):
                             for at in context["msg"].at_list:
-                                pattern = f"@{re.escape(at)}(\u2005|\u0020)"
-                                subtract_res = re.sub(pattern, r"", subtract_res)
+                                subtract_res = mention_pattern(at).sub(r"", subtract_res)
                         if subtract_res == content and context["msg"].self_display_name:
                             # 前缀移除后没有变化，使用群昵称再次移除
-                            pattern = f"@{re.escape(context['msg'].self_display_name)}(\u2005|\u0020)"
-                            subtract_res = re.sub(pattern, r"", content)
+                            subtract_res = mention_pattern(context["msg"].self_display_name).sub(r"", content)
                         content = subtract_res
                 if not flag:
                     if context["origin_ctype"] == ContextType.VOICE:
@@ -135,12 +164,12 @@ class ChatChannel(Channel):
                     return None
             else:  # 单聊
                 nick_name = context["msg"].from_user_nickname
-                if nick_name and nick_name in nick_name_black_list:
+                if matcher.is_nick_name_black(nick_name):
                     # 黑名单过滤
                     logger.warning(f"[chat_channel] Nickname '{nick_name}' in In BlackList, ignore")
                     return None
 
-                match_prefix = check_prefix(content, conf().get("single_chat_prefix", [""]))
+                match_prefix = matcher.match_prefix(matcher.single_chat_prefix, content)
                 if match_prefix is not None:  # 判断如果匹配到自定义前缀，则返回过滤掉前缀+空格后的内容
                     content = content.replace(match_prefix, "", 1).strip()
                 elif context["origin_ctype"] == ContextType.VOICE:  # 如果源消息是私聊的语音消息，允许不匹配前缀，放宽条件
@@ -149,17 +178,17 @@ class ChatChannel(Channel):
                     logger.info("[chat_channel]receive single chat msg, but checkprefix didn't match")
                     return None
             content = content.strip()
-            img_match_prefix = check_prefix(content, conf().get("image_create_prefix",[""]))
+            img_match_prefix = matcher.match_prefix(matcher.image_create_prefix, content)
             if img_match_prefix:
                 content = content.replace(img_match_prefix, "", 1)
                 context.type = ContextType.IMAGE_CREATE
             else:
                 context.type = ContextType.TEXT
             context.content = content.strip()
-            if "desire_rtype" not in context and conf().get("always_reply_voice") and ReplyType.VOICE not in self.NOT_SUPPORT_REPLYTYPE:
+            if "desire_rtype" not in context and matcher.always_reply_voice and ReplyType.VOICE not in self.NOT_SUPPORT_REPLYTYPE:
                 context["desire_rtype"] = ReplyType.VOICE
         elif context.type == ContextType.VOICE:
-            if "desire_rtype" not in context and conf().get("voice_reply_voice") and ReplyType.VOICE not in self.NOT_SUPPORT_REPLYTYPE:
+            if "desire_rtype" not in context and matcher.voice_reply_voice and ReplyType.VOICE not in self.NOT_SUPPORT_REPLYTYPE:
                 context["desire_rtype"] = ReplyType.VOICE
         return context
 
@@ -191,7 +220,10 @@ class ChatChannel(Channel):
             logger.debug("[chat_channel] ready to handle context: type={}, content={}".format(context.type, context.content))
             if context.type == ContextType.TEXT or context.type == ContextType.IMAGE_CREATE:  # 文字和图片消息
                 context["channel"] = e_context["channel"]
-                reply = super().build_reply_content(context.content, context)
+                if self._should_stream(context):
+                    reply = self._stream_reply(context)
+                else:
+                    reply = super().build_reply_content(context.content, context)
             elif context.type == ContextType.VOICE:  # 语音消息
                 cmsg = context["msg"]
                 cmsg.prepare()
@@ -233,7 +265,275 @@ class ChatChannel(Channel):
                 return
         return reply
 
-    def _decorate_reply(self, context: Context, reply: Reply) -> Reply:
+    def _should_stream(self, context: Context) -> bool:
+        if not self.STREAM_REPLY_MODE or context.type != ContextType.TEXT:
+            return False
+        # web channel的动态模型请求由Bridge推送
+        if context.get("model_config"):
+            return False
+        config = conf_snapshot()
+        if context.get("desire_rtype") == ReplyType.VOICE:
+            # 语音回复按句合成，需要TTS引擎支持并发调用
+            return (
+                bool(config.get("stream_voice_reply", False))
+                and ReplyType.VOICE not in self.NOT_SUPPORT_REPLYTYPE
+                and getattr(Bridge().get_bot("text_to_voice"), "concurrent_synthesis", False)
+            )
+        return bool(config.get("stream_reply", False))
+
+    def _stream_reply(self, context: Context) -> Reply:
+        """
+        流式回复：边接收Bot的输出边发送，发送完成后返回None；
+        Bot不支持流式时按普通方式返回回复，需要单独发送的错误提示也作为回复返回
+        """
+        stream = super().build_reply_stream(context.content, context)
+        if stream is None:
+            return super().build_reply_content(context.content, context)
+        if isinstance(stream, Reply):
+            return stream
+        try:
+            if context.get("desire_rtype") == ReplyType.VOICE:
+                return self._stream_in_voice(context, stream)
+            card = None
+            # 卡片内容不经过ON_SEND_REPLY，有插件监听时改为分批发送
+            if self.STREAM_REPLY_MODE == "card" and not PluginManager().has_listeners(Event.ON_SEND_REPLY):
+                try:
+                    card = self._stream_card_start(context)
+                except Exception as e:
+                    logger.warning("[chat_channel] create stream card failed, send in batches: {}".format(e))
+            if card is not None:
+                return self._stream_to_card(context, stream, card)
+            return self._stream_in_batches(context, stream)
+        finally:
+            if hasattr(stream, "close"):
+                stream.close()
+
+    @staticmethod
+    def _read_stream(stream):
+        """把Bot.reply_stream的数据块统一成 (增量, 错误提示)"""
+        try:
+            for chunk in stream:
+                if isinstance(chunk, str):
+                    yield chunk, None
+                elif isinstance(chunk, dict):
+                    yield chunk.get("content") or "", chunk.get("error")
+        except Exception as e:
+            logger.exception("[chat_channel] read reply stream error: {}".format(e))
+            yield "", "我现在有点累了，等会再来吧"
+
+    def _stream_in_batches(self, context: Context, stream) -> Reply:
+        """
+        分批发送：每批发送前用到目前为止的完整内容检查插件(见_stream_check)，@和前缀只加在第一批，后缀只加在最后一批，
+        配置了后缀时留一批等后续内容，以便在最后一批加上后缀。
+        每批单独经过ON_SEND_REPLY，该事件的插件看到的是单个批次
+        """
+        config = conf_snapshot()
+        batcher = SentenceBatcher(config.get("stream_batch_min_chars", 80), config.get("stream_batch_max_chars", 500))
+        hold_last = bool(self._reply_affixes(context, config)[1])
+        rest = []  # 插件中止流式发送后还没发出的内容
+        state = {"checked": "", "held": None, "first": True, "streaming": True}
+
+        def send(batch, last):
+            text = self._format_text_reply(context, batch, config, head=state["first"], tail=last)
+            state["first"] = False
+            self._send_reply(context, Reply(ReplyType.TEXT, text))
+
+        def offer(batch):
+            if not self._stream_check(context, state["checked"], batch):
+                state["streaming"] = False
+                return
+            state["checked"] += batch
+            if state["held"] is not None:
+                send(state["held"], False)
+                state["held"] = None
+            if hold_last:
+                state["held"] = batch
+            else:
+                send(batch, False)
+
+        error = None
+        for delta, error in self._read_stream(stream):
+            self._feed_stream(batcher, delta, offer, state, rest)
+            if error:
+                break
+        if state["streaming"]:
+            last = batcher.flush()
+            if last:
+                offer(last)
+                if not state["streaming"]:
+                    rest.append(last)
+        if state["held"] is not None:
+            send(state["held"], state["streaming"])
+        if not state["streaming"]:
+            self._send_filtered_stream(context, rest)
+        if error:
+            return Reply(ReplyType.ERROR, error)
+        return None
+
+    def _stream_check(self, context: Context, checked, new) -> bool:
+        """
+        流式回复在句子边界发送前，用新内容(带上已检查内容末尾STREAM_CHECK_OVERLAP个字符)触发ON_DECORATE_REPLY，
+        插件(如敏感词过滤)的总工作量与回复长度成正比；一条流式回复会多次触发该事件
+        插件原样放行时返回True；插件修改、替换或拦截时返回False，调用方停止流式发送，剩余内容按普通回复处理(_send_filtered_stream)
+        """
+        content = checked[-STREAM_CHECK_OVERLAP:] + new
+        reply = Reply(ReplyType.TEXT, content)
+        e_context = PluginManager().emit_event(
+            EventContext(
+                Event.ON_DECORATE_REPLY,
+                {"channel": self, "context": context, "reply": reply},
+            )
+        )
+        passed = not e_context.is_pass() and e_context["reply"] is reply and reply.type == ReplyType.TEXT and reply.content == content
+        if not passed:
+            logger.info("[chat_channel] reply changed by plugin, stop streaming")
+        return passed
+
+    @staticmethod
+    def _feed_stream(batcher, delta, offer, state, rest):
+        """
+        把增量交给batcher，切出的批次依次交给offer；offer中插件中止流式发送后，
+        未通过的批次、同时切出的后续批次和之后收到的增量都记入rest
+        """
+        if not state["streaming"]:
+            rest.append(delta)
+            return
+        batches = batcher.append(delta)
+        for i, batch in enumerate(batches):
+            offer(batch)
+            if not state["streaming"]:
+                rest.extend(batches[i:])
+                rest.append(batcher.flush() or "")
+                return
+
+    def _send_filtered_stream(self, context: Context, rest):
+        """
+        流式发送被插件中止后，把还没发出的部分按普通回复装饰后发送(不再加@和前缀)，已发出的内容不重复发送；插件拦截时不再发送
+        """
+        content = "".join(rest).strip()
+        reply = self._decorate_reply(context, Reply(ReplyType.TEXT, content), head=False) if content else None
+        if reply and reply.content:
+            self._send_reply(context, reply)
+
+    def _stream_in_voice(self, context: Context, stream) -> Reply:
+        """
+        流式语音回复：每凑够一句就提交合成，多句同时合成，按顺序发送已合成的语音，
+        首条语音的等待时间约为生成第一句的时间加一次TTS调用
+        """
+        config = conf_snapshot()
+        batcher = SentenceBatcher(config.get("stream_voice_min_chars", 20), config.get("stream_batch_max_chars", 500))
+        pool = _get_tts_pool()
+        pending = deque()  # (文本, future)，按句子顺序
+        rest = []
+        state = {"checked": "", "streaming": True}
+
+        def submit(text):
+            if not self._stream_check(context, state["checked"], text):
+                state["streaming"] = False
+                return
+            state["checked"] += text
+            pending.append((text, pool.submit(self.build_text_to_voice, text)))
+
+        def send_ready(wait):
+            while pending and (wait or pending[0][1].done()):
+                text, future = pending.popleft()
+                self._send_voice_segment(context, text, future)
+
+        error = None
+        for delta, error in self._read_stream(stream):
+            self._feed_stream(batcher, delta, submit, state, rest)
+            send_ready(False)
+            if error:
+                break
+        if state["streaming"]:
+            last = batcher.flush()
+            if last:
+                submit(last)
+                if not state["streaming"]:
+                    rest.append(last)
+        send_ready(True)
+        if not state["streaming"]:
+            self._send_filtered_stream(context, rest)
+        if error:
+            return Reply(ReplyType.ERROR, error)
+        return None
+
+    def _send_voice_segment(self, context: Context, text, future):
+        try:
+            reply = future.result()
+        except Exception as e:
+            logger.warning("[chat_channel] text to voice failed: {}".format(e))
+            reply = None
+        if reply and reply.type == ReplyType.VOICE:
+            reply = self._decorate_reply(context, reply)
+            if reply and reply.content:
+                self._send_reply(context, reply)
+        else:
+            # 合成失败时发送这句的文字，不丢内容
+            logger.warning("[chat_channel] text to voice failed, send text instead: {}".format(reply))
+            self._send_reply(context, Reply(ReplyType.TEXT, text))
+
+    def _stream_to_card(self, context: Context, stream, card) -> Reply:
+        """
+        卡片接口有频率限制，按时间间隔合并更新，每次用完整内容更新。
+        卡片上只显示通过插件检查(见_stream_check)的完整句子，插件修改或拦截时停止更新，
+        卡片最终内容为插件处理后的完整回复，拦截时保留已显示的句子
+        """
+        config = conf_snapshot()
+        buffer = StreamBuffer(float("inf"), config.get("stream_card_interval", 0.5))
+        checked = ""  # 已通过插件检查的内容，是完整内容的前缀
+        streaming = True
+        error = None
+        for delta, error in self._read_stream(stream):
+            if buffer.append(delta) and streaming:
+                content = buffer.getvalue()
+                new = complete_sentences(content[len(checked) :])
+                if not new:
+                    pass
+                elif self._stream_check(context, checked, new):
+                    checked = content[: len(checked)] + new
+                    try:
+                        self._stream_card_update(card, self._format_text_reply(context, checked, config, tail=False), context)
+                    except Exception as e:
+                        logger.warning("[chat_channel] update stream card failed: {}".format(e))
+                else:
+                    streaming = False
+            if error:
+                break
+        content = buffer.getvalue()
+        new = content[len(checked) :]
+        if not content:
+            final = ""
+        elif streaming and (not new.strip() or self._stream_check(context, checked, new)):
+            final = self._format_text_reply(context, content, config)
+        else:
+            reply = self._decorate_reply(context, Reply(ReplyType.TEXT, content))
+            if reply and reply.type in (ReplyType.TEXT, ReplyType.INFO, ReplyType.ERROR) and isinstance(reply.content, str):
+                final = reply.content
+            else:
+                final = self._format_text_reply(context, checked, config) if checked else ""
+                if reply and reply.content:
+                    self._send_reply(context, reply)
+        if error:
+            final = final + "\n\n" + error if final else error
+        self._stream_card_finish(card, final, context, failed=bool(error))
+        return None
+
+    def _stream_card_start(self, context: Context):
+        """
+        卡片方式的流式回复：创建卡片并返回其句柄，返回None时改为分批发送
+        """
+        return None
+
+    def _stream_card_update(self, card, content, context: Context):
+        """用当前的完整内容更新卡片"""
+        raise NotImplementedError
+
+    def _stream_card_finish(self, card, content, context: Context, failed=False):
+        """写入最终内容并结束卡片"""
+        raise NotImplementedError
+
+    def _decorate_reply(self, context: Context, reply: Reply, head=True) -> Reply:
         if reply and reply.type:
             e_context = PluginManager().emit_event(
                 EventContext(
@@ -250,17 +550,10 @@ class ChatChannel(Channel):
                     reply.content = "不支持发送的消息类型: " + str(reply.type)
 
                 if reply.type == ReplyType.TEXT:
-                    reply_text = reply.content
                     if desire_rtype == ReplyType.VOICE and ReplyType.VOICE not in self.NOT_SUPPORT_REPLYTYPE:
                         reply = super().build_text_to_voice(reply.content)
                         return self._decorate_reply(context, reply)
-                    if context.get("isgroup", False):
-                        if not context.get("no_need_at", False):
-                            reply_text = "@" + context["msg"].actual_user_nickname + "\n" + reply_text.strip()
-                        reply_text = conf().get("group_chat_reply_prefix", "") + reply_text + conf().get("group_chat_reply_suffix", "")
-                    else:
-                        reply_text = conf().get("single_chat_reply_prefix", "") + reply_text + conf().get("single_chat_reply_suffix", "")
-                    reply.content = reply_text
+                    reply.content = self._format_text_reply(context, reply.content, conf_snapshot(), head=head)
                 elif reply.type == ReplyType.ERROR or reply.type == ReplyType.INFO:
                     reply.content = "[" + str(reply.type) + "]\n" + reply.content
                 elif reply.type == ReplyType.IMAGE_URL or reply.type == ReplyType.VOICE or reply.type == ReplyType.IMAGE or reply.type == ReplyType.FILE or reply.type == ReplyType.VIDEO or reply.type == ReplyType.VIDEO_URL:
@@ -272,6 +565,23 @@ class ChatChannel(Channel):
                 logger.warning("[chat_channel] desire_rtype: {}, but reply type: {}".format(context.get("desire_rtype"), reply.type))
             return reply
 
+    def _format_text_reply(self, context: Context, text, config, head=True, tail=True):
+        """给文本回复加上@和前缀(head)、后缀(tail)，流式分批发送时只在第一批加前缀、最后一批加后缀"""
+        prefix, suffix = self._reply_affixes(context, config)
+        if head:
+            if context.get("isgroup", False) and not context.get("no_need_at", False):
+                text = "@" + context["msg"].actual_user_nickname + "\n" + text.strip()
+            text = prefix + text
+        if tail:
+            text = text + suffix
+        return text
+
+    @staticmethod
+    def _reply_affixes(context: Context, config):
+        if context.get("isgroup", False):
+            return config.get("group_chat_reply_prefix", ""), config.get("group_chat_reply_suffix", "")
+        return config.get("single_chat_reply_prefix", ""), config.get("single_chat_reply_suffix", "")
+
     def _send_reply(self, context: Context, reply: Reply):
         if reply and reply.type:
             e_context = PluginManager().emit_event(
@@ -297,6 +607,54 @@ class ChatChannel(Channel):
                 time.sleep(3 + 3 * retry_cnt)
                 self._send(reply, context, retry_cnt + 1)
 
+    # asyncio模式下的处理流程，与_handle相同，LLM请求通过Bot.areply直接await，插件事件和发送等阻塞步骤放到线程池执行
+    async def _arun(self, task, context: Context):
+        # 已被cancel_session取消的不再处理
+        if task.start():
+            await self._ahandle(context)
+
+    async def _ahandle(self, context: Context):
+        if context is None or not context.content:
+            return
+        logger.debug("[chat_channel] ready to handle context: {}".format(context))
+        reply = await self._agenerate_reply(context)
+
+        logger.debug("[chat_channel] ready to decorate reply: {}".format(reply))
+
+        if reply and reply.content:
+            reply = await self._adecorate_reply(context, reply)
+
+            await self._asend_reply(context, reply)
+
+    async def _agenerate_reply(self, context: Context, reply: Reply = Reply()) -> Reply:
+        loop = asyncio.get_running_loop()
+        if context.type != ContextType.TEXT and context.type != ContextType.IMAGE_CREATE:
+            # 语音识别、图片缓存等非对话消息沿用同步流程
+            return await loop.run_in_executor(None, self._generate_reply, context, reply)
+        e_context = await loop.run_in_executor(
+            None,
+            PluginManager().emit_event,
+            EventContext(
+                Event.ON_HANDLE_CONTEXT,
+                {"channel": self, "context": context, "reply": reply},
+            ),
+        )
+        reply = e_context["reply"]
+        if not e_context.is_pass():
+            logger.debug("[chat_channel] ready to handle context: type={}, content={}".format(context.type, context.content))
+            context["channel"] = e_context["channel"]
+            if self._should_stream(context):
+                reply = await loop.run_in_executor(None, self._stream_reply, context)
+            else:
+                reply = await super().abuild_reply_content(context.content, context)
+        return reply
+
+    async def _adecorate_reply(self, context: Context, reply: Reply) -> Reply:
+        return await asyncio.get_running_loop().run_in_executor(None, self._decorate_reply, context, reply)
+
+    async def _asend_reply(self, context: Context, reply: Reply):
+        return await asyncio.get_running_loop().run_in_executor(None, self._send_reply, context, reply)
+
     def _success_callback(self, session_id, **kwargs):  # 线程正常结束时的回调函数
         logger.debug("Worker return success, session_id = {}".format(session_id))
 
@@ -316,70 +674,178 @@ class ChatChannel(Channel):
             except Exception as e:
                 logger.exception("Worker raise exception: {}".format(e))
             with self.lock:
-                self.sessions[session_id][1].release()
+                context_queue, semaphore = self.sessions[session_id]
+                semaphore.release()
+                if not context_queue.empty():
+                    self.ready_queue.put(session_id)  # 释放了一个并发名额，会话中还有待处理的消息，重新唤醒调度
+                elif semaphore._initial_value == semaphore._value:  # 没有排队和处理中的任务，回收会话
+                    self.futures.pop(session_id, None)
+                    del self.sessions[session_id]
 
         return func
 
     def produce(self, context: Context):
         session_id = context["session_id"]
+        is_admin_cmd = _is_admin_cmd(context)
         with self.lock:
             if session_id not in self.sessions:
                 self.sessions[session_id] = [
                     Dequeue(),
-                    threading.BoundedSemaphore(conf().get("concurrency_in_session", 4)),
+                    threading.BoundedSemaphore(conf_snapshot().get("concurrency_in_session", 4)),
                 ]
-            if context.type == ContextType.TEXT and context.content.startswith("#"):
-                self.sessions[session_id][0].putleft(context)  # 优先处理管理命令
-            else:
-                self.sessions[session_id][0].put(context)
-
-    # 消费者函数，单独线程，用于从消息队列中取出消息并处理
+            context_queue = self.sessions[session_id][0]
+            accepted = True
+            if handler_pool.is_overflow(context_queue.qsize()):
+                policy = handler_pool.overflow_policy
+                if policy == OVERFLOW_DROP_OLDEST:
+                    if handler_pool.is_session_overflow(context_queue.qsize()):
+                        dropped_session, dropped = session_id, _drop_oldest(context_queue)
+                    else:  # 全局超限，从排队最多的会话中丢弃，当前会话可能没有排队消息
+                        dropped_session, dropped = self._drop_oldest_global()
+                    if dropped is None:  # 没有可丢弃的消息，只能丢弃新消息
+                        accepted = False
+                    else:
+                        handler_pool.remove_queued()
+                        logger.warning("[chat_channel] queue overflow, drop oldest context in session {}: {}".format(dropped_session, dropped.content))
+                elif policy == OVERFLOW_SHED:
+                    accepted = is_admin_cmd  # 管理命令不受限制
+                else:
+                    accepted = False
+            if accepted:
+                if is_admin_cmd:
+                    context_queue.putleft(context)  # 优先处理管理命令
+                else:
+                    context_queue.put(context)
+                handler_pool.add_queued()
+                self.ready_queue.put(session_id)  # 每条消息对应一次唤醒，消费者无需轮询
+        if not accepted:
+            logger.warning("[chat_channel] queue overflow, {} context in session {}: {}".format(handler_pool.overflow_policy, session_id, context.content))
+            if handler_pool.overflow_policy in (OVERFLOW_REJECT, OVERFLOW_DROP_OLDEST):
+                reply = self._decorate_reply(context, Reply(ReplyType.INFO, "当前消息过多，请稍后再试"))
+                self._send_reply(context, reply)
+
+    def _drop_oldest_global(self):
+        """全局排队数超限时，从排队最多的会话中丢弃最早的非管理命令消息，排队数相同时优先较早创建的会话，需持有self.lock"""
+        queues = sorted(self.sessions.items(), key=lambda item: item[1][0].qsize(), reverse=True)
+        for session_id, (context_queue, _) in queues:
+            if context_queue.empty():
+                break
+            dropped = _drop_oldest(context_queue, keep_admin=True)
+            if dropped is not None:
+                return session_id, dropped
+        return None, None
+
+    # 消费者函数，单独线程，阻塞等待有可执行消息的会话，每条消息的调度开销为O(1)
     def consume(self):
         while True:
+            session_id = self.ready_queue.get()
             with self.lock:
-                session_ids = list(self.sessions.keys())
-            for session_id in session_ids:
-                with self.lock:
-                    context_queue, semaphore = self.sessions[session_id]
-                if semaphore.acquire(blocking=False):  # 等线程处理完毕才能删除
-                    if not context_queue.empty():
-                        context = context_queue.get()
-                        logger.debug("[chat_channel] consume context: {}".format(context))
-                        future: Future = handler_pool.submit(self._handle, context)
-                        future.add_done_callback(self._thread_pool_callback(session_id, context=context))
-                        with self.lock:
-                            if session_id not in self.futures:
-                                self.futures[session_id] = []
-                            self.futures[session_id].append(future)
-                    elif semaphore._initial_value == semaphore._value + 1:  # 除了当前，没有任务再申请到信号量，说明所有任务都处理完毕
-                        with self.lock:
-                            self.futures[session_id] = [t for t in self.futures[session_id] if not t.done()]
-                            assert len(self.futures[session_id]) == 0, "thread pool error"
-                            del self.sessions[session_id]
-                    else:
-                        semaphore.release()
-            time.sleep(0.2)
+                if session_id not in self.sessions:  # 会话已被回收，唤醒信号过期
+                    continue
+                context_queue, semaphore = self.sessions[session_id]
+                # 并发名额已满时丢弃该唤醒信号，任务结束释放名额时会重新唤醒
+                if not semaphore.acquire(blocking=False):
+                    continue
+                if context_queue.empty():  # 消息已被取消或已被之前的唤醒处理
+                    semaphore.release()
+                    if semaphore._initial_value == semaphore._value:
+                        self.futures.pop(session_id, None)
+                        del self.sessions[session_id]
+                    continue
+                context = context_queue.get()
+                handler_pool.remove_queued()
+            logger.debug("[chat_channel] consume context: {}".format(context))
+            if self.async_pipeline:
+                task = _AsyncTask()
+                future: Future = asyncio.run_coroutine_threadsafe(self._arun(task, context), _get_event_loop())
+                future.task = task
+            else:
+                future: Future = handler_pool.submit(self._handle, context)
+            with self.lock:
+                if session_id not in self.futures:
+                    self.futures[session_id] = []
+                self.futures[session_id] = [t for t in self.futures[session_id] if not t.done()]
+                self.futures[session_id].append(future)
+            future.add_done_callback(self._thread_pool_callback(session_id, context=context))
 
-    # 取消session_id对应的所有任务，只能取消排队的消息和已提交线程池但未执行的任务
+    # 取消session_id对应的所有任务，只能取消排队的消息和已提交但未开始执行的任务，正在处理的消息(包括发出重置命令的这条)不受影响
     def cancel_session(self, session_id):
+        futures = []
         with self.lock:
             if session_id in self.sessions:
-                for future in self.futures[session_id]:
-                    future.cancel()
+                futures = self.futures.get(session_id, [])
                 cnt = self.sessions[session_id][0].qsize()
                 if cnt > 0:
                     logger.info("Cancel {} messages in session {}".format(cnt, session_id))
+                    handler_pool.remove_queued(cnt)
                 self.sessions[session_id][0] = Dequeue()
+        # future被取消时会同步执行回调，回调中需要获取lock，因此在锁外取消
+        for future in futures:
+            _cancel_future(future)
 
     def cancel_all_session(self):
+        futures = []
         with self.lock:
             for session_id in self.sessions:
-                for future in self.futures[session_id]:
-                    future.cancel()
+                futures.extend(self.futures.get(session_id, []))
                 cnt = self.sessions[session_id][0].qsize()
                 if cnt > 0:
                     logger.info("Cancel {} messages in session {}".format(cnt, session_id))
+                    handler_pool.remove_queued(cnt)
                 self.sessions[session_id][0] = Dequeue()
+        for future in futures:
+            _cancel_future(future)
+
+
+class _AsyncTask(object):
+    """
+    asyncio模式下提交的消息的状态
+    run_coroutine_threadsafe返回的future在协程执行期间一直是PENDING，cancel()会中断正在执行的协程，
+    因此自行记录是否已开始，只取消还没开始的
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.started = False
+        self.cancelled = False
+
+    def start(self):
+        with self.lock:
+            if self.cancelled:
+                return False
+            self.started = True
+            return True
+
+    def cancel(self):
+        with self.lock:
+            if self.started:
+                return False
+            self.cancelled = True
+            return True
+
+
+def _cancel_future(future: Future):
+    task = getattr(future, "task", None)
+    if task is not None and not task.cancel():
+        return
+    future.cancel()
+
+
+def _is_admin_cmd(context: Context):
+    return context.type == ContextType.TEXT and context.content.startswith("#")
+
+
+def _drop_oldest(context_queue: Dequeue, keep_admin=False):
+    """丢弃队列中最早的非管理命令消息，都是管理命令时丢弃队首(keep_admin为True时不丢弃)，没有可丢弃的消息返回None"""
+    with context_queue.mutex:
+        items = context_queue.queue
+        if not items:
+            return None
+        for i, item in enumerate(items):
+            if not _is_admin_cmd(item):
+                del items[i]
+                return item
+        return None if keep_admin else items.popleft()
 
 
 def check_prefix(content, prefix_list):
@@ -15,6 +15,7 @@ from dingtalk_stream import AckMessage
 from dingtalk_stream.card_replier import AICardReplier
 from dingtalk_stream.card_replier import AICardStatus
 from dingtalk_stream.card_replier import CardReplier
+from dingtalk_stream.card_instance import AIMarkdownCardInstance
 
 from bridge.context import Context, ContextType
 from bridge.reply import Reply, ReplyType
@@ -85,6 +86,8 @@ def _check(func):
 class DingTalkChanel(ChatChannel, dingtalk_stream.ChatbotHandler):
     dingtalk_client_id = conf().get('dingtalk_client_id')
     dingtalk_client_secret = conf().get('dingtalk_client_secret')
+    # 开启dingtalk_card_enabled时流式更新AI卡片，否则分批发送
+    STREAM_REPLY_MODE = "card"
 
     def setup_logger(self):
         logger = logging.getLogger()
@@ -100,7 +103,7 @@ class DingTalkChanel(ChatChannel, dingtalk_stream.ChatbotHandler):
         super(dingtalk_stream.ChatbotHandler, self).__init__()
         self.logger = self.setup_logger()
         # 历史消息id暂存，用于幂等控制
-        self.receivedMsgs = ExpiredDict(conf().get("expires_in_seconds", 3600))
+        self.receivedMsgs = ExpiredDict(conf().get("expires_in_seconds", 3600), refresh_on_read=False)
         logger.info("[DingTalk] client_id={}, client_secret={} ".format(
             self.dingtalk_client_id, self.dingtalk_client_secret))
         # 无需群校验和前缀
@@ -200,6 +203,24 @@ class DingTalkChanel(ChatChannel, dingtalk_stream.ChatbotHandler):
             self.reply_text(reply.content, incoming_message)
 
 
+    def _stream_card_start(self, context: Context):
+        if not conf().get("dingtalk_card_enabled"):
+            return None
+        incoming_message = context.kwargs['msg'].incoming_message
+        card = AIMarkdownCardInstance(self.dingtalk_client, incoming_message)
+        card.set_title_and_logo("📌 内容由AI生成", "")
+        card.ai_start(recipients=[incoming_message.sender_staff_id])
+        return card
+
+    def _stream_card_update(self, card, content, context: Context):
+        card.ai_streaming(markdown=content, append=False)
+
+    def _stream_card_finish(self, card, content, context: Context, failed=False):
+        logger.info("[Dingtalk] stream card finished, content={}".format(content))
+        card.ai_finish(markdown=content, button_list=[], tips="")
+        if context.kwargs['msg'].is_group:
+            self.reply_text("📢 您有一条新的消息，请查看。", context.kwargs['msg'].incoming_message)
+
     def generate_button_markdown_content(self, context, reply):
         image_url = context.kwargs.get("image_url")
         promptEn = context.kwargs.get("promptEn")
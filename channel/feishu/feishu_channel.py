@@ -19,6 +19,7 @@ from config import conf
 from common.expired_dict import ExpiredDict
 from bridge.context import ContextType
 from channel.chat_channel import ChatChannel, check_prefix
+from channel import http_server
 from common import utils
 import json
 import os
@@ -31,11 +32,13 @@ class FeiShuChanel(ChatChannel):
     feishu_app_id = conf().get('feishu_app_id')
     feishu_app_secret = conf().get('feishu_app_secret')
     feishu_token = conf().get('feishu_token')
+    # 开启stream_reply时通过更新消息卡片流式输出
+    STREAM_REPLY_MODE = "card"
 
     def __init__(self):
         super().__init__()
         # 历史消息id暂存，用于幂等控制
-        self.receivedMsgs = ExpiredDict(60 * 60 * 7.1)
+        self.receivedMsgs = ExpiredDict(60 * 60 * 7.1, refresh_on_read=False)
         logger.info("[FeiShu] app_id={}, app_secret={} verification_token={}".format(
             self.feishu_app_id, self.feishu_app_secret, self.feishu_token))
         # 无需群校验和前缀
@@ -48,19 +51,11 @@ class FeiShuChanel(ChatChannel):
         )
         app = web.application(urls, globals(), autoreload=False)
         port = conf().get("feishu_port", 9891)
-        web.httpserver.runsimple(app.wsgifunc(), ("0.0.0.0", port))
+        http_server.serve(app.wsgifunc(), port, "feishu")
 
     def send(self, reply: Reply, context: Context):
-        msg = context.get("msg")
-        is_group = context["isgroup"]
-        if msg:
-            access_token = msg.access_token
-        else:
-            access_token = self.fetch_access_token()
-        headers = {
-            "Authorization": "Bearer " + access_token,
-            "Content-Type": "application/json",
-        }
+        access_token = self._access_token(context)
+        headers = self._build_headers(access_token)
         msg_type = "text"
         logger.info(f"[FeiShu] start send reply message, type={context.type}, content={reply.content}")
         reply_content = reply.content
@@ -73,12 +68,32 @@ class FeiShuChanel(ChatChannel):
                 return
             msg_type = "image"
             content_key = "image_key"
-        if is_group:
+        res = self._post_message(context, headers, msg_type, json.dumps({content_key: reply_content}))
+        if res.get("code") == 0:
+            logger.info(f"[FeiShu] send message success")
+        else:
+            logger.error(f"[FeiShu] send message failed, code={res.get('code')}, msg={res.get('msg')}")
+
+    def _access_token(self, context: Context):
+        msg = context.get("msg")
+        if msg:
+            return msg.access_token
+        return self.fetch_access_token()
+
+    @staticmethod
+    def _build_headers(access_token):
+        return {
+            "Authorization": "Bearer " + access_token,
+            "Content-Type": "application/json",
+        }
+
+    def _post_message(self, context: Context, headers, msg_type, content):
+        if context["isgroup"]:
             # 群聊中直接回复
-            url = f"https://open.feishu.cn/open-apis/im/v1/messages/{msg.msg_id}/reply"
+            url = f"https://open.feishu.cn/open-apis/im/v1/messages/{context.get('msg').msg_id}/reply"
             data = {
                 "msg_type": msg_type,
-                "content": json.dumps({content_key: reply_content})
+                "content": content
             }
             res = requests.post(url=url, headers=headers, json=data, timeout=(5, 10))
         else:
@@ -87,14 +102,36 @@ class FeiShuChanel(ChatChannel):
             data = {
                 "receive_id": context.get("receiver"),
                 "msg_type": msg_type,
-                "content": json.dumps({content_key: reply_content})
+                "content": content
             }
             res = requests.post(url=url, headers=headers, params=params, json=data, timeout=(5, 10))
-        res = res.json()
-        if res.get("code") == 0:
-            logger.info(f"[FeiShu] send message success")
-        else:
-            logger.error(f"[FeiShu] send message failed, code={res.get('code')}, msg={res.get('msg')}")
+        return res.json()
+
+    @staticmethod
+    def _markdown_card(content):
+        return json.dumps({
+            "config": {"wide_screen_mode": True, "update_multi": True},
+            "elements": [{"tag": "markdown", "content": content}]
+        })
+
+    def _stream_card_start(self, context: Context):
+        # 先发送一张消息卡片，之后通过更新卡片内容实现流式输出
+        headers = self._build_headers(self._access_token(context))
+        res = self._post_message(context, headers, "interactive", self._markdown_card("..."))
+        if res.get("code") != 0:
+            logger.warning(f"[FeiShu] send stream card failed, code={res.get('code')}, msg={res.get('msg')}")
+            return None
+        return {"message_id": res["data"]["message_id"], "headers": headers}
+
+    def _stream_card_update(self, card, content, context: Context):
+        url = f"https://open.feishu.cn/open-apis/im/v1/messages/{card['message_id']}"
+        res = requests.patch(url=url, headers=card["headers"], json={"content": self._markdown_card(content)}, timeout=(5, 10)).json()
+        if res.get("code") != 0:
+            logger.warning(f"[FeiShu] update stream card failed, code={res.get('code')}, msg={res.get('msg')}")
+
+    def _stream_card_finish(self, card, content, context: Context, failed=False):
+        logger.info(f"[FeiShu] stream card finished, content={content}")
+        self._stream_card_update(card, content, context)
 
 
     def fetch_access_token(self) -> str:
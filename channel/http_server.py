@@ -0,0 +1,116 @@
+# encoding:utf-8
+
+"""
+web、飞书、公众号、企业微信等需要监听HTTP端口的channel共用的HTTP服务
+
+替代 web.httpserver.runsimple(默认10个线程的开发服务器):
+- 基于web.py自带依赖的cheroot，线程数、等待处理的连接数有上限，压力大时排队而不是无限创建线程
+- 支持HTTP/1.1 keep-alive，空闲连接超时后关闭
+- 限制请求体大小，超过时直接返回413
+- 收到SIGINT/SIGTERM时停止接收新连接，等待处理中的请求完成(最多http_shutdown_timeout秒)后退出
+- 访问日志可以通过http_access_log开关，写入common.log的日志队列，不阻塞处理请求的线程
+"""
+
+import threading
+import time
+
+from common.log import logger
+from config import conf
+
+_servers = []
+_servers_lock = threading.Lock()
+
+
+class AccessLogMiddleware(object):
+    """记录 方法 路径 状态码 响应字节数 耗时，在响应发送完成后记录"""
+
+    def __init__(self, app, name):
+        self.app = app
+        self.name = name
+
+    def __call__(self, environ, start_response):
+        start = time.perf_counter()
+        status_holder = []
+
+        def _start_response(status, headers, exc_info=None):
+            status_holder.append(status)
+            return start_response(status, headers, exc_info)
+
+        result = self.app(environ, _start_response)
+        return self._iterate(result, environ, status_holder, start)
+
+    def _iterate(self, result, environ, status_holder, start):
+        size = 0
+        try:
+            for data in result:
+                size += len(data)
+                yield data
+        finally:
+            if hasattr(result, "close"):
+                result.close()
+            logger.info(
+                "[%s] %s %s %s %s %d %.1fms",
+                self.name,
+                environ.get("REMOTE_ADDR", "-"),
+                environ.get("REQUEST_METHOD"),
+                environ.get("PATH_INFO"),
+                status_holder[0].split(" ", 1)[0] if status_holder else "-",
+                size,
+                (time.perf_counter() - start) * 1000,
+            )
+
+
+def create_server(wsgi_app, port, name="http", host="0.0.0.0"):
+    """按配置创建服务，不启动"""
+    from cheroot import wsgi
+
+    config = conf()
+    if config.get("http_access_log", False):
+        wsgi_app = AccessLogMiddleware(wsgi_app, name)
+    threads = config.get("http_server_threads", 64)
+    server = wsgi.Server(
+        (host, port),
+        wsgi_app,
+        numthreads=threads,
+        max=threads,
+        server_name=name,
+        request_queue_size=config.get("http_request_queue_size", 128),
+        timeout=config.get("http_keepalive_timeout", 10),
+        shutdown_timeout=config.get("http_shutdown_timeout", 5),
+        accepted_queue_size=config.get("http_accepted_queue_size", 256),
+    )
+    server.nodelay = True
+    server.max_request_body_size = config.get("http_max_body_size", 10 * 1024 * 1024)
+    return server
+
+
+def serve(wsgi_app, port, name="http", host="0.0.0.0"):
+    """
+    启动HTTP服务并阻塞当前线程，用于channel的startup
+    :param wsgi_app: WSGI应用，web.py的app可传入app.wsgifunc()
+    """
+    server = create_server(wsgi_app, port, name, host)
+    with _servers_lock:
+        _servers.append(server)
+    logger.info("[%s] http server listening on %s:%s, threads=%s", name, host, port, server.requests.min)
+    try:
+        server.start()
+    except (KeyboardInterrupt, SystemExit):
+        logger.info("[%s] http server shutting down", name)
+        stop(server)
+        raise
+    finally:
+        with _servers_lock:
+            if server in _servers:
+                _servers.remove(server)
+
+
+def stop(server=None):
+    """停止指定的服务，不传时停止所有服务"""
+    with _servers_lock:
+        servers = [server] if server is not None else list(_servers)
+    for s in servers:
+        try:
+            s.stop()
+        except Exception as e:
+            logger.warning("[http] stop server error: {}".format(e))
@@ -28,6 +28,7 @@ class TerminalMessage(ChatMessage):
 
 class TerminalChannel(ChatChannel):
     NOT_SUPPORT_REPLYTYPE = [ReplyType.VOICE]
+    STREAM_REPLY_MODE = "batch"
 
     def send(self, reply: Reply, context: Context):
         print("\nBot:")
@@ -0,0 +1,105 @@
+"""
+消息触发条件匹配
+
+ChatChannel._compose_context 需要的配置项(群白名单、前缀、关键词、昵称黑名单等)在这里预先编译:
+- 群名、昵称名单转为set，按成员查找
+- 前缀列表编译为一个锚定在开头的正则，按列表顺序返回第一个匹配的前缀，与逐个startswith的结果一致
+- 关键词列表编译为一个正则，一次search判断是否包含任意关键词
+- @某人 的正则按名称缓存
+根据配置快照(ConfigSnapshot)编译，配置被修改或重新加载时通过配置变化回调重新编译。
+"""
+
+import re
+from functools import lru_cache
+
+from config import add_config_listener, conf_snapshot
+
+
+def _compile_prefix(prefix_list):
+    if not prefix_list:
+        return None
+    return re.compile("|".join(re.escape(prefix) for prefix in prefix_list))
+
+
+def _compile_contain(keyword_list):
+    if not keyword_list:
+        return None
+    return re.compile("|".join(re.escape(keyword) for keyword in keyword_list))
+
+
+@lru_cache(maxsize=4096)
+def mention_pattern(name):
+    """匹配 @name 加上空格的正则，微信中@名称后面跟的是\u2005"""
+    return re.compile(f"@{re.escape(name)}(\u2005|\u0020)")
+
+
+class TriggerMatcher(object):
+    def __init__(self, snapshot):
+        self.snapshot = snapshot
+
+        group_name_white_list = snapshot.get("group_name_white_list", [])
+        self.all_group_white = "ALL_GROUP" in group_name_white_list
+        self.group_name_white_set = frozenset(group_name_white_list)
+        self.group_name_keyword = _compile_contain(snapshot.get("group_name_keyword_white_list", []))
+
+        group_chat_in_one_session = snapshot.get("group_chat_in_one_session", [])
+        self.all_group_in_one_session = "ALL_GROUP" in group_chat_in_one_session
+        self.group_chat_in_one_session_set = frozenset(group_chat_in_one_session)
+
+        self.nick_name_black_set = frozenset(snapshot.get("nick_name_black_list", []))
+        self.group_chat_prefix = _compile_prefix(snapshot.get("group_chat_prefix"))
+        self.group_chat_keyword = _compile_contain(snapshot.get("group_chat_keyword"))
+        self.single_chat_prefix = _compile_prefix(snapshot.get("single_chat_prefix", [""]))
+        self.image_create_prefix = _compile_prefix(snapshot.get("image_create_prefix", [""]))
+
+        self.trigger_by_self = snapshot.get("trigger_by_self", True)
+        self.group_at_off = snapshot.get("group_at_off", False)
+        self.always_reply_voice = snapshot.get("always_reply_voice")
+        self.voice_reply_voice = snapshot.get("voice_reply_voice")
+
+    def is_group_white(self, group_name):
+        if self.all_group_white or group_name in self.group_name_white_set:
+            return True
+        return self.group_name_keyword is not None and group_name is not None and self.group_name_keyword.search(group_name) is not None
+
+    def is_group_in_one_session(self, group_name):
+        return self.all_group_in_one_session or group_name in self.group_chat_in_one_session_set
+
+    def is_nick_name_black(self, nick_name):
+        return bool(nick_name) and nick_name in self.nick_name_black_set
+
+    @staticmethod
+    def match_prefix(pattern, content):
+        """返回匹配到的前缀，没有匹配返回None"""
+        if pattern is None:
+            return None
+        m = pattern.match(content)
+        return m.group() if m else None
+
+    @staticmethod
+    def match_contain(pattern, content):
+        """包含任意关键词时返回True，否则返回None"""
+        if pattern is None or pattern.search(content) is None:
+            return None
+        return True
+
+
+_matcher = None
+
+
+def get_trigger_matcher() -> TriggerMatcher:
+    global _matcher
+    snapshot = conf_snapshot()
+    matcher = _matcher
+    if matcher is None or matcher.snapshot is not snapshot:
+        # 并发时可能重复编译，结果相同，直接覆盖即可
+        matcher = TriggerMatcher(snapshot)
+        _matcher = matcher
+    return matcher
+
+
+@add_config_listener
+def _on_config_change(snapshot):
+    # 配置变化后立即重新编译，避免由下一条消息承担编译开销
+    global _matcher
+    _matcher = TriggerMatcher(snapshot)
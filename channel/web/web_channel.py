@@ -3,11 +3,15 @@ import time
 import web
 import json
 import uuid
+import itertools
 from queue import Queue, Empty
 from bridge.context import *
 from bridge.reply import Reply, ReplyType
+from channel import http_server
 from channel.chat_channel import ChatChannel, check_prefix
 from channel.chat_message import ChatMessage
+from common.dequeue import Dequeue
+from common.expired_dict import ExpiredDict
 from common.log import logger
 from common.singleton import singleton
 from config import conf
@@ -17,6 +21,14 @@ import mimetypes  # 添加这行来处理MIME类型
 import threading
 import logging
 
+# 等待回复时检查自己是否仍是会话当前接收方的间隔秒数
+SUBSCRIBER_CHECK_INTERVAL = 1
+
+
+class _Superseded(Exception):
+    """会话有了新的接收方(新的SSE连接或/poll)，旧的接收方不再取回复"""
+
+
 class WebMessage(ChatMessage):
     def __init__(
         self,
@@ -48,10 +60,24 @@ class WebChannel(ChatChannel):
     def __init__(self):
         super().__init__()
         self.msg_id_counter = 0  # 添加消息ID计数器
-        self.session_queues = {}  # 存储session_id到队列的映射
-        self.stream_queues = {}  # 存储request_id到流式数据队列的映射
+        # 以下映射超过web_session_timeout秒未被访问则自动清理，浏览器关闭后不会一直占用内存
+        expires = conf().get("web_session_timeout", 3600)
+        self.session_queues = ExpiredDict(expires)  # 存储session_id到队列的映射
+        self.stream_queues = ExpiredDict(expires)  # 存储request_id到流式数据队列的映射
         self.prompt_processor = PromptProcessor()  # 初始化提示词处理器
-        self.request_to_session = {}  # 存储request_id到session_id的映射
+        self.request_to_session = ExpiredDict(expires)  # 存储request_id到session_id的映射
+        # 会话当前的接收方，浏览器重连后旧的SSE连接可能还在等待，只有最新的接收方能取走回复
+        self.session_subscribers = ExpiredDict(expires)
+        self._subscriber_seq = itertools.count()
+        self._queues_lock = threading.Lock()
+        self.poll_timeout = conf().get("web_poll_timeout", 25)  # 长轮询最长等待秒数
+        # 每个SSE连接一直占用一个HTTP线程，数量需要低于线程数，给/message等请求留出线程
+        threads = conf().get("http_server_threads", 64)
+        self.sse_max_connections = conf().get("web_sse_max_connections", 48)
+        if self.sse_max_connections >= threads:
+            logger.warning("[WebChannel] web_sse_max_connections={} should be less than http_server_threads={}".format(self.sse_max_connections, threads))
+            self.sse_max_connections = threads * 3 // 4
+        self._sse_connections = 0
         # web channel无需前缀
         conf()["single_chat_prefix"] = [""]
 
@@ -65,6 +91,69 @@ class WebChannel(ChatChannel):
         """生成唯一的请求ID"""
         return str(uuid.uuid4())
 
+    def _get_session_queue(self, session_id, create=False):
+        """获取会话队列并刷新过期时间，create为True时不存在则创建"""
+        queue = self.session_queues.get(session_id)
+        if queue is None and create:
+            with self._queues_lock:
+                queue = self.session_queues.get(session_id)
+                if queue is None:
+                    queue = Dequeue()
+                    self.session_queues[session_id] = queue
+        return queue
+
+    def _subscribe(self, session_id):
+        """登记为会话当前的接收方，返回token"""
+        token = next(self._subscriber_seq)
+        self.session_subscribers[session_id] = token
+        return token
+
+    def _take_response(self, session_id, session_queue, token, timeout):
+        """
+        以接收方token的身份取一条回复，最多等待timeout秒，超时返回None
+        按短时间片等待，每次醒来和取到回复后检查是否仍是当前接收方，不是时把回复放回队首并抛出_Superseded，
+        已断开但还在等待的SSE连接不会拿走新连接的回复
+        """
+        deadline = time.monotonic() + timeout
+        while True:
+            if self.session_subscribers.peek(session_id) != token:
+                raise _Superseded()
+            remaining = deadline - time.monotonic()
+            try:
+                response = session_queue.get(timeout=max(0, min(SUBSCRIBER_CHECK_INTERVAL, remaining)))
+            except Empty:
+                if remaining <= SUBSCRIBER_CHECK_INTERVAL:
+                    return None
+                continue
+            if self.session_subscribers.peek(session_id) != token:
+                session_queue.putleft(response)
+                raise _Superseded()
+            return response
+
+    def _get_stream_queue(self, request_id, create=False):
+        queue = self.stream_queues.get(request_id)
+        if queue is None and create:
+            with self._queues_lock:
+                queue = self.stream_queues.get(request_id)
+                if queue is None:
+                    queue = Queue()
+                    self.stream_queues[request_id] = queue
+                    logger.debug("Created stream queue for request %s", request_id)
+        return queue
+
+    @staticmethod
+    def _format_response(response):
+        """/poll和/events返回的回复格式"""
+        return {
+            "status": "success" if response["type"] != "ERROR" else False,
+            "has_content": True if response["type"] != "ERROR" else False,
+            "content": response["content"],
+            "token_usage": response["token_usage"],
+            "session_id": response["session_id"],
+            "request_id": response["request_id"],
+            "timestamp": response["timestamp"],
+        }
+
     def _extract_latest_user_message(self, messages):
         """从messages列表中提取最新的用户消息"""
         if not messages:
@@ -100,7 +189,8 @@ class WebChannel(ChatChannel):
                 return
             
             # 检查是否有会话队列
-            if session_id in self.session_queues:
+            session_queue = self._get_session_queue(session_id)
+            if session_queue is not None:
                 # 创建响应数据，包含请求ID以区分不同请求的响应
                 response_data = {
                     "type": str(reply.type),
@@ -110,8 +200,8 @@ class WebChannel(ChatChannel):
                     "request_id":request_id,
                     "session_id": session_id
                 }
-                self.session_queues[session_id].put(response_data)
-                logger.debug(f"Response sent to queue for session {session_id}, request {request_id}")
+                session_queue.put(response_data)
+                logger.debug("Response sent to queue for session %s, request %s", session_id, request_id)
             else:
                 logger.warning(f"No response queue found for session {session_id}, response dropped")
             
@@ -133,17 +223,15 @@ class WebChannel(ChatChannel):
                 return
             
             # 确保流队列存在
-            if request_id not in self.stream_queues:
-                self.stream_queues[request_id] = Queue()
-                logger.debug(f"Created stream queue for request {request_id}")
+            stream_queue = self._get_stream_queue(request_id, create=True)
             
             # 添加时间戳和请求ID
             chunk_data["timestamp"] = time.time()
             chunk_data["request_id"] = request_id
             
             # 将数据块放入流队列
-            self.stream_queues[request_id].put(chunk_data)
-            logger.debug(f"Chunk sent to stream queue for request {request_id}: {chunk_data.get('content', '')[:50]}...")
+            stream_queue.put(chunk_data)
+            logger.debug("Chunk sent to stream queue for request %s: %.50s", request_id, chunk_data.get("content", ""))
             
         except Exception as e:
             logger.error(f"Error in send_chunk method: {e}")
@@ -175,9 +263,10 @@ class WebChannel(ChatChannel):
                 end_signal.update(final_data)
             
             # 发送结束信号
-            if request_id in self.stream_queues:
-                self.stream_queues[request_id].put(end_signal)
-                logger.debug(f"Stream end signal sent for request {request_id}")
+            stream_queue = self._get_stream_queue(request_id)
+            if stream_queue is not None:
+                stream_queue.put(end_signal)
+                logger.debug("Stream end signal sent for request %s", request_id)
             
         except Exception as e:
             logger.error(f"Error in send_stream_end method: {e}")
@@ -200,7 +289,8 @@ class WebChannel(ChatChannel):
                 
                 # 应用提示词处理管道
                 processed_messages = self.prompt_processor.process_full_pipeline(original_messages)
-                logger.info(f"[WebChannel] 处理后的messages: {json.dumps(processed_messages, ensure_ascii=False, indent=2)}")
+                if logger.isEnabledFor(logging.DEBUG):
+                    logger.debug("[WebChannel] 处理后的messages: %s", json.dumps(processed_messages, ensure_ascii=False))
                 
                 model_config = {
                     'model': json_data.get('model'),
@@ -227,13 +317,11 @@ class WebChannel(ChatChannel):
             self.request_to_session[request_id] = session_id
             
             # 确保会话队列存在（非流式模式需要）
-            if session_id not in self.session_queues:
-                self.session_queues[session_id] = Queue()
+            self._get_session_queue(session_id, create=True)
             
             # 为流式请求创建流队列
             if stream_enabled:
-                self.stream_queues[request_id] = Queue()
-                logger.debug(f"Created stream queue for request {request_id}")
+                self._get_stream_queue(request_id, create=True)
             
             # 创建消息对象
             msg = WebMessage(self._generate_msg_id(), prompt)
@@ -274,6 +362,8 @@ class WebChannel(ChatChannel):
     def poll_response(self):
         """
         Poll for responses using the session_id.
+        请求中带timeout(秒)时为长轮询，队列为空时最多等待timeout秒(不超过web_poll_timeout)，有回复立即返回；
+        不带timeout时保持原来的非阻塞行为
         """
         try:
             # 不记录轮询请求的日志
@@ -282,34 +372,71 @@ class WebChannel(ChatChannel):
             data = web.data()
             json_data = json.loads(data)
             session_id = json_data.get('session_id')
-            
-            if not session_id or session_id not in self.session_queues:
+            session_queue = self._get_session_queue(session_id) if session_id else None
+            if session_queue is None:
                 return json.dumps({"status": "error", "message": "Invalid session ID"})
+            timeout = min(float(json_data.get('timeout') or 0), self.poll_timeout)
             
-            # 尝试从队列获取响应，不等待
             try:
-                # 使用peek而不是get，这样如果前端没有成功处理，下次还能获取到
-                response = self.session_queues[session_id].get(block=False)
-                
-                # 返回响应，包含请求ID以区分不同请求
-                return json.dumps({
-                    "status": "success" if response["type"] != "ERROR" else False, 
-                    "has_content": True if response["type"] != "ERROR" else False,
-                    "content": response["content"],
-                    "token_usage": response["token_usage"],
-                    "session_id": response["session_id"],
-                    "request_id": response["request_id"],
-                    "timestamp": response["timestamp"]
-                })
-                
-            except Empty:
+                response = self._take_response(session_id, session_queue, self._subscribe(session_id), timeout)
+            except _Superseded:
+                response = None
+            if response is None:
                 # 没有新响应
                 return json.dumps({"status": "success", "has_content": False})
+            # 返回响应，包含请求ID以区分不同请求
+            return json.dumps(self._format_response(response))
                 
         except Exception as e:
             logger.error(f"Error polling response: {e}")
             return json.dumps({"status": "false", "message": str(e)})
 
+    def session_events(self, session_id):
+        """
+        按会话推送回复的SSE接口，数据格式与/poll相同，回复产生后立即推送，浏览器无需轮询
+        空闲时每web_poll_timeout秒发送一次注释行作为心跳，同时刷新会话的过期时间
+        """
+        web.header('Content-Type', 'text/event-stream; charset=utf-8')
+        web.header('Cache-Control', 'no-cache')
+        web.header('Connection', 'keep-alive')
+        web.header('X-Accel-Buffering', 'no')  # 关闭nginx等反向代理的缓冲
+        web.ctx.log_request = False
+        if not session_id:
+            yield f"data: {json.dumps({'status': 'error', 'message': 'Invalid session ID'})}\n\n"
+            return
+        with self._queues_lock:
+            accepted = self._sse_connections < self.sse_max_connections
+            if accepted:
+                self._sse_connections += 1
+        if not accepted:
+            # 非200响应会让EventSource关闭连接，页面随后改用/poll
+            logger.warning(f"[WebChannel] too many event streams ({self.sse_max_connections}), reject session {session_id}")
+            web.ctx.status = '503 Service Unavailable'
+            yield f"data: {json.dumps({'status': 'error', 'message': 'Too many event streams'})}\n\n"
+            return
+        try:
+            yield from self._session_events(session_id)
+        finally:
+            with self._queues_lock:
+                self._sse_connections -= 1
+
+    def _session_events(self, session_id):
+        token = self._subscribe(session_id)
+        yield f"retry: 3000\ndata: {json.dumps({'event': 'connected', 'session_id': session_id})}\n\n"
+        while True:
+            # 每次都重新获取，刷新会话的过期时间；页面刚打开、还没有发送消息时也可以订阅
+            session_queue = self._get_session_queue(session_id, create=True)
+            self.session_subscribers.get(session_id)  # 刷新过期时间
+            try:
+                response = self._take_response(session_id, session_queue, token, self.poll_timeout)
+            except _Superseded:
+                # 浏览器已重连或改用/poll，结束旧连接
+                return
+            if response is None:
+                yield ": ping\n\n"
+                continue
+            yield f"data: {json.dumps(self._format_response(response), ensure_ascii=False)}\n\n"
+
     def stream_response(self, request_id):
         """
         处理SSE流式响应
@@ -326,7 +453,8 @@ class WebChannel(ChatChannel):
             web.header('Access-Control-Allow-Headers', 'Cache-Control')
             
             # 检查流队列是否存在
-            if request_id not in self.stream_queues:
+            stream_queue = self._get_stream_queue(request_id)
+            if stream_queue is None:
                 logger.warning(f"Stream queue not found for request {request_id}")
                 yield f"data: {json.dumps({'error': 'Stream not found'}, ensure_ascii=False)}\n\n"
                 return
@@ -337,7 +465,6 @@ class WebChannel(ChatChannel):
             yield f"data: {json.dumps({'event': 'connected', 'request_id': request_id}, ensure_ascii=False)}\n\n"
             
             # 持续从流队列获取数据
-            stream_queue = self.stream_queues[request_id]
             timeout = 30  # 30秒超时
             
             while True:
@@ -368,9 +495,8 @@ class WebChannel(ChatChannel):
                     break
             
             # 清理流队列
-            if request_id in self.stream_queues:
-                del self.stream_queues[request_id]
-                logger.debug(f"Cleaned up stream queue for request {request_id}")
+            self.stream_queues.pop(request_id, None)
+            logger.debug("Cleaned up stream queue for request %s", request_id)
                 
         except Exception as e:
             logger.error(f"Error in stream_response for request {request_id}: {e}")
@@ -404,25 +530,18 @@ class WebChannel(ChatChannel):
             '/', 'RootHandler',  # 添加根路径处理器
             '/message', 'MessageHandler',
             '/poll', 'PollHandler',  # 添加轮询处理器
+            '/events/(.*)', 'EventsHandler',  # 按会话推送回复(SSE)
             '/chat', 'ChatHandler',
             '/stream/(.*)', 'StreamHandler',  # 添加流式处理器
             '/assets/(.*)', 'AssetsHandler',  # 匹配 /assets/任何路径
         )
         app = web.application(urls, globals(), autoreload=False)
         
-        # 禁用web.py的默认日志输出
-        import io
-        from contextlib import redirect_stdout
-        
         # 配置web.py的日志级别为ERROR，只显示错误
         logging.getLogger("web").setLevel(logging.ERROR)
         
-        # 禁用web.httpserver的日志
-        logging.getLogger("web.httpserver").setLevel(logging.ERROR)
-        
-        # 临时重定向标准输出，捕获web.py的启动消息
-        with redirect_stdout(io.StringIO()):
-            web.httpserver.runsimple(app.wsgifunc(), ("0.0.0.0", port))
+        # 访问日志由http_access_log控制
+        http_server.serve(app.wsgifunc(), port, "web")
 
 
 class RootHandler:
@@ -441,6 +560,11 @@ class PollHandler:
         return WebChannel().poll_response()
 
 
+class EventsHandler:
+    def GET(self, session_id):
+        return WebChannel().session_events(session_id)
+
+
 class StreamHandler:
     def GET(self, request_id):
         """处理SSE流式响应"""
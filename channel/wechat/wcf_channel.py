@@ -26,6 +26,7 @@ from wcferry import Wcf, WxMsg
 @singleton
 class WechatfChannel(ChatChannel):
     NOT_SUPPORT_REPLYTYPE = []
+    STREAM_REPLY_MODE = "batch"
 
     def __init__(self):
         super().__init__()
@@ -109,10 +109,11 @@ def qrCallback(uuid, status, qrcode):
 @singleton
 class WechatChannel(ChatChannel):
     NOT_SUPPORT_REPLYTYPE = []
+    STREAM_REPLY_MODE = "batch"
 
     def __init__(self):
         super().__init__()
-        self.receivedMsgs = ExpiredDict(conf().get("expires_in_seconds", 3600))
+        self.receivedMsgs = ExpiredDict(conf().get("expires_in_seconds", 3600), refresh_on_read=False)
         self.auto_login_times = 0
 
     def startup(self):
@@ -31,6 +31,7 @@ except Exception as e:
 @singleton
 class WechatyChannel(ChatChannel):
     NOT_SUPPORT_REPLYTYPE = []
+    STREAM_REPLY_MODE = "batch"
 
     def __init__(self):
         super().__init__()
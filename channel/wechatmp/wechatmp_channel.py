@@ -15,6 +15,7 @@ from collections import defaultdict
 from bridge.context import *
 from bridge.reply import *
 from channel.chat_channel import ChatChannel
+from channel import http_server
 from channel.wechatmp.common import *
 from channel.wechatmp.wechatmp_client import WechatMPClient
 from common.log import logger
@@ -37,6 +38,8 @@ class WechatMPChannel(ChatChannel):
         super().__init__()
         self.passive_reply = passive_reply
         self.NOT_SUPPORT_REPLYTYPE = []
+        # 被动回复只能在用户请求时取回缓存的回复，流式分批发送只在主动回复模式下开启
+        self.STREAM_REPLY_MODE = None if passive_reply else "batch"
         appid = conf().get("wechatmp_app_id")
         secret = conf().get("wechatmp_app_secret")
         token = conf().get("wechatmp_token")
@@ -65,7 +68,7 @@ class WechatMPChannel(ChatChannel):
             urls = ("/wx", "channel.wechatmp.active_reply.Query")
         app = web.application(urls, globals(), autoreload=False)
         port = conf().get("wechatmp_port", 8080)
-        web.httpserver.runsimple(app.wsgifunc(), ("0.0.0.0", port))
+        http_server.serve(app.wsgifunc(), port, "wechatmp")
 
     def start_loop(self, loop):
         asyncio.set_event_loop(loop)
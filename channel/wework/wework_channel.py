@@ -175,6 +175,7 @@ def get_with_retry(get_func, max_retries=5, delay=5):
 @singleton
 class WeworkChannel(ChatChannel):
     NOT_SUPPORT_REPLYTYPE = []
+    STREAM_REPLY_MODE = "batch"
 
     def __init__(self):
         super().__init__()
@@ -1,66 +1,167 @@
-from datetime import datetime, timedelta
+import threading
+import time
+import weakref
+from collections import OrderedDict
+from collections.abc import MutableMapping
 
-class ExpiredDict(dict):
+from common.log import logger
+
+
+class ExpiredDict(MutableMapping):
     """
-    ExpiredDict 是一个带有过期时间的字典。每个键值对在插入时会被记录一个过期时间，超过指定秒数后自动失效。
-    主要用于缓存等需要自动过期的数据场景。
+    ExpiredDict 是一个带有过期时间的字典。每个键值对在写入(及默认的读取)时刷新过期时间，超过指定秒数后自动失效。
+    主要用于缓存、消息去重等需要自动过期的数据场景。
 
     参数:
         expires_in_seconds: int，所有键值对的过期时间（秒）
+        max_size: int，最多保存的键值对数量，超出时淘汰最久未刷新的项，0为不限制
+        refresh_on_read: bool，读取时是否刷新过期时间，消息去重等场景应设为False
+
+    实现说明：
+    - 所有键值对的过期时长相同，因此按刷新时间排列的OrderedDict同时也是按过期时间排列的索引，
+      清理过期项只需从队首弹出，均摊O(1)；max_size淘汰同样从队首进行(LRU)
+    - 使用单调时钟，不受系统时间调整影响
+    - 每次写入时顺带清理队首的过期项，另外有一个共享的后台线程定期清理所有ExpiredDict，
+      只写不读的字典(如消息去重)也不会无限增长
+    - keys()/items()/values()返回未过期项的列表快照，不会刷新过期时间
 
     主要方法说明：
-    - __setitem__(key, value): 设置键值对，并记录过期时间。
+    - __setitem__(key, value): 设置键值对，并刷新过期时间。
     - __getitem__(key): 获取键值对，如果已过期则抛出KeyError并删除该项。
     - get(key, default): 获取键值对，若不存在或已过期则返回default。
-    - __contains__(key): 判断键是否存在且未过期。
-    - keys(): 返回所有未过期的键。
-    - items(): 返回所有未过期的键值对。
-    - __iter__(): 迭代所有未过期的键。
+    - peek(key, default): 获取键值对，不刷新过期时间。
+    - __contains__(key): 判断键是否存在且未过期，不刷新过期时间。
+    - purge(): 删除所有过期的键值对。
     """
 
-    def __init__(self, expires_in_seconds):
-        super().__init__()
+    def __init__(self, expires_in_seconds, max_size=0, refresh_on_read=True):
         self.expires_in_seconds = expires_in_seconds
+        self.max_size = max_size
+        self.refresh_on_read = refresh_on_read
+        self._data = OrderedDict()  # key -> (value, expiry_time)，按过期时间从早到晚排列
+        self._lock = threading.RLock()
+        _sweeper.register(self)
 
     def __getitem__(self, key):
-        # 获取键对应的值和过期时间，如果已过期则删除并抛出KeyError
-        value, expiry_time = super().__getitem__(key)
-        if datetime.now() > expiry_time:
-            del self[key]
-            raise KeyError("expired {}".format(key))
-        # 刷新过期时间
-        self.__setitem__(key, value)
-        return value
+        with self._lock:
+            value, expiry_time = self._data[key]
+            now = time.monotonic()
+            if now > expiry_time:
+                del self._data[key]
+                raise KeyError("expired {}".format(key))
+            if self.refresh_on_read:
+                self._data[key] = (value, now + self.expires_in_seconds)
+                self._data.move_to_end(key)
+            return value
 
     def __setitem__(self, key, value):
-        # 设置键值对，并记录新的过期时间
-        expiry_time = datetime.now() + timedelta(seconds=self.expires_in_seconds)
-        super().__setitem__(key, (value, expiry_time))
+        with self._lock:
+            now = time.monotonic()
+            self._data[key] = (value, now + self.expires_in_seconds)
+            self._data.move_to_end(key)
+            self._purge(now)
+            if self.max_size > 0:
+                while len(self._data) > self.max_size:
+                    self._data.popitem(last=False)
+
+    def __delitem__(self, key):
+        with self._lock:
+            del self._data[key]
+
+    def __contains__(self, key):
+        return self.peek(key, _MISSING) is not _MISSING
+
+    def __iter__(self):
+        return iter(self.keys())
+
+    def __len__(self):
+        with self._lock:
+            self._purge(time.monotonic())
+            return len(self._data)
 
     def get(self, key, default=None):
-        # 获取键对应的值，若不存在或已过期则返回default
         try:
             return self[key]
         except KeyError:
             return default
 
-    def __contains__(self, key):
-        # 判断键是否存在且未过期
-        try:
-            self[key]
-            return True
-        except KeyError:
-            return False
+    def peek(self, key, default=None):
+        with self._lock:
+            item = self._data.get(key)
+            if item is None or time.monotonic() > item[1]:
+                return default
+            return item[0]
 
     def keys(self):
         # 返回所有未过期的键
-        keys = list(super().keys())
-        return [key for key in keys if key in self]
+        with self._lock:
+            self._purge(time.monotonic())
+            return list(self._data.keys())
 
     def items(self):
         # 返回所有未过期的键值对
-        return [(key, self[key]) for key in self.keys()]
+        with self._lock:
+            self._purge(time.monotonic())
+            return [(key, item[0]) for key, item in self._data.items()]
 
-    def __iter__(self):
-        # 迭代所有未过期的键
-        return self.keys().__iter__()
+    def values(self):
+        with self._lock:
+            self._purge(time.monotonic())
+            return [item[0] for item in self._data.values()]
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def purge(self):
+        """删除所有过期的键值对"""
+        with self._lock:
+            return self._purge(time.monotonic())
+
+    def _purge(self, now):
+        cnt = 0
+        while self._data:
+            key, (_, expiry_time) = next(iter(self._data.items()))
+            if expiry_time > now:
+                break
+            del self._data[key]
+            cnt += 1
+        return cnt
+
+    def __repr__(self):
+        return "ExpiredDict({})".format(dict(self.items()))
+
+
+_MISSING = object()
+
+
+class _Sweeper(object):
+    """共享的后台清理线程，定期清理所有存活的ExpiredDict"""
+
+    interval = 60
+
+    def __init__(self):
+        self._dicts = weakref.WeakValueDictionary()  # ExpiredDict不可哈希，按id登记
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def register(self, expired_dict):
+        with self._lock:
+            self._dicts[id(expired_dict)] = expired_dict
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="ExpiredDictSweeper", daemon=True)
+                self._thread.start()
+
+    def _run(self):
+        while True:
+            time.sleep(self.interval)
+            with self._lock:
+                dicts = list(self._dicts.values())
+            for expired_dict in dicts:
+                try:
+                    expired_dict.purge()
+                except Exception as e:
+                    logger.warning("[ExpiredDict] purge error: {}".format(e))
+
+
+_sweeper = _Sweeper()
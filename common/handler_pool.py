@@ -0,0 +1,99 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from common.log import logger
+from config import conf
+
+# 队列超限时的处理策略
+OVERFLOW_DROP_OLDEST = "drop_oldest"  # 丢弃会话中最早排队的消息
+OVERFLOW_REJECT = "reject"  # 拒绝新消息，并回复INFO提示
+OVERFLOW_SHED = "shed"  # 丢弃新的普通消息，#开头的管理命令仍然入队
+OVERFLOW_POLICIES = [OVERFLOW_DROP_OLDEST, OVERFLOW_REJECT, OVERFLOW_SHED]
+
+
+class HandlerPool(ThreadPoolExecutor):
+    """
+    处理消息的共享线程池，在ThreadPoolExecutor基础上增加了:
+    1. 根据配置调整线程数，可按channel_type单独配置
+    2. 全局/单会话排队消息数的上限和超限策略
+    3. 实时的排队数、执行中任务数统计
+    """
+
+    def __init__(self, max_workers=8):
+        super().__init__(max_workers=max_workers)
+        self.max_queue_size = 0  # 所有会话排队消息总数上限，0为不限制
+        self.max_session_queue_size = 0  # 单个会话排队消息数上限，0为不限制
+        self.overflow_policy = OVERFLOW_DROP_OLDEST
+        self._counter_lock = threading.Lock()
+        self._active_workers = 0
+        self._queued_contexts = 0
+
+    def configure(self, channel_type=None):
+        """根据配置调整线程池，线程按需创建，调大后立即生效，调小后多余的空闲线程保留"""
+        max_workers = conf().get("handler_pool_workers", 8)
+        channel_workers = conf().get("handler_pool_channel_workers", {})
+        if channel_type and channel_type in channel_workers:
+            max_workers = channel_workers[channel_type]
+        if max_workers and max_workers > 0:
+            self._max_workers = max_workers
+        self.max_queue_size = conf().get("handler_pool_max_queue_size", 0)
+        self.max_session_queue_size = conf().get("handler_pool_max_session_queue_size", 0)
+        policy = conf().get("handler_pool_overflow_policy", OVERFLOW_DROP_OLDEST)
+        if policy not in OVERFLOW_POLICIES:
+            logger.warning("[HandlerPool] unknown overflow policy: {}, use {}".format(policy, OVERFLOW_DROP_OLDEST))
+            policy = OVERFLOW_DROP_OLDEST
+        self.overflow_policy = policy
+        logger.info(
+            "[HandlerPool] workers={}, max_queue_size={}, max_session_queue_size={}, overflow_policy={}".format(
+                self._max_workers, self.max_queue_size, self.max_session_queue_size, self.overflow_policy
+            )
+        )
+
+    def submit(self, fn, *args, **kwargs):
+        def run():
+            with self._counter_lock:
+                self._active_workers += 1
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                with self._counter_lock:
+                    self._active_workers -= 1
+
+        return super().submit(run)
+
+    def is_overflow(self, session_queue_size):
+        """判断再入队一条消息是否会超过排队上限"""
+        return self.is_session_overflow(session_queue_size) or self.is_global_overflow()
+
+    def is_session_overflow(self, session_queue_size):
+        return self.max_session_queue_size > 0 and session_queue_size >= self.max_session_queue_size
+
+    def is_global_overflow(self):
+        return self.max_queue_size > 0 and self._queued_contexts >= self.max_queue_size
+
+    def add_queued(self, count=1):
+        with self._counter_lock:
+            self._queued_contexts += count
+
+    def remove_queued(self, count=1):
+        with self._counter_lock:
+            self._queued_contexts = max(0, self._queued_contexts - count)
+
+    @property
+    def active_workers(self):
+        """正在执行的任务数"""
+        return self._active_workers
+
+    @property
+    def queued_contexts(self):
+        """在会话队列中排队、尚未提交到线程池的消息数"""
+        return self._queued_contexts
+
+    def stats(self) -> dict:
+        return {
+            "max_workers": self._max_workers,
+            "threads": len(self._threads),
+            "active_workers": self._active_workers,
+            "pending_tasks": self._work_queue.qsize(),  # 已提交线程池但未开始执行
+            "queued_contexts": self._queued_contexts,
+        }
@@ -33,22 +33,23 @@ class ChatClient(LinkAIClient):
         if config.get("enabled") != "Y":
             return
 
-        local_config = conf()
-        for key in config.keys():
-            if key in available_setting and config.get(key) is not None:
-                local_config[key] = config.get(key)
-        # 语音配置
-        reply_voice_mode = config.get("reply_voice_mode")
-        if reply_voice_mode:
-            if reply_voice_mode == "voice_reply_voice":
-                local_config["voice_reply_voice"] = True
-                local_config["always_reply_voice"] = False
-            elif reply_voice_mode == "always_reply_voice":
-                local_config["always_reply_voice"] = True
-                local_config["voice_reply_voice"] = True
-            elif reply_voice_mode == "no_reply_voice":
-                local_config["always_reply_voice"] = False
-                local_config["voice_reply_voice"] = False
+        # 远程配置全部写入后只发布一次新快照
+        with conf().batch() as local_config:
+            for key in config.keys():
+                if key in available_setting and config.get(key) is not None:
+                    local_config[key] = config.get(key)
+            # 语音配置
+            reply_voice_mode = config.get("reply_voice_mode")
+            if reply_voice_mode:
+                if reply_voice_mode == "voice_reply_voice":
+                    local_config["voice_reply_voice"] = True
+                    local_config["always_reply_voice"] = False
+                elif reply_voice_mode == "always_reply_voice":
+                    local_config["always_reply_voice"] = True
+                    local_config["voice_reply_voice"] = True
+                elif reply_voice_mode == "no_reply_voice":
+                    local_config["always_reply_voice"] = False
+                    local_config["voice_reply_voice"] = False
 
         if config.get("admin_password"):
             if not pconf("Godcmd"):
@@ -1,38 +1,245 @@
+"""
+日志
+
+业务线程只把日志记录放进队列，格式化和写控制台、写文件都在后台的QueueListener线程中完成:
+- 日志参数在后台线程中才格式化，热点路径请使用 logger.debug("xxx %s", arg) 的写法，不要提前拼接字符串
+- 队列满时(例如磁盘卡住)丢弃新的日志并计数，不阻塞业务线程
+- 文件日志支持按大小或按时间轮转，可选JSON Lines格式
+- 可以按模块设置日志级别，例如 {"bridge": "DEBUG", "channel.web": "WARNING"}
+"""
+
+import atexit
+import itertools
+import json
 import logging
+import logging.handlers
+import os
+import queue
 import sys
+import threading
 
 
-def _reset_logger(log):
-    for handler in log.handlers:
-        handler.close()
-        log.removeHandler(handler)
-        del handler
-    log.handlers.clear()
-    log.propagate = False
+TEXT_FORMAT = "[%(levelname)s][%(asctime)s][%(filename)s:%(lineno)d] - %(message)s"
+DATE_FORMAT = "%Y-%m-%d %H:%M:%S"
+
+_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+class JsonFormatter(logging.Formatter):
+    """每条日志输出为一行JSON"""
+
+    def format(self, record):
+        data = {
+            "time": self.formatTime(record, DATE_FORMAT),
+            "level": record.levelname,
+            "module": record.module,
+            "file": "{}:{}".format(record.filename, record.lineno),
+            "thread": record.threadName,
+            "message": record.getMessage(),
+        }
+        if record.exc_info:
+            data["exc_info"] = self.formatException(record.exc_info)
+        return json.dumps(data, ensure_ascii=False)
+
+
+class ModuleLevelFilter(logging.Filter):
+    """
+    按模块过滤日志，模块名由文件相对项目根目录的路径得到，例如 channel/web/web_channel.py -> channel.web.web_channel，
+    按最长的前缀匹配级别，没有匹配的使用默认级别
+    """
+
+    def __init__(self, level, module_levels):
+        super().__init__()
+        self.level = level
+        self.module_levels = {name.strip("."): _to_level(value) for name, value in (module_levels or {}).items()}
+        self._cache = {}  # pathname -> 级别
+
+    def set_level(self, level):
+        self.level = level
+        self._cache = {}
+
+    def filter(self, record):
+        level = self._cache.get(record.pathname)
+        if level is None:
+            level = self._cache[record.pathname] = self._level_of(record.pathname)
+        return record.levelno >= level
+
+    def _level_of(self, pathname):
+        module = os.path.splitext(os.path.relpath(pathname, _ROOT))[0].replace(os.sep, ".")
+        best = None
+        for name, level in self.module_levels.items():
+            if (module == name or module.startswith(name + ".")) and (best is None or len(name) > len(best)):
+                best = name
+        return self.level if best is None else self.module_levels[best]
+
+
+class NonBlockingQueueHandler(logging.handlers.QueueHandler):
+    """不在调用线程中格式化、队列满时丢弃的QueueHandler"""
+
+    def __init__(self, log_queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def prepare(self, record):
+        # 格式化交给后台线程；线程名、时间等在创建记录时已经确定，exc_info在进程内直接传递
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+class _Listener(logging.handlers.QueueListener):
+    def __init__(self, log_queue, handlers, queue_handler):
+        super().__init__(log_queue, *handlers, respect_handler_level=False)
+        self.queue_handler = queue_handler
+        self._reported = 0
+
+    def enqueue_sentinel(self):
+        # 停止时队列可能是满的，等待后台线程腾出位置，保证剩余日志都能写完
+        self.queue.put(self._sentinel)
+
+    def handle(self, record):
+        dropped = self.queue_handler.dropped
+        if dropped != self._reported:
+            # 在日志中记录被丢弃的条数
+            notice = logging.LogRecord(record.name, logging.WARNING, __file__, 0, "[log] queue full, %d records dropped", (dropped - self._reported,), None)
+            self._reported = dropped
+            super().handle(notice)
+        super().handle(record)
+
+
+def _to_level(level):
+    if isinstance(level, int):
+        return level
+    return logging._nameToLevel.get(str(level).upper(), logging.INFO)
+
+
+def _file_handler(filename, max_bytes, backup_count, when):
+    directory = os.path.dirname(filename)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    if when:
+        return logging.handlers.TimedRotatingFileHandler(filename, when=when, backupCount=backup_count, encoding="utf-8")
+    if max_bytes and max_bytes > 0:
+        return logging.handlers.RotatingFileHandler(filename, maxBytes=max_bytes, backupCount=backup_count, encoding="utf-8")
+    return logging.FileHandler(filename, encoding="utf-8")
+
+
+_listener = None
+_module_filter = None
+_setup_lock = threading.Lock()
+
+
+def setup_logging(
+    level=logging.INFO,
+    filename="run.log",
+    log_format="text",
+    max_bytes=0,
+    backup_count=5,
+    when=None,
+    module_levels=None,
+    queue_size=10000,
+):
+    """
+    (重新)配置日志，可重复调用，旧的后台线程会在写完队列中的日志后退出
+    :param filename: 日志文件，为空时只输出到控制台
+    :param log_format: text 或 json，只影响文件日志
+    :param max_bytes: 文件超过该大小时轮转，0表示不按大小轮转
+    :param when: 按时间轮转，取值同TimedRotatingFileHandler，如 midnight、H；设置后不再按大小轮转
+    :param module_levels: {模块名前缀: 级别}
+    :param queue_size: 队列长度，满了之后丢弃新的日志
+    """
+    global _listener, _module_filter
+    level = _to_level(level)
+    module_filter = ModuleLevelFilter(level, module_levels)
+    text_formatter = logging.Formatter(TEXT_FORMAT, datefmt=DATE_FORMAT)
+
+    handlers = []
     console_handle = logging.StreamHandler(sys.stdout)
-    console_handle.setFormatter(
-        logging.Formatter(
-            "[%(levelname)s][%(asctime)s][%(filename)s:%(lineno)d] - %(message)s",
-            datefmt="%Y-%m-%d %H:%M:%S",
-        )
-    )
-    file_handle = logging.FileHandler("run.log", encoding="utf-8")
-    file_handle.setFormatter(
-        logging.Formatter(
-            "[%(levelname)s][%(asctime)s][%(filename)s:%(lineno)d] - %(message)s",
-            datefmt="%Y-%m-%d %H:%M:%S",
-        )
-    )
-    log.addHandler(file_handle)
-    log.addHandler(console_handle)
+    console_handle.setFormatter(text_formatter)
+    handlers.append(console_handle)
+    if filename:
+        file_handle = _file_handler(filename, max_bytes, backup_count, when)
+        file_handle.setFormatter(JsonFormatter() if log_format == "json" else text_formatter)
+        handlers.insert(0, file_handle)
+
+    queue_handler = NonBlockingQueueHandler(queue.Queue(queue_size if queue_size and queue_size > 0 else 0))
+    queue_handler.addFilter(module_filter)
+    listener = _Listener(queue_handler.queue, handlers, queue_handler)
+
+    with _setup_lock:
+        old_listener = _listener
+        old_handlers = list(logger.handlers)
+        listener.start()
+        logger.addHandler(queue_handler)
+        for handler in old_handlers:
+            logger.removeHandler(handler)
+        logger.propagate = False
+        # logger本身的级别取最低的，具体是否输出由模块过滤器决定
+        logger.setLevel(min([level] + list(module_filter.module_levels.values())))
+        _listener = listener
+        _module_filter = module_filter
+    if old_listener is not None:
+        _stop_listener(old_listener)
+
+
+def set_level(level):
+    """
+    运行时修改默认日志级别(按模块设置的级别不变)
+    日志由模块过滤器按级别过滤，只调用logger.setLevel调低级别不会生效，需要通过这里修改
+    """
+    level = _to_level(level)
+    with _setup_lock:
+        if _module_filter is None:
+            logger.setLevel(level)
+            return
+        _module_filter.set_level(level)
+        logger.setLevel(min([level] + list(_module_filter.module_levels.values())))
+
+
+def get_level():
+    """当前的默认日志级别"""
+    return _module_filter.level if _module_filter is not None else logger.getEffectiveLevel()
+
+
+def _stop_listener(listener):
+    listener.stop()
+    for handler in listener.handlers:
+        handler.close()
+
+
+def shutdown():
+    """停止后台线程并写完剩余日志，进程退出时自动调用"""
+    global _listener
+    with _setup_lock:
+        listener = _listener
+        _listener = None
+    if listener is not None:
+        _stop_listener(listener)
+
+
+_sample_counters = {}
+
+
+def should_sample(key, every=100):
+    """
+    采样日志，同一个key每every次返回一次True，用于流式输出等高频位置
+    例: if should_sample("bridge.stream", 50): logger.debug(...)
+    """
+    counter = _sample_counters.get(key)
+    if counter is None:
+        counter = _sample_counters.setdefault(key, itertools.count())
+    return next(counter) % every == 0
 
 
 def _get_logger():
-    log = logging.getLogger("log")
-    _reset_logger(log)
-    log.setLevel(logging.INFO)
-    return log
+    return logging.getLogger("log")
 
 
 # 日志句柄
 logger = _get_logger()
+setup_logging()
+atexit.register(shutdown)
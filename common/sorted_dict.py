@@ -1,7 +1,12 @@
-import heapq
+class SortedDict(dict):
+    """
+    按sort_func(key, value)排序的字典，迭代、keys()、items()按排序结果返回
 
+    排序键保存在带位置索引的二叉堆中，插入、更新、删除都是O(log n)；
+    有序的keys/items列表会被缓存，只有排序发生变化时才重新生成
+    排序键相同的按key排序，reverse=True时整体倒序
+    """
 
-class SortedDict(dict):
     def __init__(self, sort_func=lambda k, v: k, init_dict=None, reverse=False):
         if init_dict is None:
             init_dict = []
@@ -9,33 +14,50 @@ class SortedDict(dict):
             init_dict = init_dict.items()
         self.sort_func = sort_func
         self.sorted_keys = None
+        self.sorted_items = None
         self.reverse = reverse
-        self.heap = []
+        self.heap = []  # [(priority, key)]，小顶堆
+        self.heap_index = {}  # key -> 在heap中的位置
         for k, v in init_dict:
             self[k] = v
 
     def __setitem__(self, key, value):
-        if key in self:
-            super().__setitem__(key, value)
-            for i, (priority, k) in enumerate(self.heap):
-                if k == key:
-                    self.heap[i] = (self.sort_func(key, value), key)
-                    heapq.heapify(self.heap)
-                    break
-            self.sorted_keys = None
-        else:
-            super().__setitem__(key, value)
-            heapq.heappush(self.heap, (self.sort_func(key, value), key))
+        super().__setitem__(key, value)
+        self.sorted_items = None
+        priority = self.sort_func(key, value)
+        pos = self.heap_index.get(key)
+        if pos is None:
+            self.heap.append((priority, key))
+            self.heap_index[key] = len(self.heap) - 1
+            self._sift_up(len(self.heap) - 1)
             self.sorted_keys = None
+        elif self.heap[pos][0] != priority:
+            self._replace(pos, priority)
 
     def __delitem__(self, key):
         super().__delitem__(key)
-        for i, (priority, k) in enumerate(self.heap):
-            if k == key:
-                del self.heap[i]
-                heapq.heapify(self.heap)
-                break
+        pos = self.heap_index.pop(key)
+        last = self.heap.pop()
+        if pos < len(self.heap):
+            self.heap[pos] = last
+            self.heap_index[last[1]] = pos
+            self._sift_down(self._sift_up(pos))
         self.sorted_keys = None
+        self.sorted_items = None
+
+    def pop(self, key, *default):
+        if key not in self:
+            return super().pop(key, *default)
+        value = self[key]
+        del self[key]
+        return value
+
+    def clear(self):
+        super().clear()
+        self.heap.clear()
+        self.heap_index.clear()
+        self.sorted_keys = None
+        self.sorted_items = None
 
     def keys(self):
         if self.sorted_keys is None:
@@ -43,20 +65,59 @@ class SortedDict(dict):
         return self.sorted_keys
 
     def items(self):
-        if self.sorted_keys is None:
-            self.sorted_keys = [k for _, k in sorted(self.heap, reverse=self.reverse)]
-        sorted_items = [(k, self[k]) for k in self.sorted_keys]
-        return sorted_items
+        if self.sorted_items is None:
+            self.sorted_items = [(k, self[k]) for k in self.keys()]
+        return self.sorted_items
+
+    def values(self):
+        return [v for _, v in self.items()]
 
     def _update_heap(self, key):
-        for i, (priority, k) in enumerate(self.heap):
-            if k == key:
-                new_priority = self.sort_func(key, self[key])
-                if new_priority != priority:
-                    self.heap[i] = (new_priority, key)
-                    heapq.heapify(self.heap)
-                    self.sorted_keys = None
+        """value内部的排序字段被修改后调用，重新计算key的排序位置"""
+        pos = self.heap_index[key]
+        new_priority = self.sort_func(key, self[key])
+        if new_priority != self.heap[pos][0]:
+            self._replace(pos, new_priority)
+
+    def _replace(self, pos, priority):
+        key = self.heap[pos][1]
+        self.heap[pos] = (priority, key)
+        self._sift_down(self._sift_up(pos))
+        self.sorted_keys = None
+        self.sorted_items = None
+
+    def _sift_up(self, pos):
+        heap, index = self.heap, self.heap_index
+        item = heap[pos]
+        while pos > 0:
+            parent = (pos - 1) >> 1
+            if not item < heap[parent]:
+                break
+            heap[pos] = heap[parent]
+            index[heap[pos][1]] = pos
+            pos = parent
+        heap[pos] = item
+        index[item[1]] = pos
+        return pos
+
+    def _sift_down(self, pos):
+        heap, index = self.heap, self.heap_index
+        size = len(heap)
+        item = heap[pos]
+        while True:
+            child = 2 * pos + 1
+            if child >= size:
+                break
+            if child + 1 < size and heap[child + 1] < heap[child]:
+                child += 1
+            if not heap[child] < item:
                 break
+            heap[pos] = heap[child]
+            index[heap[pos][1]] = pos
+            pos = child
+        heap[pos] = item
+        index[item[1]] = pos
+        return pos
 
     def __iter__(self):
         return iter(self.keys())
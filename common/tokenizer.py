@@ -0,0 +1,131 @@
+"""
+tokenizer注册表
+
+按模型名称解析出对应的tokenizer并缓存，同一个模型只解析一次，tiktoken的编码器在所有会话和bot之间共享。
+不支持tiktoken的模型(文心、讯飞、gemini等)使用按字符数估算的tokenizer，接口保持一致。
+"""
+
+import threading
+
+from common import const
+from common.log import logger
+
+# 以下模型的token计算方式与gpt-3.5-turbo相同
+GPT35_TOKEN_MODELS = ["gpt-3.5-turbo", "gpt-3.5-turbo-0301", "gpt-35-turbo", "gpt-3.5-turbo-1106", "moonshot", const.LINKAI_35]
+# 以下模型的token计算方式与gpt-4相同
+GPT4_TOKEN_MODELS = [
+    "gpt-4", "gpt-4-0314", "gpt-4-0613", "gpt-4-32k", "gpt-4-32k-0613", "gpt-3.5-turbo-0613",
+    "gpt-3.5-turbo-16k", "gpt-3.5-turbo-16k-0613", "gpt-35-turbo-16k", "gpt-4-turbo-preview",
+    "gpt-4-1106-preview", const.GPT4_TURBO_PREVIEW, const.GPT4_VISION_PREVIEW, const.GPT4_TURBO_01_25,
+    const.GPT_4o, const.GPT_4O_0806, const.GPT_4o_MINI, const.LINKAI_4o, const.LINKAI_4_TURBO,
+]
+# 字符串个数达到该值时才使用tiktoken的encode_batch，它每次调用都会创建并关闭一个线程池
+ENCODE_BATCH_MIN_SIZE = 32
+# 以下模型没有可用的tiktoken编码，按字符数估算
+CHARACTER_TOKEN_MODELS = ["wenxin", "xunfei"]
+
+
+class Tokenizer(object):
+    # refer to https://github.com/openai/openai-cookbook/blob/main/examples/How_to_count_tokens_with_tiktoken.ipynb
+    tokens_per_message = 0  # 每条消息额外的token数
+    tokens_per_name = 0  # 消息带有name字段时额外的token数
+    tokens_per_reply = 0  # 每次回复额外的token数
+
+    def count(self, text: str) -> int:
+        raise NotImplementedError
+
+    def count_tokens(self, texts: list) -> list:
+        """批量计算多个字符串的token数"""
+        return [self.count(text) for text in texts]
+
+    def count_message(self, message: dict) -> int:
+        """计算单条对话消息的token数，不包含回复的额外token"""
+        # 只有两三个短字符串，逐个计算，不走批量接口
+        num_tokens = self.tokens_per_message + sum(self.count(value) for value in message.values())
+        if "name" in message:
+            num_tokens += self.tokens_per_name
+        return num_tokens
+
+
+class TiktokenTokenizer(Tokenizer):
+    def __init__(self, encoding, tokens_per_message=3, tokens_per_name=1, tokens_per_reply=3):
+        self.encoding = encoding
+        self.tokens_per_message = tokens_per_message
+        self.tokens_per_name = tokens_per_name
+        self.tokens_per_reply = tokens_per_reply
+
+    def count(self, text: str) -> int:
+        return len(self.encoding.encode(text, disallowed_special=()))
+
+    def count_tokens(self, texts: list) -> list:
+        if len(texts) < ENCODE_BATCH_MIN_SIZE:
+            return [self.count(text) for text in texts]
+        return [len(tokens) for tokens in self.encoding.encode_batch(texts, disallowed_special=())]
+
+
+class CharacterTokenizer(Tokenizer):
+    """按字符数粗略估算token数"""
+
+    def count(self, text: str) -> int:
+        return len(text)
+
+    def count_message(self, message: dict) -> int:
+        return len(message["content"])
+
+
+_tokenizers = {}
+_encodings = {}
+_lock = threading.Lock()
+
+
+def get_tokenizer(model: str) -> Tokenizer:
+    """获取对话模型的tokenizer，结果按模型名称缓存"""
+    tokenizer = _tokenizers.get(model)
+    if tokenizer is None:
+        tokenizer = _resolve_tokenizer(model)
+        with _lock:
+            _tokenizers[model] = tokenizer
+    return tokenizer
+
+
+def get_encoding(model: str):
+    """获取模型对应的tiktoken编码器，未知模型使用cl100k_base，结果按模型名称缓存"""
+    encoding = _encodings.get(model)
+    if encoding is None:
+        import tiktoken
+
+        try:
+            encoding = tiktoken.encoding_for_model(model)
+        except KeyError:
+            logger.debug("Warning: model {} not found. Using cl100k_base encoding.".format(model))
+            encoding = tiktoken.get_encoding("cl100k_base")
+        with _lock:
+            _encodings[model] = encoding
+    return encoding
+
+
+def count_tokens(texts: list, model: str) -> list:
+    """批量计算多个字符串在指定模型下的token数"""
+    return get_tokenizer(model).count_tokens(texts)
+
+
+def preload(models: list):
+    """预先加载模型的tokenizer，避免第一条消息时才加载编码器"""
+    for model in models:
+        if not model:
+            continue
+        try:
+            get_tokenizer(model)
+        except Exception as e:
+            logger.warning("[Tokenizer] preload tokenizer for {} failed: {}".format(model, e))
+
+
+def _resolve_tokenizer(model: str) -> Tokenizer:
+    if model in CHARACTER_TOKEN_MODELS or model.startswith(const.GEMINI):
+        return CharacterTokenizer()
+    if model in GPT4_TOKEN_MODELS:
+        return TiktokenTokenizer(get_encoding("gpt-4"), tokens_per_message=3, tokens_per_name=1)
+    if model not in GPT35_TOKEN_MODELS and not model.startswith("claude-3"):
+        logger.debug(f"tokenizer is not implemented for model {model}. Returning tokenizer assuming gpt-3.5-turbo.")
+    # every message follows <|start|>{role/name}\n{content}<|end|>\n, if there's a name, the role is omitted
+    return TiktokenTokenizer(get_encoding("gpt-3.5-turbo"), tokens_per_message=4, tokens_per_name=-1)
@@ -4,9 +4,11 @@ import json
 import logging
 import os
 import pickle
+import contextlib
 import copy
+import threading
 
-from common.log import logger
+from common.log import logger, setup_logging
 
 # 将所有可用的配置项写在字典里, 请使用小写字母
 # 此处的配置值无实际意义，程序不会读取此处的配置，仅用于提示格式，请将配置加入到config.json中
@@ -49,10 +51,20 @@ available_setting = {
     "image_proxy": True,  # 是否需要图片代理，国内访问LinkAI时需要
     "image_create_prefix": ["画", "看", "找"],  # 开启图片回复的前缀
     "concurrency_in_session": 1,  # 同一会话最多有多少条消息在处理中，大于1可能乱序
+    # 消息处理线程池配置，LLM请求主要是网络等待，可适当调大线程数
+    "handler_pool_workers": 8,  # 处理消息的线程数
+    "handler_pool_channel_workers": {},  # 按channel_type单独配置线程数，如 {"web": 64}，优先于handler_pool_workers
+    "handler_pool_max_queue_size": 0,  # 所有会话排队等待处理的消息总数上限，0为不限制
+    "handler_pool_max_session_queue_size": 0,  # 单个会话排队等待处理的消息数上限，0为不限制
+    "handler_pool_overflow_policy": "drop_oldest",  # 排队超限策略，drop_oldest: 丢弃最早的排队消息(全局超限时从排队最多的会话中丢弃，无可丢弃时拒绝并回复提示)，reject: 拒绝新消息并回复提示，shed: 丢弃非#开头的新消息
+    "async_pipeline": False,  # 是否使用asyncio处理消息，开启后等待LLM响应不占用线程，适合大量并发会话
     "image_create_size": "256x256",  # 图片大小,可选有 256x256, 512x512, 1024x1024 (dall-e-3默认为1024x1024)
     "group_chat_exit_group": False,
     # chatgpt会话参数
     "expires_in_seconds": 3600,  # 无操作会话的过期时间
+    "session_store": "memory",  # 会话存储方式，memory: 内存，sqlite: SQLite持久化，sqlite_lru: SQLite持久化+LRU内存缓存
+    "session_store_path": "",  # SQLite数据库文件路径，默认为数据目录下的sessions.db
+    "session_store_cache_size": 1000,  # sqlite_lru模式下内存中最多缓存的会话数
     # 人格描述
     "character_desc": "你是ChatGPT, 一个由OpenAI训练的大型语言模型, 你旨在回答并解决人们的任何问题，并且可以使用多种语言与人交流。",
     "conversation_max_tokens": 1000,  # 支持上下文记忆的最多字符数
@@ -66,6 +78,12 @@ available_setting = {
     "presence_penalty": 0,
     "request_timeout": 180,  # chatgpt请求超时时间，openai接口默认设置为600，对于难问题一般需要较长时间
     "timeout": 120,  # chatgpt重试超时时间，在这个时间内，将会自动重试
+    # 动态模型请求复用的OpenAI客户端配置，按(model_url, api_key)缓存
+    "openai_client_pool_size": 32,  # 最多缓存的客户端数量，超出时按LRU淘汰
+    "openai_client_idle_ttl": 300,  # 客户端空闲多少秒后回收
+    "openai_client_max_connections": 20,  # 每个客户端的最大连接数
+    "openai_client_max_keepalive": 10,  # 每个客户端保持的最大keep-alive连接数
+    "openai_client_keepalive_expiry": 60,  # keep-alive连接空闲多少秒后关闭
     # Baidu 文心一言参数
     "baidu_wenxin_model": "eb-instant",  # 默认使用ERNIE-Bot-turbo模型
     "baidu_wenxin_api_key": "",  # Baidu api key
@@ -77,6 +95,7 @@ available_setting = {
     "xunfei_api_secret": "",  # 讯飞 API secret
     "xunfei_domain": "",  # 讯飞模型对应的domain参数，Spark4.0 Ultra为 4.0Ultra，其他模型详见: https://www.xfyun.cn/doc/spark/Web.html
     "xunfei_spark_url": "",  # 讯飞模型对应的请求地址，Spark4.0 Ultra为 wss://spark-api.xf-yun.com/v4.0/chat，其他模型参考详见: https://www.xfyun.cn/doc/spark/Web.html
+    "xunfei_timeout": 60,  # 讯飞星火建立连接和等待每一帧响应的超时秒数
     # claude 配置
     "claude_api_cookie": "",
     "claude_uuid": "",
@@ -103,6 +122,11 @@ available_setting = {
     "text_to_voice": "openai",  # 语音合成引擎，支持openai,baidu,google,azure,xunfei,ali,pytts(offline),elevenlabs,edge(online)
     "text_to_voice_model": "tts-1",
     "tts_voice_id": "alloy",
+    "tts_cache_enabled": True,  # 是否缓存语音合成结果，相同引擎、音色和文本的回复直接复用，转码后的格式也一并缓存
+    "tts_cache_dir": "",  # 缓存目录，默认为数据目录下的tts_cache
+    "tts_cache_max_bytes": 209715200,  # 缓存总大小上限，超过后淘汰最久未使用的条目，默认200MB
+    # 长语音分段识别，按引擎覆盖单段最大毫秒数和并发数，如 {"baidu": {"max_segment_ms": 55000, "concurrency": 4}}，max_segment_ms为0时不分段
+    "asr_chunk_config": {},
     # baidu 语音api配置， 使用百度语音识别和语音合成时需要
     "baidu_app_id": "",
     "baidu_api_key": "",
@@ -159,6 +183,15 @@ available_setting = {
     "channel_type": "",  # 通道类型，支持：{wx,wxy,terminal,wechatmp,wechatmp_service,wechatcom_app,dingtalk}
     "subscribe_msg": "",  # 订阅消息, 支持: wechatmp, wechatmp_service, wechatcom_app
     "debug": False,  # 是否开启debug模式，开启后会打印更多日志
+    # 日志配置
+    "log_level": "INFO",  # 默认日志级别，debug为true时为DEBUG
+    "log_module_levels": {},  # 按模块设置日志级别，如 {"bridge": "DEBUG", "channel.web": "WARNING"}
+    "log_file": "run.log",  # 日志文件，为空时只输出到控制台
+    "log_format": "text",  # 文件日志格式，text 或 json(每行一条JSON)
+    "log_max_bytes": 0,  # 日志文件超过该大小(字节)时轮转，0表示不轮转
+    "log_rotate_when": "",  # 按时间轮转，如 midnight、H，设置后不再按大小轮转
+    "log_backup_count": 5,  # 轮转后保留的日志文件数
+    "log_queue_size": 10000,  # 日志队列长度，写日志跟不上时丢弃新的日志而不是阻塞消息处理
     "appdata_dir": "",  # 数据目录
     # 插件配置
     "plugin_trigger_prefix": "$",  # 规范插件提供聊天相关指令的前缀，建议不要和管理员指令前缀"#"冲突
@@ -183,12 +216,34 @@ available_setting = {
     "Minimax_group_id": "",
     "Minimax_base_url": "",
     "web_port": 9899,
+    "stream_reply": False,  # 是否开启流式回复，钉钉(开启dingtalk_card_enabled时)和飞书流式更新卡片，微信等channel按句子分批发送多条消息
+    "stream_batch_min_chars": 80,  # 分批发送时，第一句之后每批至少包含的字符数
+    "stream_batch_max_chars": 500,  # 分批发送时，没有句子边界的内容超过该字符数时强制切分
+    "stream_card_interval": 0.5,  # 流式更新卡片的最小间隔秒数
+    "stream_voice_reply": False,  # 语音回复时是否按句流式合成并依次发送，需要TTS引擎支持并发合成(目前为edge、openai)
+    "stream_voice_min_chars": 20,  # 流式语音回复中，第一句之后每段语音至少包含的字符数
+    "stream_voice_concurrency": 3,  # 流式语音回复中同时合成的句子数
+    "stream_flush_chars": 64,  # 流式回复累积到该字符数时发送一帧
+    "stream_flush_interval": 0.1,  # 距上次发送超过该秒数时发送一帧，第一帧总是立即发送
+    "web_poll_timeout": 25,  # web channel长轮询(/poll)及SSE心跳的最长等待秒数
+    "web_sse_max_connections": 48,  # web channel同时保持的SSE(/events)连接数上限，需小于http_server_threads，超出后页面改用长轮询
+    "web_session_timeout": 3600,  # web channel会话和请求队列超过该秒数未访问则清理
+    # web、飞书、公众号、企业微信等channel共用的HTTP服务配置
+    "http_server_threads": 64,  # 处理请求的线程数，SSE长连接每个占用一个线程
+    "http_request_queue_size": 128,  # 监听socket的backlog
+    "http_accepted_queue_size": 256,  # 已接受、等待线程处理的连接数上限
+    "http_keepalive_timeout": 10,  # keep-alive空闲连接及读取请求的超时秒数
+    "http_max_body_size": 10485760,  # 请求体大小上限(字节)，超过返回413，0为不限制
+    "http_shutdown_timeout": 5,  # 退出时等待处理中请求的秒数
+    "http_access_log": False,  # 是否记录访问日志
 }
 
 
 class Config(dict):
     def __init__(self, d=None):
         super().__init__()
+        self.version = 0  # 每次修改配置加1，根据配置编译的缓存据此判断是否需要重建
+        self._batch_depth = 0
         if d is None:
             d = {}
         for k, v in d.items():
@@ -197,22 +252,52 @@ class Config(dict):
         self.user_datas = {}
 
     def __getitem__(self, key):
-        if key not in available_setting:
-            raise Exception("key {} not in available_setting".format(key))
-        return super().__getitem__(key)
+        # 写入时已经校验过，命中时直接返回，只有取不到时才校验key是否合法
+        try:
+            return super().__getitem__(key)
+        except KeyError:
+            if key not in available_setting:
+                raise Exception("key {} not in available_setting".format(key))
+            raise
 
     def __setitem__(self, key, value):
         if key not in available_setting:
             raise Exception("key {} not in available_setting".format(key))
-        return super().__setitem__(key, value)
+        self.version += 1
+        super().__setitem__(key, value)
+        if self is config and not self._batch_depth:
+            # 直接修改当前配置(如conf()["xxx"] = xxx)时同样生成新的快照并通知
+            _publish(self)
+
+    def update(self, other=(), **kwargs):
+        """批量修改配置，全部写入后只生成一次快照"""
+        with self.batch():
+            for k, v in dict(other, **kwargs).items():
+                self[k] = v
+
+    @contextlib.contextmanager
+    def batch(self):
+        """
+        批量修改配置，期间每次写入不单独发布，退出时有修改则生成一次快照并通知监听者，可嵌套。
+        批量修改期间其他线程的conf_snapshot()仍返回修改前的快照，不会看到只改了一半的配置
+        """
+        with _publish_lock:
+            version = self.version
+            self._batch_depth += 1
+            try:
+                yield self
+            finally:
+                self._batch_depth -= 1
+                if not self._batch_depth and self.version != version and self is config:
+                    _publish(self)
 
     def get(self, key, default=None):
-        try:
-            return self[key]
-        except KeyError as e:
-            return default
-        except Exception as e:
-            raise e
+        value = super().get(key, _MISSING)
+        if value is not _MISSING:
+            return value
+        if key not in available_setting:
+            raise Exception("key {} not in available_setting".format(key))
+        return default
 
     # Make sure to return a dictionary to ensure atomic
     def get_user_data(self, user) -> dict:
@@ -240,7 +325,91 @@ class Config(dict):
             logger.info("[Config] User datas error: {}".format(e))
 
 
+class ConfigSnapshot(object):
+    """
+    配置的只读快照，每个配置项是一个slot属性，读取时不加锁、不做校验
+
+    未配置的项为None，与conf().get(key)一致；需要其他默认值时使用get(key, default)。
+    配置重新加载或被修改时整体替换为新的快照，已经取到旧快照的代码看到的始终是一份完整、一致的配置。
+    list类型的配置在快照中为tuple，dict为复制的新dict，修改当前配置中的列表不会影响已发布的快照。
+    """
+
+    __slots__ = tuple(available_setting) + ("version", "_configured")
+
+    def __init__(self, config):
+        for key in available_setting:
+            object.__setattr__(self, key, _freeze(dict.get(config, key)))
+        object.__setattr__(self, "version", config.version)
+        object.__setattr__(self, "_configured", frozenset(config))
+
+    def __setattr__(self, key, value):
+        raise AttributeError("config snapshot is read-only, use conf()[{!r}] = value".format(key))
+
+    def __delattr__(self, key):
+        raise AttributeError("config snapshot is read-only")
+
+    def __getitem__(self, key):
+        if key not in self._configured:
+            raise KeyError(key)
+        return getattr(self, key)
+
+    def __contains__(self, key):
+        return key in self._configured
+
+    def get(self, key, default=None):
+        if key in self._configured:
+            return getattr(self, key)
+        if key not in available_setting:
+            raise Exception("key {} not in available_setting".format(key))
+        return default
+
+
+_MISSING = object()
 config = Config()
+_snapshot = None
+_snapshot_source = None
+_listeners = []
+_publish_lock = threading.RLock()
+
+
+def _freeze(value):
+    if isinstance(value, (list, tuple)):
+        return tuple(_freeze(item) for item in value)
+    if isinstance(value, dict):
+        return {k: _freeze(v) for k, v in value.items()}
+    return value
+
+
+def _publish(new_config):
+    """把new_config设为当前配置，生成快照并依次通知监听者"""
+    global config, _snapshot, _snapshot_source
+    with _publish_lock:
+        snapshot = ConfigSnapshot(new_config)
+        config = new_config
+        _snapshot_source = new_config
+        _snapshot = snapshot
+        for listener in list(_listeners):
+            try:
+                listener(snapshot)
+            except Exception as e:
+                logger.exception("[Config] config listener {} error: {}".format(listener, e))
+    return snapshot
+
+
+def add_config_listener(listener):
+    """
+    注册配置变化的回调，load_config或修改配置后以新的ConfigSnapshot为参数调用，
+    用于重建根据配置编译的状态。回调在发布配置的线程中同步执行，应尽量轻量
+    """
+    with _publish_lock:
+        _listeners.append(listener)
+    return listener
+
+
+def remove_config_listener(listener):
+    with _publish_lock:
+        if listener in _listeners:
+            _listeners.remove(listener)
 
 
 def drag_sensitive(config):
@@ -268,7 +437,6 @@ def drag_sensitive(config):
 
 
 def load_config():
-    global config
     config_path = "./config.json"
     if not os.path.exists(config_path):
         logger.info("配置文件不存在，将使用config-template.json模板")
@@ -278,7 +446,7 @@ def load_config():
     logger.debug("[INIT] config str: {}".format(drag_sensitive(config_str)))
 
     # 将json字符串反序列化为dict类型
-    config = Config(json.loads(config_str))
+    new_config = Config(json.loads(config_str))
 
     # override config with environment variables.
     # Some online deployment platforms (e.g. Railway) deploy project from github directly. So you shouldn't put your secrets like api key in a config file, instead use environment variables to override the default config.
@@ -287,17 +455,29 @@ def load_config():
         if name in available_setting:
             logger.info("[INIT] override config by environ args: {}={}".format(name, value))
             try:
-                config[name] = eval(value)
+                new_config[name] = eval(value)
             except:
                 if value == "false":
-                    config[name] = False
+                    new_config[name] = False
                 elif value == "true":
-                    config[name] = True
+                    new_config[name] = True
                 else:
-                    config[name] = value
-
+                    new_config[name] = value
+
+    # 环境变量覆盖完成后再整体替换，其他线程不会读到只加载了一半的配置
+    _publish(new_config)
+
+    setup_logging(
+        level=logging.DEBUG if config.get("debug", False) else config.get("log_level", "INFO"),
+        filename=config.get("log_file", "run.log"),
+        log_format=config.get("log_format", "text"),
+        max_bytes=config.get("log_max_bytes", 0),
+        backup_count=config.get("log_backup_count", 5),
+        when=config.get("log_rotate_when"),
+        module_levels=config.get("log_module_levels"),
+        queue_size=config.get("log_queue_size", 10000),
+    )
     if config.get("debug", False):
-        logger.setLevel(logging.DEBUG)
         logger.debug("[INIT] set log level to DEBUG")
 
     logger.info("[INIT] load config: {}".format(drag_sensitive(config)))
@@ -318,6 +498,16 @@ def conf():
     return config
 
 
+def conf_snapshot() -> ConfigSnapshot:
+    """当前配置的只读快照，热点路径中按属性读取配置"""
+    snapshot = _snapshot
+    if snapshot is None or _snapshot_source is not config or snapshot.version != config.version:
+        if snapshot is not None and _snapshot_source is config and config._batch_depth:
+            return snapshot  # 批量修改尚未完成，返回修改前的快照
+        snapshot = _publish(config)
+    return snapshot
+
+
 def get_appdata_dir():
     data_path = os.path.join(get_root(), conf().get("appdata_dir", ""))
     if not os.path.exists(data_path):
@@ -27,6 +27,7 @@ class AgentPlugin(Plugin):
     def __init__(self):
         super().__init__()
         self.handlers[Event.ON_HANDLE_CONTEXT] = self.on_handle_context
+        self.set_filter(Event.ON_HANDLE_CONTEXT, context_types=[ContextType.TEXT])
         self.name = "agent"
         self.description = "Use AgentMesh framework to process tasks with multi-agent teams"
         self.config = self._load_config()
@@ -7,9 +7,10 @@ import plugins
 from bridge.context import ContextType
 from bridge.reply import Reply, ReplyType
 from common.log import logger
+from config import get_appdata_dir
 from plugins import *
 
-from .lib.WordsSearch import WordsSearch
+from .banwords_index import get_index
 
 
 @plugins.register(
@@ -35,17 +36,15 @@ class Banwords(Plugin):
                     with open(config_path, "w") as f:
                         json.dump(conf, f, indent=4)
 
-            self.searchr = WordsSearch()
             self.action = conf["action"]
             banwords_path = os.path.join(curdir, "banwords.txt")
-            with open(banwords_path, "r", encoding="utf-8") as f:
-                words = []
-                for line in f:
-                    word = line.strip()
-                    if word:
-                        words.append(word)
-            self.searchr.SetKeywords(words)
+            if not os.path.exists(banwords_path):
+                raise FileNotFoundError(banwords_path)
+            # 编译好的词库索引按内容hash缓存，词库文件变化时在后台重新编译
+            index_path = conf.get("index_path") or os.path.join(get_appdata_dir(), "banwords.idx")
+            self.index = get_index(banwords_path, index_path, conf.get("reload_interval", 10))
             self.handlers[Event.ON_HANDLE_CONTEXT] = self.on_handle_context
+            self.set_filter(Event.ON_HANDLE_CONTEXT, context_types=[ContextType.TEXT, ContextType.IMAGE_CREATE])
             if conf.get("reply_filter", True):
                 self.handlers[Event.ON_DECORATE_REPLY] = self.on_decorate_reply
                 self.reply_action = conf.get("reply_action", "ignore")
@@ -54,6 +53,10 @@ class Banwords(Plugin):
             logger.warn("[Banwords] init failed, ignore or see https://github.com/zhayujie/chatgpt-on-wechat/tree/master/plugins/banwords .")
             raise e
 
+    @property
+    def searchr(self):
+        return self.index.searcher
+
     def on_handle_context(self, e_context: EventContext):
         if e_context["context"].type not in [
             ContextType.TEXT,
@@ -70,8 +73,9 @@ class Banwords(Plugin):
                 e_context.action = EventAction.BREAK_PASS
                 return
         elif self.action == "replace":
-            if self.searchr.ContainsAny(content):
-                reply = Reply(ReplyType.INFO, "发言中包含敏感词，请重试: \n" + self.searchr.Replace(content))
+            found, replaced = self.searchr.FindAllAndReplace(content)
+            if found:
+                reply = Reply(ReplyType.INFO, "发言中包含敏感词，请重试: \n" + replaced)
                 e_context["reply"] = reply
                 e_context.action = EventAction.BREAK_PASS
                 return
@@ -90,8 +94,9 @@ class Banwords(Plugin):
                 e_context.action = EventAction.BREAK_PASS
                 return
         elif self.reply_action == "replace":
-            if self.searchr.ContainsAny(content):
-                reply = Reply(ReplyType.INFO, "已替换回复中的敏感词: \n" + self.searchr.Replace(content))
+            found, replaced = self.searchr.FindAllAndReplace(content)
+            if found:
+                reply = Reply(ReplyType.INFO, "已替换回复中的敏感词: \n" + replaced)
                 e_context["reply"] = reply
                 e_context.action = EventAction.CONTINUE
                 return
@@ -0,0 +1,137 @@
+# encoding:utf-8
+
+import hashlib
+import os
+import threading
+import time
+
+from common.log import logger
+
+from .lib.WordsSearch import WordsSearch
+
+
+class BanwordsIndex(object):
+    """
+    敏感词库的编译索引
+
+    - 编译好的自动机保存在index_path，以词库内容的sha256作为标签，词库未变化时重启或重新激活插件直接mmap加载
+    - 后台线程定期检查词库文件，发生变化时在后台重新编译并原子替换searcher，处理消息时不会等待编译
+    - 启动时如果只有旧版本的索引，先用旧索引提供服务，同时在后台编译新索引
+    """
+
+    def __init__(self, words_path, index_path, check_interval=10):
+        self.words_path = words_path
+        self.index_path = index_path
+        self.check_interval = check_interval
+        self.searcher = WordsSearch()
+        self._stat = None  # 词库文件的 (mtime, size)
+        self._tag = None  # 当前searcher对应的词库sha256
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def start(self):
+        stat, data = self._read_words()
+        tag = hashlib.sha256(data).digest()
+        searcher = WordsSearch()
+        try:
+            loaded = searcher.LoadIndex(self.index_path, tag)
+        except Exception as e:
+            logger.warning("[Banwords] load index {} failed: {}".format(self.index_path, e))
+            loaded = False
+        if loaded:
+            logger.info("[Banwords] loaded index {}, {} words".format(self.index_path, len(searcher._keywords)))
+            self._swap(searcher, stat, tag)
+        elif not self._load_stale():
+            self._swap(self._build(data, tag), stat, tag)
+        # 使用旧索引时self._stat为None，后台线程会立即重新编译
+        if self.check_interval and self.check_interval > 0:
+            self._thread = threading.Thread(target=self._watch, name="BanwordsIndexWatcher", daemon=True)
+        elif self._stat is None:
+            self._thread = threading.Thread(target=self.refresh, name="BanwordsIndexBuilder", daemon=True)
+        if self._thread is not None:
+            self._thread.start()
+        return self
+
+    def refresh(self):
+        """检查词库文件，有变化则重新编译并替换searcher"""
+        with self._lock:
+            try:
+                if os.path.exists(self.words_path):
+                    st = os.stat(self.words_path)
+                    if (st.st_mtime, st.st_size) == self._stat:
+                        return False
+                stat, data = self._read_words()
+                tag = hashlib.sha256(data).digest()
+                if tag == self._tag:
+                    self._stat = stat
+                    return False
+                self._swap(self._build(data, tag), stat, tag)
+                return True
+            except Exception as e:
+                logger.warning("[Banwords] refresh index failed: {}".format(e))
+                return False
+
+    def _watch(self):
+        if self._stat is None:
+            self.refresh()
+        while True:
+            time.sleep(self.check_interval)
+            self.refresh()
+
+    def _read_words(self):
+        if not os.path.exists(self.words_path):
+            return None, b""
+        with open(self.words_path, "rb") as f:
+            st = os.fstat(f.fileno())
+            return (st.st_mtime, st.st_size), f.read()
+
+    def _build(self, data, tag):
+        start = time.time()
+        words = []
+        for line in data.decode("utf-8").splitlines():
+            word = line.strip()
+            if word:
+                words.append(word)
+        searcher = WordsSearch()
+        searcher.SetKeywords(words)
+        try:
+            searcher.SaveIndex(self.index_path, tag)
+        except Exception as e:
+            logger.warning("[Banwords] save index {} failed: {}".format(self.index_path, e))
+        logger.info("[Banwords] built index for {} words in {:.2f}s".format(len(words), time.time() - start))
+        return searcher
+
+    def _load_stale(self):
+        """加载任意版本标签的旧索引"""
+        searcher = WordsSearch()
+        try:
+            tag = searcher.ReadIndexTag(self.index_path)
+            if tag is None or not searcher.LoadIndex(self.index_path, tag):
+                return False
+        except Exception as e:
+            logger.warning("[Banwords] load stale index {} failed: {}".format(self.index_path, e))
+            return False
+        logger.info("[Banwords] words changed, use stale index until rebuild finished")
+        self._swap(searcher, None, tag)
+        return True
+
+    def _swap(self, searcher, stat, tag):
+        # 单次属性赋值是原子的，正在处理的消息继续使用旧的searcher
+        self.searcher = searcher
+        self._stat = stat
+        self._tag = tag
+
+
+_indexes = {}
+_indexes_lock = threading.Lock()
+
+
+def get_index(words_path, index_path, check_interval=10) -> BanwordsIndex:
+    """同一个词库只编译、监听一次，插件重新激活时复用"""
+    key = (os.path.abspath(words_path), os.path.abspath(index_path))
+    with _indexes_lock:
+        index = _indexes.get(key)
+        if index is None:
+            index = BanwordsIndex(words_path, index_path, check_interval).start()
+            _indexes[key] = index
+        return index
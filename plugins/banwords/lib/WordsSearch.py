@@ -6,245 +6,295 @@
 # 更新日志
 # 2020.04.06 第一次提交
 # 2020.05.16 修改，支持大于0xffff的字符
+# 2026.10 改为扁平数组存储的自动机，接口不变；支持保存为二进制索引文件并通过mmap加载
+
+"""
+Aho-Corasick多模式匹配
+
+自动机不再使用节点对象，全部存放在扁平的表中:
+- 字母表: 关键词中出现过的字符编号为 1..A-1，其余字符不可能参与匹配
+- 转移表: 一个以 state * A + code 为键的int字典，只保存trie的边
+- 失败表: _fail[state] 为失败指针，转移查不到时沿失败指针回退，整体均摊每个字符O(1)
+- 输出表: 以该状态结束的关键词按CSR格式存放在 _out_start/_out_index 两个array中，
+  _out_link[state] 为失败链上最近的结束状态，_out_len[state] 为该状态匹配到的最长关键词长度，0表示没有匹配
+扫描前先用正则按字母表切出可能匹配的片段，其余字符在C层面跳过
+
+SaveIndex/LoadIndex 把上述表保存为带版本号的二进制文件，加载时通过mmap直接引用文件中的数组，
+只有转移字典和关键词列表需要重新生成
+"""
+
+import mmap
+import os
+import re
+import struct
+import sys
+from array import array
 
 __all__ = ['WordsSearch']
 __author__ = 'Lin Zhijun'
 __date__ = '2020.05.16'
 
-class TrieNode():
-    def __init__(self):
-        self.Index = 0
-        self.Index = 0
-        self.Layer = 0
-        self.End = False
-        self.Char = ''
-        self.Results = []
-        self.m_values = {}
-        self.Failure = None
-        self.Parent = None
-
-    def Add(self,c):
-        if c in self.m_values :
-            return self.m_values[c]
-        node = TrieNode()
-        node.Parent = self
-        node.Char = c
-        self.m_values[c] = node
-        return node
-
-    def SetResults(self,index):
-        if (self.End == False):
-            self.End = True
-        self.Results.append(index)
-
-class TrieNode2():
-    def __init__(self):
-        self.End = False
-        self.Results = []
-        self.m_values = {}
-        self.minflag = 0xffff
-        self.maxflag = 0
-
-    def Add(self,c,node3):
-        if (self.minflag > c):
-            self.minflag = c
-        if (self.maxflag < c):
-             self.maxflag = c
-        self.m_values[c] = node3
-
-    def SetResults(self,index):
-        if (self.End == False) :
-            self.End = True
-        if (index in self.Results )==False : 
-            self.Results.append(index)
-
-    def HasKey(self,c):
-        return c in self.m_values
-        
- 
-    def TryGetValue(self,c):
-        if (self.minflag <= c and self.maxflag >= c):
-            if c in self.m_values:
-                return self.m_values[c]
-        return None
+INDEX_MAGIC = b'WSAC'
+INDEX_VERSION = 2
+# magic, 版本号, 标签(一般为词库内容的sha256), 字母表大小, 状态数, 关键词数, 各段长度，末尾补齐到128字节，使第一段也按8字节对齐
+_INDEX_HEADER = struct.Struct('<4sI32sIII9Q4x')
+# 按顺序保存的段: (属性名, array类型)，alphabet和keywords为utf-8文本
+_INDEX_SECTIONS = [('_alphabet', None), ('_keywords', None), ('goto_keys', 'q'), ('goto_values', 'i'),
+                   ('_fail', 'i'), ('_out_len', 'i'), ('_out_link', 'i'), ('_out_start', 'i'), ('_out_index', 'i')]
 
 
 class WordsSearch():
     def __init__(self):
-        self._first = {}
         self._keywords = []
-        self._indexs=[]
-    
-    def SetKeywords(self,keywords):
+        self._indexs = []
+        self._alphabet = {}  # 字符 -> 编号，从1开始
+        self._width = 1  # 字母表大小A
+        self._goto = {}  # state * A + code -> 子状态
+        self._fail = array('i', [0])
+        self._out_len = array('i', [0])
+        self._out_link = array('i', [0])
+        self._out_start = array('i', [0, 0])
+        self._out_index = array('i')
+        self._segment = None  # 匹配字母表中字符的连续片段
+
+    def SetKeywords(self, keywords):
         self._keywords = keywords
-        self._indexs=[]
-        for i in range(len(keywords)):
-            self._indexs.append(i)
-
-        root = TrieNode()
-        allNodeLayer={}
-
-        for i in range(len(self._keywords)): # for (i = 0; i < _keywords.length; i++) 
-            p = self._keywords[i]
-            nd = root
-            for j in range(len(p)): # for (j = 0; j < p.length; j++) 
-                nd = nd.Add(ord(p[j]))
-                if (nd.Layer == 0):
-                    nd.Layer = j + 1
-                    if nd.Layer in allNodeLayer:
-                        allNodeLayer[nd.Layer].append(nd)
-                    else:
-                        allNodeLayer[nd.Layer]=[]
-                        allNodeLayer[nd.Layer].append(nd)
-            nd.SetResults(i)
-
-
-        allNode = []
-        allNode.append(root)
-        for key in allNodeLayer.keys():
-            for nd in allNodeLayer[key]:
-                allNode.append(nd)
-        allNodeLayer=None
-
-        for i in range(len(allNode)): # for (i = 0; i < allNode.length; i++) 
-            if i==0 :
-                continue
-            nd=allNode[i]
-            nd.Index = i
-            r = nd.Parent.Failure
-            c = nd.Char
-            while (r != None and (c in r.m_values)==False):
-                r = r.Failure
-            if (r == None):
-                nd.Failure = root
-            else:
-                nd.Failure = r.m_values[c]
-                for key2 in nd.Failure.Results :
-                    nd.SetResults(key2)
-        root.Failure = root
-
-        allNode2 = []
-        for i in range(len(allNode)): # for (i = 0; i < allNode.length; i++) 
-            allNode2.append( TrieNode2())
-        
-        for i in range(len(allNode2)): # for (i = 0; i < allNode2.length; i++) 
-            oldNode = allNode[i]
-            newNode = allNode2[i]
-
-            for key in oldNode.m_values :
-                index = oldNode.m_values[key].Index
-                newNode.Add(key, allNode2[index])
-            
-            for index in range(len(oldNode.Results)): # for (index = 0; index < oldNode.Results.length; index++) 
-                item = oldNode.Results[index]
-                newNode.SetResults(item)
-            
-            oldNode=oldNode.Failure
-            while oldNode != root:
-                for key in oldNode.m_values :
-                    if (newNode.HasKey(key) == False):
-                        index = oldNode.m_values[key].Index
-                        newNode.Add(key, allNode2[index])
-                for index in range(len(oldNode.Results)): 
-                    item = oldNode.Results[index]
-                    newNode.SetResults(item)
-                oldNode=oldNode.Failure
-        allNode = None
-        root = None
-
-        # first = []
-        # for index in range(65535):# for (index = 0; index < 0xffff; index++) 
-        #     first.append(None)
-        
-        # for key in allNode2[0].m_values :
-        #     first[key] = allNode2[0].m_values[key]
-        
-        self._first = allNode2[0]
-    
-
-    def FindFirst(self,text):
-        ptr = None
-        for index in range(len(text)): # for (index = 0; index < text.length; index++) 
-            t =ord(text[index]) # text.charCodeAt(index)
-            tn = None
-            if (ptr == None):
-                tn = self._first.TryGetValue(t)
+        self._indexs = list(range(len(keywords)))
+
+        alphabet = {}
+        for keyword in keywords:
+            for ch in keyword:
+                if ch not in alphabet:
+                    alphabet[ch] = len(alphabet) + 1
+        width = len(alphabet) + 1
+
+        # 1. 建立trie，子节点用 first_child/next_sibling 链表记录，便于按层遍历
+        goto = {}
+        first_child = array('i', [0])
+        next_sibling = array('i', [0])
+        codes = array('i', [0])
+        own = {}  # state -> 以该状态结束的关键词
+        for i, keyword in enumerate(keywords):
+            state = 0
+            for ch in keyword:
+                code = alphabet[ch]
+                key = state * width + code
+                nxt = goto.get(key)
+                if nxt is None:
+                    nxt = len(codes)
+                    goto[key] = nxt
+                    codes.append(code)
+                    first_child.append(0)
+                    next_sibling.append(first_child[state])
+                    first_child[state] = nxt
+                state = nxt
+            if keyword:
+                own.setdefault(state, []).append(i)
+        count = len(codes)
+
+        # 2. 按层遍历，计算失败指针和输出链接
+        fail = array('i', [0]) * count
+        out_len = array('i', [0]) * count
+        out_link = array('i', [0]) * count
+        queue = array('i')
+        child = first_child[0]
+        while child:
+            queue.append(child)
+            child = next_sibling[child]
+        for state in queue:
+            child = first_child[state]
+            while child:
+                code = codes[child]
+                f = fail[state]
+                target = goto.get(f * width + code)
+                while target is None and f:
+                    f = fail[f]
+                    target = goto.get(f * width + code)
+                target = target or 0
+                fail[child] = target
+                out_link[child] = target if target in own else out_link[target]
+                queue.append(child)
+                child = next_sibling[child]
+            items = own.get(state)
+            if items:
+                out_len[state] = len(keywords[items[0]])
+            elif out_link[state]:
+                out_len[state] = out_len[out_link[state]]
+
+        out_start = array('i', [0]) * (count + 1)
+        out_index = array('i')
+        for state in range(count):
+            out_start[state] = len(out_index)
+            items = own.get(state)
+            if items:
+                out_index.extend(items)
+        out_start[count] = len(out_index)
+
+        self._alphabet = alphabet
+        self._width = width
+        self._goto = goto
+        self._fail = fail
+        self._out_len = out_len
+        self._out_link = out_link
+        self._out_start = out_start
+        self._out_index = out_index
+        self._compile_segment()
+
+    def _compile_segment(self):
+        if self._alphabet:
+            self._segment = re.compile('[' + ''.join(re.escape(ch) for ch in self._alphabet) + ']+')
+        else:
+            self._segment = None
+
+    def SaveIndex(self, path, tag=b''):
+        """
+        把自动机保存为二进制索引文件，先写临时文件再替换，保证读到的文件总是完整的
+        :param tag: 最多32字节，LoadIndex时校验，一般为词库内容的hash
+        """
+        sections = []
+        for name, typecode in _INDEX_SECTIONS:
+            if name == '_alphabet':
+                data = ''.join(self._alphabet).encode('utf-8')
+            elif name == '_keywords':
+                data = '\0'.join(self._keywords).encode('utf-8')
+            elif name == 'goto_keys':
+                data = array('q', self._goto.keys()).tobytes()
+            elif name == 'goto_values':
+                data = array('i', self._goto.values()).tobytes()
             else:
-                tn = ptr.TryGetValue(t)
-                if (tn==None):
-                    tn = self._first.TryGetValue(t)
-                
-            
-            if (tn != None):
-                if (tn.End):
-                    item = tn.Results[0]
-                    keyword = self._keywords[item]
-                    return { "Keyword": keyword, "Success": True, "End": index, "Start": index + 1 - len(keyword), "Index": self._indexs[item] }
-            ptr = tn
+                data = array(typecode, getattr(self, name)).tobytes()
+            sections.append(data)
+        header = _INDEX_HEADER.pack(INDEX_MAGIC, INDEX_VERSION, tag, self._width, len(self._fail), len(self._keywords), *[len(data) for data in sections])
+        tmp_path = '{}.{}.tmp'.format(path, os.getpid())
+        with open(tmp_path, 'wb') as f:
+            f.write(header)
+            for data in sections:
+                f.write(data)
+                f.write(b'\0' * (-len(data) % 8))  # 每段按8字节对齐
+        os.replace(tmp_path, path)
+
+    @staticmethod
+    def ReadIndexTag(path):
+        """读取索引文件的标签，文件不存在或格式不对时返回None"""
+        if not os.path.exists(path):
+            return None
+        with open(path, 'rb') as f:
+            data = f.read(_INDEX_HEADER.size)
+        if len(data) < _INDEX_HEADER.size:
+            return None
+        magic, version, tag = _INDEX_HEADER.unpack(data)[:3]
+        if magic != INDEX_MAGIC or version != INDEX_VERSION:
+            return None
+        return tag
+
+    def LoadIndex(self, path, tag=b''):
+        """
+        通过mmap加载SaveIndex保存的索引，数组直接引用文件内容，不拷贝
+        :return: 文件不存在、版本或标签不一致时返回False
+        """
+        if sys.byteorder != 'little' or not os.path.exists(path):
+            return False
+        with open(path, 'rb') as f:
+            if os.fstat(f.fileno()).st_size < _INDEX_HEADER.size:
+                return False
+            buf = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        header = _INDEX_HEADER.unpack_from(buf, 0)
+        magic, version, saved_tag, width, count, keyword_count = header[:6]
+        if magic != INDEX_MAGIC or version != INDEX_VERSION or saved_tag != tag.ljust(32, b'\0'):
+            buf.close()
+            return False
+        view = memoryview(buf)
+        offset = _INDEX_HEADER.size
+        values = {}
+        for (name, typecode), size in zip(_INDEX_SECTIONS, header[6:]):
+            data = view[offset:offset + size]
+            values[name] = bytes(data).decode('utf-8') if typecode is None else data.cast(typecode)
+            offset += size + (-size % 8)
+        alphabet = values['_alphabet']
+        self._alphabet = {ch: code for code, ch in enumerate(alphabet, 1)}
+        self._width = width
+        self._keywords = values['_keywords'].split('\0') if keyword_count else []
+        self._indexs = list(range(len(self._keywords)))
+        self._goto = dict(zip(values['goto_keys'], values['goto_values']))
+        for name in ['_fail', '_out_len', '_out_link', '_out_start', '_out_index']:
+            setattr(self, name, values[name])
+        self._compile_segment()
+        return True
+
+    def _scan(self, text):
+        """依次返回 (结束位置, 状态)，只返回有匹配的状态"""
+        if self._segment is None:
+            return
+        alphabet = self._alphabet
+        width = self._width
+        goto_get = self._goto.get
+        fail = self._fail
+        out_len = self._out_len
+        for m in self._segment.finditer(text):
+            state = 0
+            index = m.start()
+            for ch in m.group():
+                code = alphabet[ch]
+                nxt = goto_get(state * width + code)
+                while nxt is None and state:
+                    state = fail[state]
+                    nxt = goto_get(state * width + code)
+                state = nxt or 0
+                if out_len[state]:
+                    yield index, state
+                index += 1
+
+    def _outputs(self, state):
+        """状态匹配到的所有关键词，顺序为自身结束的关键词、再沿失败链由长到短"""
+        out_start = self._out_start
+        out_index = self._out_index
+        out_link = self._out_link
+        if out_start[state] == out_start[state + 1]:
+            state = out_link[state]
+        while state:
+            for j in range(out_start[state], out_start[state + 1]):
+                yield out_index[j]
+            state = out_link[state]
+
+    def _result(self, item, index):
+        keyword = self._keywords[item]
+        return {"Keyword": keyword, "Success": True, "End": index, "Start": index + 1 - len(keyword), "Index": self._indexs[item]}
+
+    def FindFirst(self, text):
+        for index, state in self._scan(text):
+            for item in self._outputs(state):
+                return self._result(item, index)
         return None
 
-    def FindAll(self,text):
-        ptr = None
-        list = []
+    def FindAll(self, text):
+        found = []
+        for index, state in self._scan(text):
+            for item in self._outputs(state):
+                found.append(self._result(item, index))
+        return found
 
-        for index in range(len(text)): # for (index = 0; index < text.length; index++) 
-            t =ord(text[index]) # text.charCodeAt(index)
-            tn = None
-            if (ptr == None):
-                tn = self._first.TryGetValue(t)
-            else:
-                tn = ptr.TryGetValue(t)
-                if (tn==None):
-                    tn = self._first.TryGetValue(t)
-                
-            
-            if (tn != None):
-                if (tn.End):
-                    for j in range(len(tn.Results)): # for (j = 0; j < tn.Results.length; j++) 
-                        item = tn.Results[j]
-                        keyword = self._keywords[item]
-                        list.append({ "Keyword": keyword, "Success": True, "End": index, "Start": index + 1 - len(keyword), "Index": self._indexs[item] })
-            ptr = tn
-        return list
-
-
-    def ContainsAny(self,text):
-        ptr = None
-        for index in range(len(text)): # for (index = 0; index < text.length; index++) 
-            t =ord(text[index]) # text.charCodeAt(index)
-            tn = None
-            if (ptr == None):
-                tn = self._first.TryGetValue(t)
-            else:
-                tn = ptr.TryGetValue(t)
-                if (tn==None):
-                    tn = self._first.TryGetValue(t)
-            
-            if (tn != None):
-                if (tn.End):
-                    return True
-            ptr = tn
+    def ContainsAny(self, text):
+        for _ in self._scan(text):
+            return True
         return False
-    
-    def Replace(self,text, replaceChar = '*'):
-        result = list(text) 
-
-        ptr = None
-        for i in range(len(text)): # for (i = 0; i < text.length; i++) 
-            t =ord(text[i]) # text.charCodeAt(index)
-            tn = None
-            if (ptr == None):
-                tn = self._first.TryGetValue(t)
-            else:
-                tn = ptr.TryGetValue(t)
-                if (tn==None):
-                    tn = self._first.TryGetValue(t)
-            
-            if (tn != None):
-                if (tn.End):
-                    maxLength = len( self._keywords[tn.Results[0]])
-                    start = i + 1 - maxLength
-                    for j in range(start,i+1): # for (j = start; j <= i; j++) 
-                        result[j] = replaceChar
-            ptr = tn
-        return ''.join(result) 
\ No newline at end of file
+
+    def Replace(self, text, replaceChar='*'):
+        return self.FindAllAndReplace(text, replaceChar, False)[1]
+
+    def FindAllAndReplace(self, text, replaceChar='*', findAll=True):
+        """
+        一次扫描同时完成FindAll和Replace
+        :return: (FindAll的结果, 替换后的文本)，findAll为False时第一个值为None
+        """
+        out_len = self._out_len
+        found = [] if findAll else None
+        result = None
+        for index, state in self._scan(text):
+            if result is None:
+                result = list(text)
+            start = index + 1 - out_len[state]
+            result[start:index + 1] = [replaceChar] * (index + 1 - start)
+            if findAll:
+                for item in self._outputs(state):
+                    found.append(self._result(item, index))
+        return found, text if result is None else ''.join(result)
@@ -37,6 +37,7 @@ class BDunit(Plugin):
             self.secret_key = conf["secret_key"]
             self.access_token = self.get_token()
             self.handlers[Event.ON_HANDLE_CONTEXT] = self.on_handle_context
+            self.set_filter(Event.ON_HANDLE_CONTEXT, context_types=[ContextType.TEXT])
             logger.info("[BDunit] inited")
         except Exception as e:
             logger.warn("[BDunit] init failed, ignore ")
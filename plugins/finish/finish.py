@@ -4,7 +4,7 @@ import plugins
 from bridge.context import ContextType
 from bridge.reply import Reply, ReplyType
 from common.log import logger
-from config import conf
+from config import add_config_listener, conf, conf_snapshot
 from plugins import *
 
 
@@ -20,8 +20,19 @@ class Finish(Plugin):
     def __init__(self):
         super().__init__()
         self.handlers[Event.ON_HANDLE_CONTEXT] = self.on_handle_context
+        self.trigger_prefix = conf_snapshot().get("plugin_trigger_prefix", "$")
+        self.set_filter(Event.ON_HANDLE_CONTEXT, context_types=[ContextType.TEXT], trigger_prefixes=[self.trigger_prefix])
         logger.info("[Finish] inited")
 
+    def update_filter(self, snapshot):
+        """plugin_trigger_prefix修改后更新预过滤条件，并重新生成分发表"""
+        trigger_prefix = snapshot.get("plugin_trigger_prefix", "$")
+        if trigger_prefix == self.trigger_prefix:
+            return
+        self.trigger_prefix = trigger_prefix
+        self.set_filter(Event.ON_HANDLE_CONTEXT, context_types=[ContextType.TEXT], trigger_prefixes=[trigger_prefix])
+        PluginManager().refresh_order()
+
     def on_handle_context(self, e_context: EventContext):
         if e_context["context"].type != ContextType.TEXT:
             return
@@ -38,3 +49,10 @@ class Finish(Plugin):
 
     def get_help_text(self, **kwargs):
         return ""
+
+
+@add_config_listener
+def _on_config_change(snapshot):
+    instance = PluginManager().instances.get("FINISH")
+    if instance is not None:
+        instance.update_filter(snapshot)
@@ -13,6 +13,7 @@ from bridge.bridge import Bridge
 from bridge.context import ContextType
 from bridge.reply import Reply, ReplyType
 from common import const
+from common.log import get_level, set_level
 from config import conf, load_config, global_config
 from plugins import *
 
@@ -347,11 +348,11 @@ class Godcmd(Plugin):
                             else:
                                 ok, result = False, "当前对话机器人不支持重置会话"
                         elif cmd == "debug":
-                            if logger.getEffectiveLevel() == logging.DEBUG:  # 判断当前日志模式是否DEBUG
-                                logger.setLevel(logging.INFO)
+                            if get_level() == logging.DEBUG:  # 判断当前日志模式是否DEBUG
+                                set_level(logging.INFO)
                                 ok, result = True, "DEBUG模式已关闭"
                             else:
-                                logger.setLevel(logging.DEBUG)
+                                set_level(logging.DEBUG)
                                 ok, result = True, "DEBUG模式已开启"
                         elif cmd == "plist":
                             plugins = PluginManager().list_plugins()
@@ -0,0 +1,94 @@
+# encoding:utf-8
+
+import hashlib
+import json
+import os
+import threading
+import time
+
+import requests
+
+from common.log import logger
+
+
+class RemoteFileCache(object):
+    """
+    按URL缓存远程文件到磁盘
+
+    文件保存在 cache_dir/<url的sha1>/<原文件名>，保留原文件名以便发送文件时显示正确的名称；
+    同目录下的meta.json记录ETag、Last-Modified和上次校验时间。
+    距上次校验超过revalidate_seconds时带If-None-Match/If-Modified-Since重新请求，304则继续使用缓存；
+    请求失败时如果有缓存也继续使用缓存。
+    """
+
+    def __init__(self, cache_dir, revalidate_seconds=300, timeout=30):
+        self.cache_dir = cache_dir
+        self.revalidate_seconds = revalidate_seconds
+        self.timeout = timeout
+        self._locks = {}
+        self._locks_lock = threading.Lock()
+
+    def get(self, url) -> str:
+        """返回URL对应的本地文件路径，需要时下载或重新校验"""
+        entry_dir = os.path.join(self.cache_dir, hashlib.sha1(url.encode("utf-8")).hexdigest())
+        file_path = os.path.join(entry_dir, os.path.basename(url.split("?")[0]) or "file")
+        meta_path = os.path.join(entry_dir, "meta.json")
+        with self._lock(url):
+            meta = self._read_meta(meta_path) if os.path.exists(file_path) else None
+            if meta and time.time() - meta.get("checked_at", 0) < self.revalidate_seconds:
+                return file_path
+            headers = {}
+            if meta:
+                if meta.get("etag"):
+                    headers["If-None-Match"] = meta["etag"]
+                if meta.get("last_modified"):
+                    headers["If-Modified-Since"] = meta["last_modified"]
+            try:
+                response = requests.get(url, headers=headers, timeout=self.timeout, stream=True)
+                if response.status_code == 304 and meta:
+                    logger.debug("[keyword] cache revalidated, url={}".format(url))
+                else:
+                    response.raise_for_status()
+                    os.makedirs(entry_dir, exist_ok=True)
+                    tmp_path = "{}.{}.tmp".format(file_path, threading.get_ident())
+                    with open(tmp_path, "wb") as f:
+                        for block in response.iter_content(64 * 1024):
+                            f.write(block)
+                    os.replace(tmp_path, file_path)
+                    meta = {"url": url, "etag": response.headers.get("ETag"), "last_modified": response.headers.get("Last-Modified")}
+                    logger.info("[keyword] downloaded {} to {}".format(url, file_path))
+            except Exception as e:
+                if not meta:
+                    raise
+                logger.warning("[keyword] revalidate {} failed, use cached file: {}".format(url, e))
+            meta["checked_at"] = time.time()
+            self._write_meta(meta_path, meta)
+            return file_path
+
+    def read(self, url) -> bytes:
+        with open(self.get(url), "rb") as f:
+            return f.read()
+
+    def _lock(self, url):
+        # 同一个URL同时只下载一次
+        with self._locks_lock:
+            lock = self._locks.get(url)
+            if lock is None:
+                lock = self._locks[url] = threading.Lock()
+            return lock
+
+    @staticmethod
+    def _read_meta(meta_path):
+        try:
+            with open(meta_path, "r", encoding="utf-8") as f:
+                return json.load(f)
+        except Exception:
+            return None
+
+    @staticmethod
+    def _write_meta(meta_path, meta):
+        try:
+            with open(meta_path, "w", encoding="utf-8") as f:
+                json.dump(meta, f)
+        except Exception as e:
+            logger.warning("[keyword] write cache meta failed: {}".format(e))
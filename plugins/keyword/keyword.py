@@ -1,14 +1,19 @@
 # encoding:utf-8
 
+import io
 import json
 import os
-import requests
+
 import plugins
 from bridge.context import ContextType
 from bridge.reply import Reply, ReplyType
 from common.log import logger
+from config import get_appdata_dir
 from plugins import *
 
+from .file_cache import RemoteFileCache
+from .rule_engine import KeywordEngine
+
 
 @plugins.register(
     name="Keyword",
@@ -34,11 +39,14 @@ class Keyword(Plugin):
                 logger.debug(f"[keyword]加载配置文件{config_path}")
                 with open(config_path, "r", encoding="utf-8") as f:
                     conf = json.load(f)
-            # 加载关键词
+            # 加载关键词，keyword为完全匹配，prefix/contains/regex为可选的其他匹配方式
             self.keyword = conf["keyword"]
+            self.engine = KeywordEngine(conf["keyword"], conf.get("prefix"), conf.get("contains"), conf.get("regex"))
+            self.file_cache = RemoteFileCache(os.path.join(get_appdata_dir(), "keyword_cache"), conf.get("cache_revalidate_seconds", 300))
 
             logger.info("[keyword] {}".format(self.keyword))
             self.handlers[Event.ON_HANDLE_CONTEXT] = self.on_handle_context
+            self.set_filter(Event.ON_HANDLE_CONTEXT, context_types=[ContextType.TEXT])
             logger.info("[keyword] inited.")
         except Exception as e:
             logger.warn("[keyword] init failed, ignore or see https://github.com/zhayujie/chatgpt-on-wechat/tree/master/plugins/keyword .")
@@ -50,47 +58,40 @@ class Keyword(Plugin):
 
         content = e_context["context"].content.strip()
         logger.debug("[keyword] on_handle_context. content: %s" % content)
-        if content in self.keyword:
-            logger.info(f"[keyword] 匹配到关键字【{content}】")
-            reply_text = self.keyword[content]
-
-            # 判断匹配内容的类型
-            if (reply_text.startswith("http://") or reply_text.startswith("https://")) and any(reply_text.endswith(ext) for ext in [".jpg", ".webp", ".jpeg", ".png", ".gif", ".img"]):
-            # 如果是以 http:// 或 https:// 开头，且".jpg", ".jpeg", ".png", ".gif", ".img"结尾，则认为是图片 URL。
-                reply = Reply()
-                reply.type = ReplyType.IMAGE_URL
-                reply.content = reply_text
-                
-            elif (reply_text.startswith("http://") or reply_text.startswith("https://")) and any(reply_text.endswith(ext) for ext in [".pdf", ".doc", ".docx", ".xls", "xlsx",".zip", ".rar"]):
-            # 如果是以 http:// 或 https:// 开头，且".pdf", ".doc", ".docx", ".xls", "xlsx",".zip", ".rar"结尾，则下载文件到tmp目录并发送给用户
-                file_path = "tmp"
-                if not os.path.exists(file_path):
-                    os.makedirs(file_path)
-                file_name = reply_text.split("/")[-1]  # 获取文件名
-                file_path = os.path.join(file_path, file_name)
-                response = requests.get(reply_text)
-                with open(file_path, "wb") as f:
-                    f.write(response.content)
-                #channel/wechat/wechat_channel.py和channel/wechat_channel.py中缺少ReplyType.FILE类型。
-                reply = Reply()
-                reply.type = ReplyType.FILE
-                reply.content = file_path
-            
-            elif (reply_text.startswith("http://") or reply_text.startswith("https://")) and any(reply_text.endswith(ext) for ext in [".mp4"]):
-            # 如果是以 http:// 或 https:// 开头，且".mp4"结尾，则下载视频到tmp目录并发送给用户
-                reply = Reply()
-                reply.type = ReplyType.VIDEO_URL
-                reply.content = reply_text
-                
-            else:
-            # 否则认为是普通文本
-                reply = Reply()
-                reply.type = ReplyType.TEXT
-                reply.content = reply_text
-            
+        matched = self.engine.match(content)
+        if matched:
+            match_type, keyword, reply_text = matched
+            logger.info(f"[keyword] 匹配到关键字【{keyword}】({match_type})")
+            reply = self._build_reply(reply_text, e_context["channel"])
             e_context["reply"] = reply
             e_context.action = EventAction.BREAK_PASS  # 事件结束，并跳过处理context的默认逻辑
-            
+
+    def _build_reply(self, reply_text, channel):
+        is_url = reply_text.startswith("http://") or reply_text.startswith("https://")
+        # 判断匹配内容的类型
+        if is_url and any(reply_text.endswith(ext) for ext in [".jpg", ".webp", ".jpeg", ".png", ".gif", ".img"]):
+            # 如果是以 http:// 或 https:// 开头，且".jpg", ".jpeg", ".png", ".gif", ".img"结尾，则认为是图片 URL。
+            # channel支持直接发送图片时使用本地缓存，否则仍交给channel按URL下载
+            if ReplyType.IMAGE not in getattr(channel, "NOT_SUPPORT_REPLYTYPE", [ReplyType.IMAGE]) and not reply_text.endswith(".webp"):
+                try:
+                    return Reply(ReplyType.IMAGE, io.BytesIO(self.file_cache.read(reply_text)))
+                except Exception as e:
+                    logger.warning("[keyword] download image failed, fallback to url: {}".format(e))
+            return Reply(ReplyType.IMAGE_URL, reply_text)
+
+        elif is_url and any(reply_text.endswith(ext) for ext in [".pdf", ".doc", ".docx", ".xls", "xlsx", ".zip", ".rar"]):
+            # 如果是以 http:// 或 https:// 开头，且".pdf", ".doc", ".docx", ".xls", "xlsx",".zip", ".rar"结尾，则下载文件并发送给用户
+            # 文件按URL缓存在磁盘上，重复命中时不再重新下载
+            # channel/wechat/wechat_channel.py和channel/wechat_channel.py中缺少ReplyType.FILE类型。
+            return Reply(ReplyType.FILE, self.file_cache.get(reply_text))
+
+        elif is_url and any(reply_text.endswith(ext) for ext in [".mp4"]):
+            # 如果是以 http:// 或 https:// 开头，且".mp4"结尾，则交给channel下载视频并发送给用户
+            return Reply(ReplyType.VIDEO_URL, reply_text)
+
+        # 否则认为是普通文本
+        return Reply(ReplyType.TEXT, reply_text)
+
     def get_help_text(self, **kwargs):
         help_text = "关键词过滤"
         return help_text
@@ -0,0 +1,142 @@
+# encoding:utf-8
+
+"""
+关键词规则引擎
+
+支持四种匹配方式，优先级从高到低:
+- exact: 消息与关键词完全相同，dict查找
+- prefix: 消息以关键词开头，多个命中时取最长的
+- contains: 消息中包含关键词，多个命中时取最先出现的，位置相同取最长的
+- regex: 正则匹配(re.search)，多个命中时取在消息中最先出现的，位置相同时取配置中靠前的
+
+prefix和contains的关键词编译进同一个Aho-Corasick自动机，扫描一遍消息即可得到两类结果；
+regex规则合并为一个带命名分组的正则，一次search完成。
+"""
+
+import re
+
+from common.log import logger
+
+EXACT = "exact"
+PREFIX = "prefix"
+CONTAINS = "contains"
+REGEX = "regex"
+
+_NUMBERED_BACKREF = re.compile(r"\\[1-9]")
+
+
+class _Automaton(object):
+    """多模式匹配自动机，规模通常只有几十到几百个关键词，转移直接用dict保存"""
+
+    def __init__(self, patterns):
+        self.goto = [{}]
+        self.fail = [0]
+        self.output = [[]]  # state -> [(关键词长度, 规则序号)]，包括失败链上的输出
+        for rule_id, pattern in enumerate(patterns):
+            state = 0
+            for ch in pattern:
+                nxt = self.goto[state].get(ch)
+                if nxt is None:
+                    nxt = len(self.goto)
+                    self.goto[state][ch] = nxt
+                    self.goto.append({})
+                    self.fail.append(0)
+                    self.output.append([])
+                state = nxt
+            self.output[state].append((len(pattern), rule_id))
+        queue = list(self.goto[0].values())
+        for state in queue:
+            for ch, child in self.goto[state].items():
+                f = self.fail[state]
+                while f and ch not in self.goto[f]:
+                    f = self.fail[f]
+                target = self.goto[f].get(ch, 0)
+                self.fail[child] = target
+                self.output[child] = self.output[child] + self.output[target]
+                queue.append(child)
+
+    def search(self, text):
+        """依次返回 (起始位置, 关键词长度, 规则序号)"""
+        goto = self.goto
+        fail = self.fail
+        output = self.output
+        state = 0
+        for index, ch in enumerate(text):
+            nxt = goto[state].get(ch)
+            while nxt is None and state:
+                state = fail[state]
+                nxt = goto[state].get(ch)
+            state = nxt or 0
+            for length, rule_id in output[state]:
+                yield index + 1 - length, length, rule_id
+
+
+class KeywordEngine(object):
+    def __init__(self, exact=None, prefix=None, contains=None, regex=None):
+        """
+        :param exact/prefix/contains/regex: {关键词或正则: 回复内容}
+        """
+        self.exact = dict(exact or {})
+        # 自动机中的规则: (类型, 关键词, 回复)
+        self.rules = [(PREFIX, k, v) for k, v in (prefix or {}).items() if k]
+        self.rules += [(CONTAINS, k, v) for k, v in (contains or {}).items() if k]
+        self.automaton = _Automaton([rule[1] for rule in self.rules]) if self.rules else None
+        self.regex_rules = list((regex or {}).items())
+        self.regex = None
+        self.regex_list = None
+        self._compile_regex()
+
+    def _compile_regex(self):
+        if not self.regex_rules:
+            return
+        compiled = []
+        for pattern, reply in self.regex_rules:
+            try:
+                compiled.append((re.compile(pattern), pattern, reply))
+            except re.error as e:
+                logger.warning("[keyword] invalid regex {}: {}".format(pattern, e))
+        # 合并为一个正则，用分组名区分命中的规则；含有按序号的反向引用等无法合并的写法时，逐个匹配
+        if not any(_NUMBERED_BACKREF.search(pattern) for _, pattern, _ in compiled):
+            try:
+                self.regex = re.compile("|".join("(?P<_kw{}>{})".format(i, item[1]) for i, item in enumerate(compiled)))
+                self.regex_list = [(pattern, reply) for _, pattern, reply in compiled]
+                return
+            except re.error:
+                pass
+        self.regex = None
+        self.regex_list = compiled
+
+    def match(self, content: str):
+        """
+        :return: (匹配方式, 关键词, 回复内容)，没有命中返回None
+        """
+        reply = self.exact.get(content)
+        if reply is not None:
+            return EXACT, content, reply
+        if self.automaton is not None:
+            best_prefix = None
+            best_contains = None
+            for start, length, rule_id in self.automaton.search(content):
+                rule_type = self.rules[rule_id][0]
+                if rule_type == PREFIX:
+                    if start == 0 and (best_prefix is None or length > best_prefix[1]):
+                        best_prefix = (rule_id, length)
+                elif best_contains is None or (start, -length) < (best_contains[1], -best_contains[2]):
+                    best_contains = (rule_id, start, length)
+            best = best_prefix or best_contains
+            if best is not None:
+                return self.rules[best[0]]
+        if self.regex is not None:
+            m = self.regex.search(content)
+            if m:
+                pattern, reply = self.regex_list[int(m.lastgroup[3:])]
+                return REGEX, pattern, reply
+        elif self.regex_list:
+            best = None
+            for compiled, pattern, reply in self.regex_list:
+                m = compiled.search(content)
+                if m and (best is None or m.start() < best[0]):
+                    best = (m.start(), pattern, reply)
+            if best is not None:
+                return REGEX, best[1], best[2]
+        return None
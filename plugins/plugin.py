@@ -7,6 +7,7 @@ from common.log import logger
 class Plugin:
     def __init__(self):
         self.handlers = {}
+        self.handler_filters = {}  # event -> (context_types, trigger_prefixes)
 
     def load_config(self) -> dict:
         """
@@ -45,6 +46,15 @@ class Plugin:
         except Exception as e:
             logger.warn("save plugin config failed: {}".format(e))
 
+    def set_filter(self, event, context_types=None, trigger_prefixes=None):
+        """
+        设置event对应handler的预过滤条件，插件激活时编译进PluginManager的分发表，不满足时直接跳过，不调用handler
+        激活后修改需调用 PluginManager().refresh_order() 生效
+        :param context_types: 只处理这些ContextType的消息，None为不限制
+        :param trigger_prefixes: 只处理以这些前缀开头的文本消息，None为不限制
+        """
+        self.handler_filters[event] = (context_types, trigger_prefixes)
+
     def get_help_text(self, **kwargs):
         return "暂无帮助信息"
 
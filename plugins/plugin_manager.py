@@ -5,7 +5,9 @@ import importlib.util
 import json
 import os
 import sys
+import time
 
+from bridge.context import ContextType
 from common.log import logger
 from common.singleton import singleton
 from common.sorted_dict import SortedDict
@@ -14,6 +16,18 @@ from config import conf, remove_plugin_config, write_plugin_config
 from .event import *
 
 
+class HandlerStats(object):
+    """单个插件处理单个事件的耗时统计"""
+
+    __slots__ = ("calls", "skipped", "total_time", "max_time")
+
+    def __init__(self):
+        self.calls = 0  # handler被调用的次数
+        self.skipped = 0  # 被预过滤条件跳过的次数
+        self.total_time = 0.0
+        self.max_time = 0.0
+
+
 @singleton
 class PluginManager:
     def __init__(self):
@@ -23,6 +37,8 @@ class PluginManager:
         self.pconf = {}
         self.current_plugin_path = None
         self.loaded = {}
+        self.dispatch_table = {}  # event -> ((name, handler, context_types, trigger_prefixes, stats), ...)
+        self.handler_stats = {}  # (name, event) -> HandlerStats
 
     def register(self, name: str, desire_priority: int = 0, **kwargs):
         def wrapper(plugincls):
@@ -131,11 +147,40 @@ class PluginManager:
                 self.plugins._update_heap(name)  # 更新下plugins中的顺序
         if modified:
             self.save_config()
+        self.refresh_order()
         return new_plugins
 
     def refresh_order(self):
         for event in self.listening_plugins.keys():
             self.listening_plugins[event].sort(key=lambda name: self.plugins[name].priority, reverse=True)
+        self._build_dispatch_table()
+
+    def _build_dispatch_table(self):
+        """
+        按优先级为每个事件预先生成不可变的处理链，只包含已开启的插件实例
+        插件开启/关闭/重载/调整优先级后重新生成，emit_event只读取，无需加锁
+        """
+        dispatch_table = {}
+        for event, names in self.listening_plugins.items():
+            chain = []
+            for name in names:
+                plugincls = self.plugins.get(name)
+                instance = self.instances.get(name)
+                if plugincls is None or not plugincls.enabled or instance is None or event not in instance.handlers:
+                    continue
+                context_types, trigger_prefixes = getattr(instance, "handler_filters", {}).get(event, (None, None))
+                chain.append(
+                    (
+                        name,
+                        instance.handlers[event],
+                        frozenset(context_types) if context_types is not None else None,
+                        tuple(trigger_prefixes) if trigger_prefixes is not None else None,
+                        self.handler_stats.setdefault((name, event), HandlerStats()),
+                    )
+                )
+            if chain:
+                dispatch_table[event] = tuple(chain)
+        self.dispatch_table = dispatch_table
 
     def activate_plugins(self):  # 生成新开启的插件实例
         failed_plugins = []
@@ -188,17 +233,58 @@ class PluginManager:
         self.activate_plugins()
 
     def emit_event(self, e_context: EventContext, *args, **kwargs):
-        if e_context.event in self.listening_plugins:
-            for name in self.listening_plugins[e_context.event]:
-                if self.plugins[name].enabled and e_context.action == EventAction.CONTINUE:
-                    logger.debug("Plugin %s triggered by event %s" % (name, e_context.event))
-                    instance = self.instances[name]
-                    instance.handlers[e_context.event](e_context, *args, **kwargs)
-                    if e_context.is_break():
-                        e_context["breaked_by"] = name
-                        logger.debug("Plugin %s breaked event %s" % (name, e_context.event))
+        chain = self.dispatch_table.get(e_context.event)
+        if not chain:
+            return e_context
+        for name, handler, context_types, trigger_prefixes, stats in chain:
+            if e_context.action != EventAction.CONTINUE:
+                break
+            # 前面的插件可能修改了context，每次重新读取
+            context = e_context.econtext.get("context")
+            if context is not None:
+                if context_types is not None and context.type not in context_types:
+                    stats.skipped += 1
+                    continue
+                if trigger_prefixes is not None and not (context.type == ContextType.TEXT and isinstance(context.content, str) and context.content.startswith(trigger_prefixes)):
+                    stats.skipped += 1
+                    continue
+            logger.debug("Plugin %s triggered by event %s" % (name, e_context.event))
+            start = time.perf_counter()
+            try:
+                handler(e_context, *args, **kwargs)
+            finally:
+                cost = time.perf_counter() - start
+                stats.calls += 1
+                stats.total_time += cost
+                if cost > stats.max_time:
+                    stats.max_time = cost
+            if e_context.is_break():
+                e_context["breaked_by"] = name
+                logger.debug("Plugin %s breaked event %s" % (name, e_context.event))
         return e_context
 
+    def has_listeners(self, event: Event) -> bool:
+        """是否有开启的插件处理该事件"""
+        return bool(self.dispatch_table.get(event))
+
+    def get_handler_stats(self) -> list:
+        """各插件处理各事件的调用次数和耗时，按总耗时倒序"""
+        result = []
+        for (name, event), stats in self.handler_stats.items():
+            result.append(
+                {
+                    "plugin": name,
+                    "event": event.name,
+                    "calls": stats.calls,
+                    "skipped": stats.skipped,
+                    "total_ms": stats.total_time * 1000,
+                    "avg_ms": stats.total_time * 1000 / stats.calls if stats.calls else 0,
+                    "max_ms": stats.max_time * 1000,
+                }
+            )
+        result.sort(key=lambda item: item["total_ms"], reverse=True)
+        return result
+
     def set_plugin_priority(self, name: str, priority: int):
         name = name.upper()
         if name not in self.plugins:
@@ -238,6 +324,7 @@ class PluginManager:
             rawname = self.plugins[name].name
             self.pconf["plugins"][rawname]["enabled"] = False
             self.save_config()
+            self._build_dispatch_table()
             return True
         return True
 
@@ -336,6 +423,7 @@ class PluginManager:
                 if name in self.listening_plugins[event]:
                     self.listening_plugins[event].remove(name)
             del self.plugins[name]
+            self._build_dispatch_table()
             del self.pconf["plugins"][rawname]
             self.loaded[dirname] = None
             self.save_config()
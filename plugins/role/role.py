@@ -65,6 +65,7 @@ class Role(Plugin):
             if len(self.roles) == 0:
                 raise Exception("no role found")
             self.handlers[Event.ON_HANDLE_CONTEXT] = self.on_handle_context
+            self.set_filter(Event.ON_HANDLE_CONTEXT, context_types=[ContextType.TEXT])
             self.roleplays = {}
             logger.info("[Role] inited")
         except Exception as e:
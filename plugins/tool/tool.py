@@ -22,6 +22,7 @@ class Tool(Plugin):
     def __init__(self):
         super().__init__()
         self.handlers[Event.ON_HANDLE_CONTEXT] = self.on_handle_context
+        self.set_filter(Event.ON_HANDLE_CONTEXT, context_types=[ContextType.TEXT])
         self.app = self._reset_app()
         if not self.tool_config.get("tools"):
             logger.warn("[tool] init failed, ignore ")
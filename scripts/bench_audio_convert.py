@@ -0,0 +1,204 @@
+# encoding:utf-8
+"""
+语音转码耗时和子进程数测试脚本
+
+对比基于pydub的旧实现(下方LegacyConvert，与改动前的voice/audio_convert相同)和现在的voice.audio_convert，
+场景与channel中的调用一致:
+- wechatcom: TTS音频 -> any_to_amr -> split_audio(60s)
+- wechaty:   TTS音频 -> any_to_sil
+- wechatmp:  TTS音频 -> any_to_mp3 -> split_audio(60s)
+- asr:       收到的语音 -> any_to_wav
+
+需要ffmpeg。旧实现解码wav以外的格式时会先调用ffprobe，没有ffprobe时跳过这一步但仍计入子进程数，
+此时旧实现的耗时是下限(标*)。
+用法: python3 scripts/bench_audio_convert.py [--seconds 90] [--rounds 5]
+"""
+
+import argparse
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import config  # noqa: E402
+from config import Config  # noqa: E402
+
+config.config = Config({"tts_cache_enabled": False})
+
+from voice import audio_convert  # noqa: E402
+
+
+class LegacyConvert(object):
+    """改动前基于pydub的实现"""
+
+    @staticmethod
+    def any_to_mp3(any_path, mp3_path):
+        from pydub import AudioSegment
+
+        if any_path.endswith(".mp3"):
+            shutil.copy2(any_path, mp3_path)
+            return
+        audio = AudioSegment.from_file(any_path)
+        audio.export(mp3_path, format="mp3")
+
+    @staticmethod
+    def any_to_wav(any_path, wav_path):
+        from pydub import AudioSegment
+
+        if any_path.endswith(".wav"):
+            shutil.copy2(any_path, wav_path)
+            return
+        audio = AudioSegment.from_file(any_path)
+        audio.set_frame_rate(8000)
+        audio.set_channels(1)
+        audio.export(wav_path, format="wav", codec="pcm_s16le")
+
+    @staticmethod
+    def any_to_sil(any_path, sil_path):
+        import pysilk
+        from pydub import AudioSegment
+
+        audio = AudioSegment.from_file(any_path)
+        rate = audio_convert.find_closest_sil_supports(audio.frame_rate)
+        pcm_s16 = audio.set_sample_width(2)
+        pcm_s16 = pcm_s16.set_frame_rate(rate)
+        silk_data = pysilk.encode(pcm_s16.raw_data, data_rate=rate, sample_rate=rate)
+        with open(sil_path, "wb") as f:
+            f.write(silk_data)
+        return audio.duration_seconds * 1000
+
+    @staticmethod
+    def any_to_amr(any_path, amr_path):
+        from pydub import AudioSegment
+
+        if any_path.endswith(".amr"):
+            shutil.copy2(any_path, amr_path)
+            return
+        audio = AudioSegment.from_file(any_path)
+        audio = audio.set_frame_rate(8000)
+        audio.export(amr_path, format="amr")
+        return audio.duration_seconds * 1000
+
+    @staticmethod
+    def split_audio(file_path, max_segment_length_ms=60000):
+        from pydub import AudioSegment
+
+        audio = AudioSegment.from_file(file_path)
+        audio_length_ms = len(audio)
+        if audio_length_ms <= max_segment_length_ms:
+            return audio_length_ms, [file_path]
+        segments = []
+        for start_ms in range(0, audio_length_ms, max_segment_length_ms):
+            end_ms = min(audio_length_ms, start_ms + max_segment_length_ms)
+            segments.append(audio[start_ms:end_ms])
+        file_prefix = file_path[: file_path.rindex(".")]
+        format = file_path[file_path.rindex(".") + 1 :]
+        files = []
+        for i, segment in enumerate(segments):
+            path = f"{file_prefix}_{i+1}" + f".{format}"
+            segment.export(path, format=format)
+            files.append(path)
+        return audio_length_ms, files
+
+
+_spawned = [0]
+_popen_init = subprocess.Popen.__init__
+
+
+def _counting_init(self, *args, **kwargs):
+    _spawned[0] += 1
+    _popen_init(self, *args, **kwargs)
+
+
+def _skip_ffprobe():
+    # pydub拿不到流信息时按默认参数解码，结果相同
+    from pydub import audio_segment
+
+    def mediainfo_json(*args, **kwargs):
+        _spawned[0] += 1
+        return {}
+
+    audio_segment.mediainfo_json = mediainfo_json
+
+
+def wechatcom(impl, src, work):
+    amr = os.path.join(work, "reply.amr")
+    impl.any_to_amr(src, amr)
+    impl.split_audio(amr, 60 * 1000)
+
+
+def wechaty(impl, src, work):
+    impl.any_to_sil(src, os.path.join(work, "reply.sil"))
+
+
+def wechatmp(impl, src, work):
+    mp3 = os.path.join(work, "reply.mp3")
+    impl.any_to_mp3(src, mp3)
+    impl.split_audio(mp3, 60 * 1000)
+
+
+def asr(impl, src, work):
+    impl.any_to_wav(src, os.path.join(work, "voice.wav"))
+
+
+def make_inputs(work, seconds):
+    # 近似语音的测试音频：单声道，带音量包络的多个正弦波
+    source = "aevalsrc='0.3*sin(2*PI*220*t)*(0.6+0.4*sin(2*PI*3*t))+0.1*sin(2*PI*1200*t)':s=24000:d={}".format(seconds)
+    inputs = {}
+    for name, args in (("wav", ["-acodec", "pcm_s16le"]), ("mp3", [])):
+        path = os.path.join(work, "input.{}".format(name))
+        subprocess.run(["ffmpeg", "-hide_banner", "-loglevel", "error", "-y", "-f", "lavfi", "-i", source] + args + [path], check=True)
+        inputs[name] = path
+    return inputs
+
+
+def run(impl, scenario, src, rounds):
+    work = tempfile.mkdtemp()
+    try:
+        shutil.copy2(src, os.path.join(work, os.path.basename(src)))
+        src = os.path.join(work, os.path.basename(src))
+        scenario(impl, src, work)  # 预热
+        _spawned[0] = 0
+        start = time.perf_counter()
+        for _ in range(rounds):
+            scenario(impl, src, work)
+        return (time.perf_counter() - start) / rounds * 1000, _spawned[0] / rounds
+    finally:
+        shutil.rmtree(work, ignore_errors=True)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--seconds", type=int, default=90)
+    parser.add_argument("--rounds", type=int, default=5)
+    args = parser.parse_args()
+
+    work = tempfile.mkdtemp()
+    inputs = make_inputs(work, args.seconds)
+    has_ffprobe = shutil.which("ffprobe") is not None
+    if not has_ffprobe:
+        _skip_ffprobe()
+    subprocess.Popen.__init__ = _counting_init
+    print("audio={}s rounds={} ffprobe={}".format(args.seconds, args.rounds, "yes" if has_ffprobe else "no"))
+    print("{:<22}{:>14}{:>10}{:>14}{:>10}".format("", "legacy ms", "procs", "new ms", "procs"))
+    try:
+        for name, scenario in (("wechatcom", wechatcom), ("wechaty", wechaty), ("wechatmp", wechatmp), ("asr", asr)):
+            for fmt in ("wav", "mp3"):
+                if scenario is asr and fmt == "wav":
+                    continue  # wav直接复制
+                label = "{} ({})".format(name, fmt)
+                new_ms, new_procs = run(audio_convert, scenario, inputs[fmt], args.rounds)
+                legacy_ms, legacy_procs = run(LegacyConvert, scenario, inputs[fmt], args.rounds)
+                legacy = "{:.1f}{}".format(legacy_ms, "" if has_ffprobe else "*")
+                print("{:<22}{:>14}{:>10.1f}{:>14.1f}{:>10.1f}".format(label, legacy, legacy_procs, new_ms, new_procs))
+    finally:
+        subprocess.Popen.__init__ = _popen_init
+        shutil.rmtree(work, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
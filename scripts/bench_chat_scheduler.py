@@ -0,0 +1,68 @@
+# encoding:utf-8
+"""
+ChatChannel消息调度压测脚本
+
+向 5k 个会话推送 10k 条合成消息，统计从 produce 入队到 _handle 开始执行的延迟(p50/p99)
+
+用法: python3 scripts/bench_chat_scheduler.py [--messages 10000] [--sessions 5000]
+"""
+
+import argparse
+import os
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from bridge.context import Context, ContextType  # noqa: E402
+from channel.chat_channel import ChatChannel  # noqa: E402
+
+
+class BenchChannel(ChatChannel):
+    def __init__(self, total):
+        super().__init__()
+        self.total = total
+        self.latencies = []
+        self.latency_lock = threading.Lock()
+        self.done = threading.Event()
+
+    def _handle(self, context: Context):
+        latency = time.perf_counter() - context["enqueue_ts"]
+        with self.latency_lock:
+            self.latencies.append(latency)
+            if len(self.latencies) >= self.total:
+                self.done.set()
+
+
+def percentile(values, p):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p / 100))]
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--messages", type=int, default=10000)
+    parser.add_argument("--sessions", type=int, default=5000)
+    args = parser.parse_args()
+
+    channel = BenchChannel(args.messages)
+    start = time.perf_counter()
+    for i in range(args.messages):
+        context = Context(ContextType.TEXT, "msg {}".format(i), kwargs={"session_id": "s{}".format(i % args.sessions)})
+        context["enqueue_ts"] = time.perf_counter()
+        channel.produce(context)
+    if not channel.done.wait(timeout=300):
+        print("timeout, dispatched {}/{}".format(len(channel.latencies), args.messages))
+        return
+    elapsed = time.perf_counter() - start
+    print("messages={} sessions={} elapsed={:.3f}s".format(args.messages, args.sessions, elapsed))
+    print("enqueue->dispatch latency p50={:.3f}ms p99={:.3f}ms max={:.3f}ms".format(
+        percentile(channel.latencies, 50) * 1000,
+        percentile(channel.latencies, 99) * 1000,
+        max(channel.latencies) * 1000,
+    ))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,248 @@
+# encoding:utf-8
+"""
+ChatChannel._compose_context 吞吐测试脚本
+
+模拟群聊为主的消息流(白名单群、关键词群、非白名单群、@机器人、前缀触发、单聊)，对比旧版每条消息都读取配置、
+逐个startswith和临时编译@正则的实现，与预编译TriggerMatcher的实现每秒能处理的消息数，并校验两者结果一致
+
+用法: python3 scripts/bench_compose_context.py [--messages 50000] [--groups 500]
+"""
+
+import argparse
+import os
+import random
+import re
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import config  # noqa: E402
+from bridge.context import Context, ContextType  # noqa: E402
+from bridge.reply import ReplyType  # noqa: E402
+from channel.chat_channel import ChatChannel, check_contain, check_prefix  # noqa: E402
+from channel.chat_message import ChatMessage  # noqa: E402
+from common.log import logger  # noqa: E402
+from config import Config, conf  # noqa: E402
+from plugins import Event, EventContext, PluginManager  # noqa: E402
+
+
+class LegacyChatChannel(ChatChannel):
+    """优化前的实现"""
+
+    def _compose_context(self, ctype: ContextType, content, **kwargs):
+        context = Context(ctype, content)
+        context.kwargs = kwargs
+        # context首次传入时，origin_ctype是None,
+        # 引入的起因是：当输入语音时，会嵌套生成两个context，第一步语音转文本，第二步通过文本生成文字回复。
+        # origin_ctype用于第二步文本回复时，判断是否需要匹配前缀，如果是私聊的语音，就不需要匹配前缀
+        if "origin_ctype" not in context:
+            context["origin_ctype"] = ctype
+        # context首次传入时，receiver是None，根据类型设置receiver
+        first_in = "receiver" not in context
+        # 群名匹配过程，设置session_id和receiver
+        if first_in:  # context首次传入时，receiver是None，根据类型设置receiver
+            config = conf()
+            cmsg = context["msg"]
+            user_data = conf().get_user_data(cmsg.from_user_id)
+            context["openai_api_key"] = user_data.get("openai_api_key")
+            context["gpt_model"] = user_data.get("gpt_model")
+            if context.get("isgroup", False):
+                group_name = cmsg.other_user_nickname
+                group_id = cmsg.other_user_id
+
+                group_name_white_list = config.get("group_name_white_list", [])
+                group_name_keyword_white_list = config.get("group_name_keyword_white_list", [])
+                if any(
+                    [
+                        group_name in group_name_white_list,
+                        "ALL_GROUP" in group_name_white_list,
+                        check_contain(group_name, group_name_keyword_white_list),
+                    ]
+                ):
+                    group_chat_in_one_session = conf().get("group_chat_in_one_session", [])
+                    session_id = cmsg.actual_user_id
+                    if any(
+                        [
+                            group_name in group_chat_in_one_session,
+                            "ALL_GROUP" in group_chat_in_one_session,
+                        ]
+                    ):
+                        session_id = group_id
+                else:
+                    logger.debug(f"No need reply, groupName not in whitelist, group_name={group_name}")
+                    return None
+                context["session_id"] = session_id
+                context["receiver"] = group_id
+            else:
+                context["session_id"] = cmsg.other_user_id
+                context["receiver"] = cmsg.other_user_id
+            e_context = PluginManager().emit_event(EventContext(Event.ON_RECEIVE_MESSAGE, {"channel": self, "context": context}))
+            context = e_context["context"]
+            if e_context.is_pass() or context is None:
+                return context
+            if cmsg.from_user_id == self.user_id and not config.get("trigger_by_self", True):
+                logger.debug("[chat_channel]self message skipped")
+                return None
+
+        # 消息内容匹配过程，并处理content
+        if ctype == ContextType.TEXT:
+            if first_in and "」\n- - - - - - -" in content:  # 初次匹配 过滤引用消息
+                logger.debug(content)
+                logger.debug("[chat_channel]reference query skipped")
+                return None
+
+            nick_name_black_list = conf().get("nick_name_black_list", [])
+            if context.get("isgroup", False):  # 群聊
+                # 校验关键字
+                match_prefix = check_prefix(content, conf().get("group_chat_prefix"))
+                match_contain = check_contain(content, conf().get("group_chat_keyword"))
+                flag = False
+                if context["msg"].to_user_id != context["msg"].actual_user_id:
+                    if match_prefix is not None or match_contain is not None:
+                        flag = True
+                        if match_prefix:
+                            content = content.replace(match_prefix, "", 1).strip()
+                    if context["msg"].is_at:
+                        nick_name = context["msg"].actual_user_nickname
+                        if nick_name and nick_name in nick_name_black_list:
+                            # 黑名单过滤
+                            logger.warning(f"[chat_channel] Nickname {nick_name} in In BlackList, ignore")
+                            return None
+
+                        logger.info("[chat_channel]receive group at")
+                        if not conf().get("group_at_off", False):
+                            flag = True
+                        self.name = self.name if self.name is not None else ""  # 部分渠道self.name可能没有赋值
+                        pattern = f"@{re.escape(self.name)}(\u2005|\u0020)"
+                        subtract_res = re.sub(pattern, r"", content)
+                        if isinstance(context["msg"].at_list, list):
+                            for at in context["msg"].at_list:
+                                pattern = f"@{re.escape(at)}(\u2005|\u0020)"
+                                subtract_res = re.sub(pattern, r"", subtract_res)
+                        if subtract_res == content and context["msg"].self_display_name:
+                            # 前缀移除后没有变化，使用群昵称再次移除
+                            pattern = f"@{re.escape(context['msg'].self_display_name)}(\u2005|\u0020)"
+                            subtract_res = re.sub(pattern, r"", content)
+                        content = subtract_res
+                if not flag:
+                    if context["origin_ctype"] == ContextType.VOICE:
+                        logger.info("[chat_channel]receive group voice, but checkprefix didn't match")
+                    return None
+            else:  # 单聊
+                nick_name = context["msg"].from_user_nickname
+                if nick_name and nick_name in nick_name_black_list:
+                    # 黑名单过滤
+                    logger.warning(f"[chat_channel] Nickname '{nick_name}' in In BlackList, ignore")
+                    return None
+
+                match_prefix = check_prefix(content, conf().get("single_chat_prefix", [""]))
+                if match_prefix is not None:  # 判断如果匹配到自定义前缀，则返回过滤掉前缀+空格后的内容
+                    content = content.replace(match_prefix, "", 1).strip()
+                elif context["origin_ctype"] == ContextType.VOICE:  # 如果源消息是私聊的语音消息，允许不匹配前缀，放宽条件
+                    pass
+                else:
+                    logger.info("[chat_channel]receive single chat msg, but checkprefix didn't match")
+                    return None
+            content = content.strip()
+            img_match_prefix = check_prefix(content, conf().get("image_create_prefix",[""]))
+            if img_match_prefix:
+                content = content.replace(img_match_prefix, "", 1)
+                context.type = ContextType.IMAGE_CREATE
+            else:
+                context.type = ContextType.TEXT
+            context.content = content.strip()
+            if "desire_rtype" not in context and conf().get("always_reply_voice") and ReplyType.VOICE not in self.NOT_SUPPORT_REPLYTYPE:
+                context["desire_rtype"] = ReplyType.VOICE
+        elif context.type == ContextType.VOICE:
+            if "desire_rtype" not in context and conf().get("voice_reply_voice") and ReplyType.VOICE not in self.NOT_SUPPORT_REPLYTYPE:
+                context["desire_rtype"] = ReplyType.VOICE
+        return context
+
+
+def make_config(groups):
+    return Config(
+        {
+            "group_name_white_list": ["group-{}".format(i) for i in range(0, groups, 2)],
+            "group_name_keyword_white_list": ["kw{}".format(i) for i in range(50)],
+            "group_chat_in_one_session": ["group-{}".format(i) for i in range(0, groups, 10)],
+            "nick_name_black_list": ["spammer-{}".format(i) for i in range(200)],
+            "group_chat_prefix": ["@bot", "bot", "机器人"],
+            "group_chat_keyword": ["help", "帮助", "查询", "天气"],
+            "single_chat_prefix": ["bot", "@bot"],
+            "image_create_prefix": ["画", "看", "找"],
+        }
+    )
+
+
+def make_messages(count, groups, seed=0):
+    rng = random.Random(seed)
+    messages = []
+    for i in range(count):
+        msg = ChatMessage(None)
+        msg.from_user_id = "user-{}".format(rng.randint(0, 1000))
+        msg.to_user_id = "bot-id"
+        msg.actual_user_id = msg.from_user_id
+        msg.actual_user_nickname = rng.choice(["spammer-{}".format(rng.randint(0, 400)), "member-{}".format(rng.randint(0, 1000))])
+        msg.from_user_nickname = msg.actual_user_nickname
+        text = rng.choice(["今天吃什么", "help me", "画一只猫", "查询快递", "随便聊聊 " * rng.randint(1, 20), "hello world"])
+        is_group = rng.random() < 0.9
+        if is_group:
+            name = rng.choice(["group-{}".format(rng.randint(0, groups)), "kw{}-fans".format(rng.randint(0, 100))])
+            msg.other_user_id = "id-" + name
+            msg.other_user_nickname = name
+            msg.is_at = rng.random() < 0.3
+            msg.at_list = ["member-{}".format(rng.randint(0, 1000))] if rng.random() < 0.2 else []
+            if msg.is_at:
+                text = "@bot\u2005" + text
+                for at in msg.at_list:
+                    text = "@{} {}".format(at, text)
+            else:
+                text = rng.choice(["", "", "bot ", "机器人"]) + text
+        else:
+            msg.other_user_id = msg.from_user_id
+            msg.other_user_nickname = msg.from_user_nickname
+            text = rng.choice(["", "bot ", "@bot "]) + text
+        msg.content = text
+        messages.append((msg, is_group))
+    return messages
+
+
+def make_channel(cls):
+    channel = cls.__new__(cls)
+    channel.name = "bot"
+    channel.user_id = "bot-id"
+    return channel
+
+
+def run(channel, messages):
+    results = []
+    start = time.perf_counter()
+    for msg, is_group in messages:
+        context = channel._compose_context(ContextType.TEXT, msg.content, isgroup=is_group, msg=msg)
+        results.append(None if context is None else (context.type, context.content, context.get("session_id")))
+    return time.perf_counter() - start, results
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--messages", type=int, default=50000)
+    parser.add_argument("--groups", type=int, default=500)
+    args = parser.parse_args()
+
+    logger.disabled = True
+    config.config = make_config(args.groups)
+    messages = make_messages(args.messages, args.groups)
+    run(make_channel(ChatChannel), messages[:1000])  # 预热
+    before, legacy_results = run(make_channel(LegacyChatChannel), messages)
+    after, results = run(make_channel(ChatChannel), messages)
+    assert results == legacy_results, "results mismatch"
+    replied = sum(1 for r in results if r is not None)
+    print("messages={} groups={} triggered={}".format(args.messages, args.groups, replied))
+    print("{:<10}{:>14}{:>14}".format("", "legacy", "precompiled"))
+    print("{:<10}{:>14.0f}{:>14.0f}".format("msgs/s", args.messages / before, args.messages / after))
+    print("{:<10}{:>14.2f}{:>14.2f}".format("us/msg", before / args.messages * 1e6, after / args.messages * 1e6))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,139 @@
+# encoding:utf-8
+"""
+HTTP服务压力测试脚本
+
+在本地分别启动与 web.httpserver.runsimple 相同配置的服务(cheroot默认10个线程)和 channel/http_server 创建的服务，
+测量:
+- 多个客户端通过keep-alive连接循环请求时的每秒请求数
+- 同时打开多个SSE长连接时，全部连接收完事件所需的时间(线程不够时后来的连接只能排队)
+
+用法: python3 scripts/bench_http_server.py [--clients 32] [--duration 5] [--sse 100] [--sse-events 5]
+"""
+
+import argparse
+import http.client
+import os
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import config  # noqa: E402
+from channel import http_server  # noqa: E402
+from config import Config  # noqa: E402
+
+
+def app(environ, start_response):
+    path = environ.get("PATH_INFO")
+    if path == "/events":
+        # 模拟web channel的SSE：每隔一段时间推送一条
+        count = int(environ.get("QUERY_STRING", "count=5").split("=")[1])
+        start_response("200 OK", [("Content-Type", "text/event-stream"), ("Cache-Control", "no-cache")])
+
+        def stream():
+            for i in range(count):
+                time.sleep(0.2)
+                yield 'data: {{"seq": {}}}\n\n'.format(i).encode("utf-8")
+
+        return stream()
+    body = b'{"status": "success", "has_content": false}'
+    start_response("200 OK", [("Content-Type", "application/json"), ("Content-Length", str(len(body)))])
+    return [body]
+
+
+def legacy_server(port):
+    # web.httpserver.runsimple 中的配置
+    from cheroot import wsgi
+
+    server = wsgi.Server(("127.0.0.1", port), app, server_name="localhost")
+    server.nodelay = True
+    return server
+
+
+def start(server):
+    thread = threading.Thread(target=server.safe_start, daemon=True)
+    thread.start()
+    while not server.ready:
+        time.sleep(0.01)
+    return thread
+
+
+def bench_requests(port, clients, duration):
+    counts = [0] * clients
+    errors = [0] * clients
+    deadline = time.perf_counter() + duration
+
+    def worker(i):
+        conn = http.client.HTTPConnection("127.0.0.1", port, timeout=10)
+        while time.perf_counter() < deadline:
+            try:
+                conn.request("POST", "/poll", body=b'{"session_id": "s"}', headers={"Content-Type": "application/json"})
+                conn.getresponse().read()
+                counts[i] += 1
+            except Exception:
+                errors[i] += 1
+                conn.close()
+                conn = http.client.HTTPConnection("127.0.0.1", port, timeout=10)
+        conn.close()
+
+    threads = [threading.Thread(target=worker, args=(i,)) for i in range(clients)]
+    start_time = time.perf_counter()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    return sum(counts) / (time.perf_counter() - start_time), sum(errors)
+
+
+def bench_sse(port, connections, events):
+    finished = []
+    lock = threading.Lock()
+
+    def worker():
+        conn = http.client.HTTPConnection("127.0.0.1", port, timeout=120)
+        try:
+            conn.request("GET", "/events?count={}".format(events))
+            data = conn.getresponse().read()
+            if data.count(b"data:") == events:
+                with lock:
+                    finished.append(time.perf_counter())
+        finally:
+            conn.close()
+
+    threads = [threading.Thread(target=worker) for _ in range(connections)]
+    start_time = time.perf_counter()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    return len(finished), (max(finished) - start_time) if finished else 0
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--clients", type=int, default=32)
+    parser.add_argument("--duration", type=float, default=5)
+    parser.add_argument("--sse", type=int, default=100)
+    parser.add_argument("--sse-events", type=int, default=5)
+    parser.add_argument("--threads", type=int, default=64)
+    args = parser.parse_args()
+
+    config.config = Config({"http_server_threads": args.threads})
+    servers = [
+        ("runsimple", legacy_server(18901)),
+        ("http_server", http_server.create_server(app, 18902, "bench", "127.0.0.1")),
+    ]
+    print("clients={} duration={}s sse={}x{} events, threads={}".format(args.clients, args.duration, args.sse, args.sse_events, args.threads))
+    print("{:<14}{:>12}{:>10}{:>16}{:>14}".format("", "req/s", "errors", "sse finished", "sse time(s)"))
+    for name, server in servers:
+        start(server)
+        port = server.bind_addr[1]
+        rps, errors = bench_requests(port, args.clients, args.duration)
+        finished, sse_time = bench_sse(port, args.sse, args.sse_events)
+        server.stop()
+        print("{:<14}{:>12.0f}{:>10}{:>16}{:>14.2f}".format(name, rps, errors, "{}/{}".format(finished, args.sse), sse_time))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,106 @@
+# encoding:utf-8
+"""
+OpenAI客户端复用延迟测试脚本
+
+在本地启动一个兼容OpenAI流式接口的桩服务，分别用"每次新建客户端"和"客户端注册表复用连接"两种方式请求，
+统计首个token的到达时间(p50/p99)
+
+用法: python3 scripts/bench_openai_client_pool.py [--requests 200] [--delay 0.0]
+"""
+
+import argparse
+import json
+import os
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from openai import OpenAI  # noqa: E402
+
+from bot.openai.openai_client_pool import OpenAIClientPool  # noqa: E402
+
+FIRST_TOKEN_DELAY = 0.0
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"  # 支持keep-alive
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        if FIRST_TOKEN_DELAY:
+            time.sleep(FIRST_TOKEN_DELAY)
+        for token in ["Hello", " world", "!"]:
+            chunk = {
+                "id": "stub",
+                "object": "chat.completion.chunk",
+                "created": int(time.time()),
+                "model": "stub",
+                "choices": [{"index": 0, "delta": {"content": token}, "finish_reason": None}],
+            }
+            self._write_chunk("data: {}\n\n".format(json.dumps(chunk)))
+        self._write_chunk("data: [DONE]\n\n")
+        self.wfile.write(b"0\r\n\r\n")
+
+    def _write_chunk(self, data):
+        data = data.encode("utf-8")
+        self.wfile.write("{:x}\r\n".format(len(data)).encode("ascii") + data + b"\r\n")
+        self.wfile.flush()
+
+    def log_message(self, format, *args):
+        pass
+
+
+def first_token_time(client):
+    start = time.perf_counter()
+    stream = client.chat.completions.create(model="stub", messages=[{"role": "user", "content": "hi"}], stream=True)
+    elapsed = None
+    for chunk in stream:
+        if elapsed is None and chunk.choices and chunk.choices[0].delta.content:
+            elapsed = time.perf_counter() - start
+    return elapsed
+
+
+def report(name, values):
+    values = sorted(values)
+    p50 = values[len(values) // 2]
+    p99 = values[min(len(values) - 1, int(len(values) * 0.99))]
+    print("{:<8} first token p50={:.2f}ms p99={:.2f}ms".format(name, p50 * 1000, p99 * 1000))
+
+
+def main():
+    global FIRST_TOKEN_DELAY
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--delay", type=float, default=0.0, help="桩服务返回首个token前的等待秒数")
+    args = parser.parse_args()
+    FIRST_TOKEN_DELAY = args.delay
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), StubHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    base_url = "http://127.0.0.1:{}/v1".format(server.server_address[1])
+
+    cold = []
+    for _ in range(args.requests):
+        client = OpenAI(base_url=base_url, api_key="sk-stub")
+        cold.append(first_token_time(client))
+        client.close()
+
+    pooled = []
+    for _ in range(args.requests):
+        with OpenAIClientPool().client(base_url, "sk-stub") as client:
+            pooled.append(first_token_time(client))
+
+    report("cold", cold)
+    report("pooled", pooled)
+    server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,76 @@
+# encoding:utf-8
+"""
+会话存储压测脚本
+
+向指定的会话存储写入10万个会话(每个会话一问一答)，然后随机查找会话，统计进程RSS和查找延迟(p50/p99)
+每种存储建议单独运行一次，以免RSS相互影响
+
+用法: python3 scripts/bench_session_store.py --store sqlite_lru [--sessions 100000] [--lookups 20000]
+"""
+
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from bot.chatgpt.chat_gpt_session import ChatGPTSession  # noqa: E402
+from bot.session_manager import SessionManager  # noqa: E402
+from config import conf  # noqa: E402
+
+
+def rss_mb():
+    with open("/proc/self/status") as f:
+        for line in f:
+            if line.startswith("VmRSS:"):
+                return int(line.split()[1]) / 1024
+    return 0
+
+
+def percentile(values, p):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p / 100))]
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--store", default="sqlite_lru", choices=["memory", "sqlite", "sqlite_lru"])
+    parser.add_argument("--sessions", type=int, default=100000)
+    parser.add_argument("--lookups", type=int, default=20000)
+    parser.add_argument("--cache-size", type=int, default=1000)
+    args = parser.parse_args()
+
+    db_dir = tempfile.mkdtemp()
+    conf()["session_store"] = args.store
+    conf()["session_store_path"] = os.path.join(db_dir, "sessions.db")
+    conf()["session_store_cache_size"] = args.cache_size
+    conf()["expires_in_seconds"] = 0
+    conf()["conversation_max_tokens"] = 100000
+
+    # 按字符数计算token，不依赖tiktoken
+    manager = SessionManager(ChatGPTSession, model="wenxin")
+    rss_before = rss_mb()
+    start = time.perf_counter()
+    for i in range(args.sessions):
+        session_id = "user_{}".format(i)
+        manager.session_query("question from {}".format(session_id), session_id)
+        manager.session_reply("answer for {}".format(session_id), session_id)
+    write_elapsed = time.perf_counter() - start
+
+    latencies = []
+    for _ in range(args.lookups):
+        session_id = "user_{}".format(random.randrange(args.sessions))
+        start = time.perf_counter()
+        manager.build_session(session_id)
+        latencies.append(time.perf_counter() - start)
+
+    print("store={} sessions={} write={:.1f}s".format(args.store, args.sessions, write_elapsed))
+    print("rss={:.1f}MB (+{:.1f}MB)".format(rss_mb(), rss_mb() - rss_before))
+    print("lookup p50={:.3f}ms p99={:.3f}ms".format(percentile(latencies, 50) * 1000, percentile(latencies, 99) * 1000))
+
+
+if __name__ == "__main__":
+    main()
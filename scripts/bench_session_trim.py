@@ -0,0 +1,64 @@
+# encoding:utf-8
+"""
+会话历史裁剪耗时测试脚本
+
+构造包含200条消息的会话，对比裁剪时"每次全量重新计算token数"与"按消息缓存token数"两种方式的耗时
+
+用法: python3 scripts/bench_session_trim.py [--messages 200] [--model gpt-3.5-turbo] [--rounds 20]
+"""
+
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from bot.chatgpt.chat_gpt_session import ChatGPTSession, num_tokens_from_messages  # noqa: E402
+
+
+class FullRecountSession(ChatGPTSession):
+    """优化前的行为：每次计算都遍历全部消息"""
+
+    def calc_tokens(self):
+        return num_tokens_from_messages(self.messages, self.model)
+
+
+def build_session(session_cls, model, count):
+    session = session_cls("bench", system_prompt="You are a helpful assistant.", model=model)
+    for i in range(count // 2):
+        session.add_query("question {} ".format(i) * 20)
+        session.add_reply("answer {} ".format(i) * 40)
+    return session
+
+
+def bench(session_cls, model, count, rounds):
+    elapsed = 0
+    for _ in range(rounds):
+        session = build_session(session_cls, model, count)
+        max_tokens = session.calc_tokens() // 10  # 裁剪掉约90%的历史
+        start = time.perf_counter()
+        session.discard_exceeding(max_tokens)
+        # 模拟一轮对话：session_query和session_reply各裁剪一次
+        session.add_query("one more question")
+        session.discard_exceeding(max_tokens)
+        elapsed += time.perf_counter() - start
+    return elapsed / rounds
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--messages", type=int, default=200)
+    parser.add_argument("--model", default="gpt-3.5-turbo", help="使用wenxin等模型时按字符数计算，不依赖tiktoken")
+    parser.add_argument("--rounds", type=int, default=20)
+    args = parser.parse_args()
+
+    before = bench(FullRecountSession, args.model, args.messages, args.rounds)
+    after = bench(ChatGPTSession, args.model, args.messages, args.rounds)
+    print("model={} messages={}".format(args.model, args.messages))
+    print("full recount: {:.3f}ms per turn".format(before * 1000))
+    print("cached      : {:.3f}ms per turn".format(after * 1000))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,141 @@
+# encoding:utf-8
+"""
+插件排序字典耗时测试脚本
+
+模拟PluginManager注册500个插件，对比旧版SortedDict(每次修改线性查找+heapify)与带位置索引的堆实现在
+注册、调整优先级、有序遍历、按名称查找、卸载时的耗时
+
+用法: python3 scripts/bench_sorted_dict.py [--plugins 500] [--rounds 20]
+"""
+
+import argparse
+import heapq
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from common.sorted_dict import SortedDict  # noqa: E402
+
+
+class LegacySortedDict(dict):
+    """优化前的实现"""
+
+    def __init__(self, sort_func=lambda k, v: k, init_dict=None, reverse=False):
+        self.sort_func = sort_func
+        self.sorted_keys = None
+        self.reverse = reverse
+        self.heap = []
+
+    def __setitem__(self, key, value):
+        if key in self:
+            super().__setitem__(key, value)
+            for i, (priority, k) in enumerate(self.heap):
+                if k == key:
+                    self.heap[i] = (self.sort_func(key, value), key)
+                    heapq.heapify(self.heap)
+                    break
+            self.sorted_keys = None
+        else:
+            super().__setitem__(key, value)
+            heapq.heappush(self.heap, (self.sort_func(key, value), key))
+            self.sorted_keys = None
+
+    def __delitem__(self, key):
+        super().__delitem__(key)
+        for i, (priority, k) in enumerate(self.heap):
+            if k == key:
+                del self.heap[i]
+                heapq.heapify(self.heap)
+                break
+        self.sorted_keys = None
+
+    def keys(self):
+        if self.sorted_keys is None:
+            self.sorted_keys = [k for _, k in sorted(self.heap, reverse=self.reverse)]
+        return self.sorted_keys
+
+    def items(self):
+        if self.sorted_keys is None:
+            self.sorted_keys = [k for _, k in sorted(self.heap, reverse=self.reverse)]
+        return [(k, self[k]) for k in self.sorted_keys]
+
+    def _update_heap(self, key):
+        for i, (priority, k) in enumerate(self.heap):
+            if k == key:
+                new_priority = self.sort_func(key, self[key])
+                if new_priority != priority:
+                    self.heap[i] = (new_priority, key)
+                    heapq.heapify(self.heap)
+                    self.sorted_keys = None
+                break
+
+    def __iter__(self):
+        return iter(self.keys())
+
+
+class FakePlugin(object):
+    def __init__(self, name, priority):
+        self.name = name
+        self.priority = priority
+        self.enabled = True
+
+
+def bench(dict_cls, count, rounds):
+    rng = random.Random(0)
+    names = ["PLUGIN_{}".format(i) for i in range(count)]
+    timings = {"register": 0, "set_priority": 0, "iterate": 0, "lookup": 0, "uninstall": 0}
+    for _ in range(rounds):
+        plugins = dict_cls(lambda k, v: v.priority, reverse=True)
+
+        start = time.perf_counter()
+        for name in names:
+            plugins[name] = FakePlugin(name, rng.randint(-1000, 1000))
+        timings["register"] += time.perf_counter() - start
+
+        # 与set_plugin_priority相同：修改优先级后更新排序，再遍历一次
+        start = time.perf_counter()
+        for name in rng.sample(names, 50):
+            plugins[name].priority = rng.randint(-1000, 1000)
+            plugins._update_heap(name)
+            list(plugins.items())
+        timings["set_priority"] += time.perf_counter() - start
+
+        start = time.perf_counter()
+        for _ in range(100):
+            for name, plugin in plugins.items():
+                pass
+        timings["iterate"] += time.perf_counter() - start
+
+        # 与emit_event相同：每条消息按名称查找插件
+        start = time.perf_counter()
+        for _ in range(100):
+            for name in names:
+                plugins[name].enabled
+        timings["lookup"] += time.perf_counter() - start
+
+        start = time.perf_counter()
+        for name in rng.sample(names, count // 2):
+            del plugins[name]
+        timings["uninstall"] += time.perf_counter() - start
+    return {k: v / rounds for k, v in timings.items()}
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--plugins", type=int, default=500)
+    parser.add_argument("--rounds", type=int, default=20)
+    args = parser.parse_args()
+
+    before = bench(LegacySortedDict, args.plugins, args.rounds)
+    after = bench(SortedDict, args.plugins, args.rounds)
+    print("plugins={}".format(args.plugins))
+    print("{:<14}{:>12}{:>12}".format("", "legacy(ms)", "indexed(ms)"))
+    for name in before:
+        print("{:<14}{:>12.3f}{:>12.3f}".format(name, before[name] * 1000, after[name] * 1000))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,126 @@
+# encoding:utf-8
+"""
+流式回复转发耗时测试脚本
+
+模拟Bot流式返回一条4k token的回复(每个token一个数据块)，channel像WebChannel.stream_response一样把每个数据块
+编码为SSE帧，对比旧版(每块拼接完整内容并随增量一起发送)与新版(只发送合并后的增量，结束时发送一次完整内容)
+的耗时、帧数和传输字节数
+
+用法: python3 scripts/bench_stream_response.py [--tokens 4000] [--rounds 5]
+"""
+
+import argparse
+import json
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from bridge.bridge import Bridge  # noqa: E402
+from bridge.context import Context, ContextType  # noqa: E402
+from bridge.reply import Reply, ReplyType  # noqa: E402
+from common.log import logger  # noqa: E402
+
+
+class FakeBot(object):
+    def __init__(self, tokens):
+        self.tokens = tokens
+
+    def reply_stream(self, query, context=None):
+        for token in self.tokens:
+            yield {"content": token, "finished": False}
+        yield {"content": "", "finished": True, "event": "end", "token_usage": {"completion_tokens": len(self.tokens)}}
+
+
+class FakeChannel(object):
+    """按WebChannel.stream_response的方式编码每一帧"""
+
+    def __init__(self):
+        self.frames = 0
+        self.bytes = 0
+
+    def _emit(self, data):
+        frame = "data: {}\n\n".format(json.dumps(data, ensure_ascii=False, separators=(",", ":"))).encode("utf-8")
+        self.frames += 1
+        self.bytes += len(frame)
+
+    def send_chunk(self, chunk_data, context):
+        chunk_data["timestamp"] = time.time()
+        chunk_data["request_id"] = context["request_id"]
+        self._emit(chunk_data)
+
+    def send_stream_end(self, context, final_data=None):
+        end_signal = {"event": "end", "timestamp": time.time(), "request_id": context["request_id"], "finished": True}
+        end_signal.update(final_data or {})
+        self._emit(end_signal)
+
+
+def legacy_handle_stream_response(bridge, bot, query, context):
+    """优化前的实现(去掉了日志)"""
+    channel = context.get("channel")
+    stream_generator = bot.reply_stream(query, context)
+    accumulated_content = ""
+    token_usage = {"prompt_tokens": 0, "completion_tokens": 0, "total_tokens": 0}
+    for chunk in stream_generator:
+        if isinstance(chunk, dict):
+            chunk_content = chunk.get("content", "")
+            if chunk_content:
+                accumulated_content += chunk_content
+                chunk_data = {"content": chunk_content, "accumulated_content": accumulated_content, "finished": False, "event": "chunk"}
+                channel.send_chunk(chunk_data, context)
+            if "token_usage" in chunk:
+                token_usage.update(chunk["token_usage"])
+        elif isinstance(chunk, str):
+            accumulated_content += chunk
+            chunk_data = {"content": chunk, "accumulated_content": accumulated_content, "finished": False, "event": "chunk"}
+            channel.send_chunk(chunk_data, context)
+    final_data = {"content": accumulated_content, "token_usage": token_usage, "accumulated_content": accumulated_content}
+    channel.send_stream_end(context, final_data)
+    reply = Reply(ReplyType.TEXT, accumulated_content)
+    reply.token_usage = token_usage
+    return reply
+
+
+def make_tokens(count, seed=0):
+    rng = random.Random(seed)
+    words = ["流式", "回复", "的", "内容", "模型", "生成", "，", "。", " the", " stream", " token", " reply", "\n"]
+    return [rng.choice(words) for _ in range(count)]
+
+
+def run(handle, bridge, tokens, rounds):
+    best = None
+    for i in range(rounds):
+        channel = FakeChannel()
+        context = Context(ContextType.TEXT, "q")
+        context["channel"] = channel
+        context["request_id"] = "bench-{}".format(i)
+        start = time.perf_counter()
+        reply = handle(bridge, FakeBot(tokens), "q", context)
+        cost = time.perf_counter() - start
+        if best is None or cost < best[0]:
+            best = (cost, channel.frames, channel.bytes, reply.content)
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--tokens", type=int, default=4000)
+    parser.add_argument("--rounds", type=int, default=5)
+    args = parser.parse_args()
+
+    logger.disabled = True
+    bridge = Bridge()
+    tokens = make_tokens(args.tokens)
+    before = run(legacy_handle_stream_response, bridge, tokens, args.rounds)
+    after = run(lambda b, bot, q, ctx: b._handle_stream_response(bot, q, ctx), bridge, tokens, args.rounds)
+    assert before[3] == after[3] == "".join(tokens), "content mismatch"
+    print("tokens={} chars={}".format(args.tokens, len(after[3])))
+    print("{:<10}{:>12}{:>10}{:>14}".format("", "time(ms)", "frames", "bytes"))
+    for name, (cost, frames, size, _) in (("legacy", before), ("delta", after)):
+        print("{:<10}{:>12.1f}{:>10}{:>14}".format(name, cost * 1000, frames, size))
+
+
+if __name__ == "__main__":
+    main()
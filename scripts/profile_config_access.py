@@ -0,0 +1,136 @@
+# encoding:utf-8
+"""
+每条消息的配置读取开销测试脚本
+
+按一条群聊文本消息从接收到回复经过的代码(ChatChannel._compose_context、_decorate_reply、ChatGPTBot、SessionManager)
+优化前读取配置的顺序回放，对比旧版Config(每次读取先校验key并经过异常处理)、新版Config.get与ConfigSnapshot属性读取的耗时
+
+用法: python3 scripts/profile_config_access.py [--messages 200000]
+"""
+
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from config import Config, ConfigSnapshot, available_setting  # noqa: E402
+
+# 优化前处理一条群聊文本消息时读取的配置: (key, 默认值)
+PER_MESSAGE_READS = [
+    ("group_name_white_list", []),
+    ("group_name_keyword_white_list", []),
+    ("group_chat_in_one_session", []),
+    ("trigger_by_self", True),
+    ("nick_name_black_list", []),
+    ("group_chat_prefix", None),
+    ("group_chat_keyword", None),
+    ("group_at_off", False),
+    ("image_create_prefix", [""]),
+    ("always_reply_voice", None),
+    ("clear_memory_commands", ["#清除记忆"]),
+    ("conversation_max_tokens", 1000),
+    ("rate_limit_chatgpt", None),
+    ("conversation_max_tokens", 1000),
+    ("group_chat_reply_prefix", ""),
+    ("group_chat_reply_suffix", ""),
+]
+
+
+class LegacyConfig(dict):
+    """优化前的实现"""
+
+    def __getitem__(self, key):
+        if key not in available_setting:
+            raise Exception("key {} not in available_setting".format(key))
+        return super().__getitem__(key)
+
+    def __setitem__(self, key, value):
+        if key not in available_setting:
+            raise Exception("key {} not in available_setting".format(key))
+        return super().__setitem__(key, value)
+
+    def get(self, key, default=None):
+        try:
+            return self[key]
+        except KeyError as e:
+            return default
+        except Exception as e:
+            raise e
+
+
+def make_settings():
+    # 与config-template.json类似，只配置了一部分项，其余读取时走默认值
+    return {
+        "group_name_white_list": ["ChatGPT测试群", "ChatGPT测试群2"],
+        "group_chat_prefix": ["@bot"],
+        "single_chat_prefix": ["bot", "@bot"],
+        "image_create_prefix": ["画"],
+        "conversation_max_tokens": 2500,
+        "voice_reply_voice": False,
+    }
+
+
+def profile_get(config, messages):
+    reads = PER_MESSAGE_READS
+    start = time.perf_counter()
+    for _ in range(messages):
+        for key, default in reads:
+            config.get(key, default)
+    return time.perf_counter() - start
+
+
+def profile_attributes(snapshot, messages):
+    # 热点路径中直接读属性，只在默认值不是None时使用get
+    start = time.perf_counter()
+    for _ in range(messages):
+        snapshot.get("group_name_white_list", [])
+        snapshot.get("group_name_keyword_white_list", [])
+        snapshot.get("group_chat_in_one_session", [])
+        snapshot.get("trigger_by_self", True)
+        snapshot.get("nick_name_black_list", [])
+        snapshot.group_chat_prefix
+        snapshot.group_chat_keyword
+        snapshot.get("group_at_off", False)
+        snapshot.get("image_create_prefix", [""])
+        snapshot.always_reply_voice
+        snapshot.get("clear_memory_commands", ["#清除记忆"])
+        snapshot.get("conversation_max_tokens", 1000)
+        snapshot.rate_limit_chatgpt
+        snapshot.get("conversation_max_tokens", 1000)
+        snapshot.get("group_chat_reply_prefix", "")
+        snapshot.get("group_chat_reply_suffix", "")
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--messages", type=int, default=200000)
+    args = parser.parse_args()
+
+    settings = make_settings()
+    legacy = LegacyConfig(settings)
+    config = Config(settings)
+    snapshot = ConfigSnapshot(config)
+    for key, default in PER_MESSAGE_READS:
+        value = snapshot.get(key, default)
+        if isinstance(value, tuple):  # 快照中的list为tuple
+            value = list(value)
+        assert legacy.get(key, default) == config.get(key, default) == value, key
+
+    results = [
+        ("legacy Config.get", profile_get(legacy, args.messages)),
+        ("Config.get", profile_get(config, args.messages)),
+        ("ConfigSnapshot.get", profile_get(snapshot, args.messages)),
+        ("ConfigSnapshot attrs", profile_attributes(snapshot, args.messages)),
+    ]
+    print("messages={} reads/message={}".format(args.messages, len(PER_MESSAGE_READS)))
+    print("{:<22}{:>14}{:>10}".format("", "ns/message", "speedup"))
+    base = results[0][1]
+    for name, cost in results:
+        print("{:<22}{:>14.0f}{:>9.1f}x".format(name, cost / args.messages * 1e9, base / cost))
+
+
+if __name__ == "__main__":
+    main()
@@ -22,6 +22,9 @@ from config import conf
 
 
 class AliVoice(Voice):
+    # 一句话识别最长60秒
+    asr_max_segment_ms = 55000
+
     def __init__(self):
         """
         初始化AliVoice类，从配置文件加载必要的配置。
@@ -42,6 +45,10 @@ class AliVoice(Voice):
         except Exception as e:
             logger.warn("AliVoice init failed: %s, ignore " % e)
 
+    def cache_params(self):
+        # 音色等参数在阿里云项目(app_key)中配置
+        return {"app_key": self.app_key}
+
     def textToVoice(self, text):
         """
         将文本转换为语音文件。
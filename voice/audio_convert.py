@@ -1,4 +1,18 @@
+"""
+音频转码
+
+音频解码一次得到内存中的PCM(16bit有符号小端)，重采样、切分、编码都基于内存数据完成:
+- wav用wave模块、silk用pysilk直接在内存中编解码，不启动子进程
+- 其余格式直接调用ffmpeg，输入输出都走管道或一次完成文件到文件的转换，每次转码只启动一个ffmpeg进程
+  (pydub的from_file会先启动ffprobe再启动ffmpeg解码，export时再启动一次ffmpeg)
+- amr按帧切分，超长语音分段时不需要重新编码
+"""
+
+import functools
+import io
+import os
 import shutil
+import subprocess
 import wave
 
 from common.log import logger
@@ -8,9 +22,261 @@ try:
 except ImportError:
     logger.debug("import pysilk failed, wechaty voice message will not be supported.")
 
-from pydub import AudioSegment
+FFMPEG = "ffmpeg"
 
 sil_supports = [8000, 12000, 16000, 24000, 32000, 44100, 48000]  # slk转wav时，支持的采样率
+SILK_FORMATS = ("sil", "silk", "slk")
+
+AMR_HEADER = b"#!AMR\n"
+AMR_FRAME_MS = 20
+# AMR-NB每种帧类型(TOC中的FT)的数据长度，不含1字节的TOC
+AMR_FRAME_BYTES = [12, 13, 15, 17, 19, 20, 26, 31, 5, 6, 5, 5, 0, 0, 0, 0]
+
+# MPEG Layer III帧头中的比特率(kbps)和采样率，按MPEG版本区分
+MP3_BITRATES = {
+    1: [0, 32, 40, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320, 0],
+    2: [0, 8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 144, 160, 0],
+}
+MP3_SAMPLE_RATES = {1: [44100, 48000, 32000], 2: [22050, 24000, 16000], 2.5: [11025, 12000, 8000]}
+
+
+def tts_cached(fmt):
+    """
+    输入是TTS缓存交出的音频时，转码结果也放入缓存，再次合成同样的文本时直接复用
+    """
+
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(any_path, out_path):
+            from voice.tts_cache import peek_tts_cache
+
+            # 只有TTS合成过(缓存已创建)才可能是缓存交出的文件，与TTS无关的转码不创建缓存
+            cache = peek_tts_cache()
+            if cache is None:
+                return func(any_path, out_path)
+            return cache.convert(any_path, out_path, fmt, func)
+
+        return wrapper
+
+    return decorator
+
+
+class PcmAudio(object):
+    """内存中的音频，16bit有符号小端PCM"""
+
+    __slots__ = ("pcm", "rate", "channels")
+
+    def __init__(self, pcm, rate, channels=1):
+        self.pcm = pcm
+        self.rate = rate
+        self.channels = channels
+
+    @property
+    def frame_bytes(self):
+        return 2 * self.channels
+
+    @property
+    def duration_ms(self):
+        return len(self.pcm) * 1000 // (self.rate * self.frame_bytes)
+
+    def slice(self, start_ms, end_ms=None):
+        start = start_ms * self.rate // 1000 * self.frame_bytes
+        end = None if end_ms is None else end_ms * self.rate // 1000 * self.frame_bytes
+        return PcmAudio(self.pcm[start:end], self.rate, self.channels)
+
+    def split(self, max_segment_ms):
+        """按最大时长切分"""
+        return [self.slice(start, start + max_segment_ms) for start in range(0, self.duration_ms, max_segment_ms)]
+
+    def convert(self, rate=None, channels=None):
+        """重采样/混音，参数与当前相同时返回自身"""
+        rate = rate or self.rate
+        channels = channels or self.channels
+        if rate == self.rate and channels == self.channels:
+            return self
+        pcm = _ffmpeg(_raw_input_args(self) + ["-ar", str(rate), "-ac", str(channels), "-f", "s16le", "pipe:1"], self.pcm)
+        return PcmAudio(pcm, rate, channels)
+
+
+def audio_format(path):
+    """由扩展名得到格式名，silk的几种扩展名统一为silk"""
+    fmt = os.path.splitext(path)[1][1:].lower()
+    return "silk" if fmt in SILK_FORMATS else fmt
+
+
+def _ffmpeg(args, data=None):
+    try:
+        proc = subprocess.run(
+            [FFMPEG, "-hide_banner", "-loglevel", "error", "-y"] + args,
+            input=data,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+        )
+    except FileNotFoundError:
+        raise RuntimeError("ffmpeg not found, please install ffmpeg first")
+    if proc.returncode != 0:
+        raise RuntimeError("ffmpeg failed: {}".format(proc.stderr.decode("utf-8", "ignore").strip()[-500:]))
+    return proc.stdout
+
+
+def _raw_input_args(audio: PcmAudio):
+    return ["-f", "s16le", "-ar", str(audio.rate), "-ac", str(audio.channels), "-i", "pipe:0"]
+
+
+def _parse_wav(data):
+    """16bit PCM的wav直接读取，其余(如浮点)返回None交给ffmpeg"""
+    try:
+        with wave.open(io.BytesIO(data), "rb") as wav:
+            if wav.getsampwidth() != 2:
+                return None
+            return PcmAudio(wav.readframes(wav.getnframes()), wav.getframerate(), wav.getnchannels())
+    except (wave.Error, EOFError):
+        return None
+
+
+def decode(source, fmt=None, rate=None, channels=None) -> PcmAudio:
+    """
+    解码为PCM
+    :param source: 文件路径或音频数据
+    :param fmt: 格式，为空时由文件扩展名得到，都没有时由ffmpeg识别
+    :param rate: 目标采样率，为空时保持原采样率
+    :param channels: 目标声道数，为空时保持原声道数
+    """
+    is_path = isinstance(source, str)
+    if fmt is None and is_path:
+        fmt = audio_format(source)
+    if fmt in ("wav", "silk"):
+        data = _read(source) if is_path else source
+        if fmt == "silk":
+            silk_rate = rate if rate in sil_supports else 24000
+            audio = PcmAudio(pysilk.decode(data, sample_rate=silk_rate), silk_rate, 1)
+        else:
+            audio = _parse_wav(data)
+        if audio is not None:
+            return audio.convert(rate, channels)
+        source, is_path = data, False
+    # 输出带头部的wav以便得到原始的采样率和声道数
+    args = ["-i", source] if is_path else (["-f", fmt] if fmt else []) + ["-i", "pipe:0"]
+    if rate:
+        args += ["-ar", str(rate)]
+    if channels:
+        args += ["-ac", str(channels)]
+    out = _ffmpeg(args + ["-f", "wav", "-acodec", "pcm_s16le", "pipe:1"], None if is_path else source)
+    return _parse_piped_wav(out)
+
+
+def _parse_piped_wav(data):
+    # 输出到管道时ffmpeg无法回写wav头中的长度，只读取格式，其余都作为数据
+    pos = 12
+    rate = channels = None
+    while pos + 8 <= len(data):
+        chunk_id = data[pos : pos + 4]
+        size = int.from_bytes(data[pos + 4 : pos + 8], "little")
+        if chunk_id == b"fmt ":
+            channels = int.from_bytes(data[pos + 10 : pos + 12], "little")
+            rate = int.from_bytes(data[pos + 12 : pos + 16], "little")
+        elif chunk_id == b"data":
+            pcm = data[pos + 8 :]
+            return PcmAudio(pcm[: len(pcm) - len(pcm) % (2 * channels)], rate, channels)
+        pos += 8 + size
+    raise RuntimeError("invalid wav data from ffmpeg")
+
+
+def encode(audio: PcmAudio, fmt) -> bytes:
+    """编码为指定格式"""
+    if fmt == "wav":
+        buf = io.BytesIO()
+        with wave.open(buf, "wb") as wav:
+            wav.setnchannels(audio.channels)
+            wav.setsampwidth(2)
+            wav.setframerate(audio.rate)
+            wav.writeframes(audio.pcm)
+        return buf.getvalue()
+    if fmt == "silk":
+        audio = audio.convert(find_closest_sil_supports(audio.rate), 1)
+        return pysilk.encode(audio.pcm, data_rate=audio.rate, sample_rate=audio.rate)
+    args = _raw_input_args(audio)
+    if fmt == "amr":
+        args += ["-ar", "8000", "-ac", "1"]  # only support 8000
+    return _ffmpeg(args + ["-f", fmt, "pipe:1"], audio.pcm)
+
+
+def transcode(data, src_fmt, dst_fmt, rate=None, channels=None) -> bytes:
+    """内存中的音频转码"""
+    return encode(decode(data, src_fmt, rate, channels), dst_fmt)
+
+
+def _read(path):
+    with open(path, "rb") as f:
+        return f.read()
+
+
+def _write(path, data):
+    with open(path, "wb") as f:
+        f.write(data)
+
+
+def _ffmpeg_file(src_path, dst_path, dst_fmt, extra_args=()):
+    """两端都由ffmpeg处理时，文件到文件一次完成"""
+    _ffmpeg(["-i", src_path] + list(extra_args) + ["-f", dst_fmt, dst_path])
+
+
+def amr_duration_ms(data):
+    frames = _amr_frames(data)
+    return len(frames) * AMR_FRAME_MS if frames is not None else None
+
+
+def _amr_frames(data):
+    """amr数据中每一帧的(起始, 结束)位置，格式不对时返回None"""
+    if not data.startswith(AMR_HEADER):
+        return None
+    frames = []
+    pos = len(AMR_HEADER)
+    while pos < len(data):
+        end = pos + 1 + AMR_FRAME_BYTES[(data[pos] >> 3) & 0x0F]
+        if end > len(data):
+            return None
+        frames.append((pos, end))
+        pos = end
+    return frames
+
+
+def _mp3_frames(data):
+    """
+    mp3数据中每一帧的(起始, 结束)位置和每帧的毫秒数，只支持Layer III，格式不对时返回None
+    ID3v2标签跳过，文件末尾的ID3v1等非帧数据忽略
+    """
+    pos = 0
+    if data.startswith(b"ID3") and len(data) >= 10:
+        pos = 10 + ((data[6] & 0x7F) << 21 | (data[7] & 0x7F) << 14 | (data[8] & 0x7F) << 7 | (data[9] & 0x7F))
+    frames = []
+    frame_ms = None
+    while pos + 4 <= len(data):
+        b1, b2 = data[pos + 1], data[pos + 2]
+        if data[pos] != 0xFF or (b1 & 0xE0) != 0xE0:
+            break
+        version = {3: 1, 2: 2, 0: 2.5}.get((b1 >> 3) & 0x03)
+        if version is None or (b1 >> 1) & 0x03 != 1:  # 只处理Layer III
+            return None
+        bitrate = MP3_BITRATES[1 if version == 1 else 2][b2 >> 4]
+        rate_index = (b2 >> 2) & 0x03
+        if not bitrate or rate_index == 3:
+            return None
+        rate = MP3_SAMPLE_RATES[version][rate_index]
+        samples = 1152 if version == 1 else 576
+        end = pos + samples // 8 * bitrate * 1000 // rate + ((b2 >> 1) & 0x01)
+        if end > len(data):
+            break
+        frames.append((pos, end))
+        frame_ms = samples * 1000 / rate
+        pos = end
+    if not frames:
+        return None
+    first = data[frames[0][0] : frames[0][1]]
+    if b"Xing" in first or b"Info" in first:
+        # 编码器写入的总帧数等信息，切分后不再准确，去掉
+        frames = frames[1:]
+    return frames, frame_ms
 
 
 def find_closest_sil_supports(sample_rate):
@@ -40,6 +306,7 @@ def get_pcm_from_wav(wav_path):
     return wav.readframes(wav.getnframes())
 
 
+@tts_cached("mp3")
 def any_to_mp3(any_path, mp3_path):
     """
     把任意格式转成mp3文件
@@ -47,11 +314,10 @@ def any_to_mp3(any_path, mp3_path):
     if any_path.endswith(".mp3"):
         shutil.copy2(any_path, mp3_path)
         return
-    if any_path.endswith(".sil") or any_path.endswith(".silk") or any_path.endswith(".slk"):
-        sil_to_wav(any_path, any_path)
-        any_path = mp3_path
-    audio = AudioSegment.from_file(any_path)
-    audio.export(mp3_path, format="mp3")
+    if audio_format(any_path) in ("wav", "silk"):
+        _write(mp3_path, encode(decode(any_path), "mp3"))
+    else:
+        _ffmpeg_file(any_path, mp3_path, "mp3")
 
 
 def any_to_wav(any_path, wav_path):
@@ -61,33 +327,26 @@ def any_to_wav(any_path, wav_path):
     if any_path.endswith(".wav"):
         shutil.copy2(any_path, wav_path)
         return
-    if any_path.endswith(".sil") or any_path.endswith(".silk") or any_path.endswith(".slk"):
+    if audio_format(any_path) == "silk":
         return sil_to_wav(any_path, wav_path)
-    audio = AudioSegment.from_file(any_path)
-    audio.set_frame_rate(8000)    # 百度语音转写支持8000采样率, pcm_s16le, 单通道语音识别
-    audio.set_channels(1)
-    audio.export(wav_path, format="wav", codec='pcm_s16le')
+    _ffmpeg_file(any_path, wav_path, "wav", ["-acodec", "pcm_s16le"])
 
 
+@tts_cached("sil")
 def any_to_sil(any_path, sil_path):
     """
     把任意格式转成sil文件
     """
-    if any_path.endswith(".sil") or any_path.endswith(".silk") or any_path.endswith(".slk"):
+    if audio_format(any_path) == "silk":
         shutil.copy2(any_path, sil_path)
         return 10000
-    audio = AudioSegment.from_file(any_path)
-    rate = find_closest_sil_supports(audio.frame_rate)
-    # Convert to PCM_s16
-    pcm_s16 = audio.set_sample_width(2)
-    pcm_s16 = pcm_s16.set_frame_rate(rate)
-    wav_data = pcm_s16.raw_data
-    silk_data = pysilk.encode(wav_data, data_rate=rate, sample_rate=rate)
-    with open(sil_path, "wb") as f:
-        f.write(silk_data)
-    return audio.duration_seconds * 1000
+    # silk只支持单声道
+    audio = decode(any_path, channels=1)
+    _write(sil_path, encode(audio, "silk"))
+    return audio.duration_ms
 
 
+@tts_cached("amr")
 def any_to_amr(any_path, amr_path):
     """
     把任意格式转成amr文件
@@ -95,12 +354,16 @@ def any_to_amr(any_path, amr_path):
     if any_path.endswith(".amr"):
         shutil.copy2(any_path, amr_path)
         return
-    if any_path.endswith(".sil") or any_path.endswith(".silk") or any_path.endswith(".slk"):
+    fmt = audio_format(any_path)
+    if fmt == "silk":
         raise NotImplementedError("Not support file type: {}".format(any_path))
-    audio = AudioSegment.from_file(any_path)
-    audio = audio.set_frame_rate(8000)  # only support 8000
-    audio.export(amr_path, format="amr")
-    return audio.duration_seconds * 1000
+    if fmt == "wav":
+        data = encode(decode(any_path), "amr")
+        _write(amr_path, data)
+    else:
+        _ffmpeg_file(any_path, amr_path, "amr", ["-ar", "8000", "-ac", "1"])  # only support 8000
+        data = _read(amr_path)
+    return amr_duration_ms(data)
 
 
 def sil_to_wav(silk_path, wav_path, rate: int = 24000):
@@ -116,20 +379,41 @@ def split_audio(file_path, max_segment_length_ms=60000):
     """
     分割音频文件
     """
-    audio = AudioSegment.from_file(file_path)
-    audio_length_ms = len(audio)
+    file_prefix, ext = os.path.splitext(file_path)
+    fmt = audio_format(file_path)
+    if fmt == "amr":
+        data = _read(file_path)
+        frames = _amr_frames(data)
+        if frames is not None:
+            return _split_frames(file_path, AMR_HEADER, data, frames, AMR_FRAME_MS, max_segment_length_ms)
+    elif fmt == "mp3":
+        data = _read(file_path)
+        parsed = _mp3_frames(data)
+        if parsed is not None:
+            return _split_frames(file_path, b"", data, parsed[0], parsed[1], max_segment_length_ms)
+    audio = decode(file_path)
+    audio_length_ms = audio.duration_ms
+    if audio_length_ms <= max_segment_length_ms:
+        return audio_length_ms, [file_path]
+    files = []
+    for i, segment in enumerate(audio.split(max_segment_length_ms)):
+        path = f"{file_prefix}_{i+1}{ext}"
+        _write(path, encode(segment, fmt))
+        files.append(path)
+    return audio_length_ms, files
+
+
+def _split_frames(file_path, header, data, frames, frame_ms, max_segment_length_ms):
+    # amr、mp3的帧可以单独解码，直接按帧切分，不需要重新编码
+    audio_length_ms = int(len(frames) * frame_ms)
     if audio_length_ms <= max_segment_length_ms:
         return audio_length_ms, [file_path]
-    segments = []
-    for start_ms in range(0, audio_length_ms, max_segment_length_ms):
-        end_ms = min(audio_length_ms, start_ms + max_segment_length_ms)
-        segment = audio[start_ms:end_ms]
-        segments.append(segment)
-    file_prefix = file_path[: file_path.rindex(".")]
-    format = file_path[file_path.rindex(".") + 1 :]
+    file_prefix, ext = os.path.splitext(file_path)
+    per_segment = max(1, int(max_segment_length_ms // frame_ms))
     files = []
-    for i, segment in enumerate(segments):
-        path = f"{file_prefix}_{i+1}" + f".{format}"
-        segment.export(path, format=format)
+    for i, start in enumerate(range(0, len(frames), per_segment)):
+        segment = frames[start : start + per_segment]
+        path = f"{file_prefix}_{i+1}{ext}"
+        _write(path, header + data[segment[0][0] : segment[-1][1]])
         files.append(path)
     return audio_length_ms, files
@@ -69,6 +69,10 @@ class AzureVoice(Voice):
             reply = Reply(ReplyType.ERROR, "抱歉，语音识别失败")
         return reply
 
+    def cache_params(self):
+        # 开启auto_detect时音色由文本语言决定，文本相同时结果也相同
+        return {"config": self.config}
+
     def textToVoice(self, text):
         if self.config.get("auto_detect"):
             lang = classify(text)[0]
@@ -17,6 +17,9 @@ from voice.audio_convert import get_pcm_from_wav
 from voice.voice import Voice
 
 class BaiduVoice(Voice):
+    # 短语音识别接口最长60秒
+    asr_max_segment_ms = 55000
+
     def __init__(self):
         try:
             # 读取本地 TTS 参数配置
@@ -144,6 +147,9 @@ class BaiduVoice(Voice):
         logger.info("[Baidu] 长文本合成 success: %s", fn)
         return Reply(ReplyType.VOICE, fn)
 
+    def cache_params(self):
+        return {"lang": self.lang, "ctp": self.ctp, "spd": self.spd, "pit": self.pit, "vol": self.vol, "per": self.per}
+
     def textToVoice(self, text):
         try:
             # GBK 编码字节长度
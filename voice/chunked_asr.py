@@ -0,0 +1,143 @@
+# encoding:utf-8
+"""
+长语音分段识别
+
+各引擎的 voiceToText 都是整段音频一次请求，长语音会超过接口的时长/大小限制，等待时间也随时长线性增长。
+超过引擎单段时长上限的语音在静音处切成若干段，在按引擎划分的线程池中并发识别，再按顺序拼接文本。
+单段上限和并发数由引擎类的 asr_max_segment_ms / asr_concurrency 给出，可通过 asr_chunk_config 按引擎覆盖。
+"""
+
+import os
+import sys
+import threading
+from array import array
+from concurrent.futures import ThreadPoolExecutor
+
+from bridge.reply import Reply, ReplyType
+from common.log import logger
+from config import conf
+from voice import audio_convert
+
+WINDOW_MS = 20  # 计算音量的窗口
+SEARCH_MS = 5000  # 在每段末尾往前多长的范围内找静音
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+def segment_options(provider, voice):
+    """
+    :return: (单段最大毫秒数, 并发数)，单段最大毫秒数为空时不分段
+    """
+    options = (conf().get("asr_chunk_config") or {}).get(provider) or {}
+    max_segment_ms = options.get("max_segment_ms", getattr(voice, "asr_max_segment_ms", None))
+    concurrency = options.get("concurrency", getattr(voice, "asr_concurrency", 1))
+    return max_segment_ms, max(1, int(concurrency or 1))
+
+
+def find_segments(audio, max_segment_ms):
+    """
+    切分位置：每段在上限前SEARCH_MS(不超过上限的1/4)范围内找最安静的窗口，从窗口中间切开，尽量不切断字词
+    :return: 各段的(起始毫秒, 结束毫秒)
+    """
+    total = audio.duration_ms
+    search = min(SEARCH_MS, max_segment_ms // 4)
+    segments = []
+    start = 0
+    while total - start > max_segment_ms:
+        end = start + max_segment_ms
+        end = _quietest(audio, end - search, end) if search >= WINDOW_MS else end
+        segments.append((start, end))
+        start = end
+    segments.append((start, total))
+    return segments
+
+
+def _quietest(audio, begin_ms, end_ms):
+    samples = array("h")
+    samples.frombytes(audio.slice(begin_ms, end_ms).pcm)
+    if sys.byteorder == "big":
+        samples.byteswap()
+    # 只看第一个声道，降采样到约4kHz，足够区分静音
+    step = audio.channels * max(1, audio.rate // 4000)
+    window = audio.rate * WINDOW_MS // 1000 * audio.channels
+    best, best_energy = end_ms, None
+    for offset in range(0, len(samples) - window + 1, window):
+        energy = sum(map(abs, samples[offset : offset + window : step]))
+        # 同样安静时取靠后的位置，分段数更少
+        if best_energy is None or energy <= best_energy:
+            best_energy = energy
+            best = begin_ms + offset // audio.channels * 1000 // audio.rate + WINDOW_MS // 2
+    return best
+
+
+def _get_pool(provider, concurrency):
+    # 同一引擎的所有请求共用一个线程池，并发数是对该引擎的总并发
+    key = (provider, concurrency)
+    with _pools_lock:
+        pool = _pools.get(key)
+        if pool is None:
+            pool = _pools[key] = ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix="asr-{}".format(provider))
+        return pool
+
+
+def join_texts(texts):
+    """拼接各段文本，两侧都是英文字母或数字时加空格"""
+    result = ""
+    for text in texts:
+        text = text.strip()
+        if not text:
+            continue
+        if result and result[-1].isascii() and result[-1].isalnum() and text[0].isascii() and text[0].isalnum():
+            result += " "
+        result += text
+    return result
+
+
+def voice_to_text(provider, voice, voice_file) -> Reply:
+    """
+    带分段的 voice.voiceToText(voice_file)，不需要分段时直接调用
+    :param provider: 引擎名称，即voice_to_text配置
+    """
+    max_segment_ms, concurrency = segment_options(provider, voice)
+    if not max_segment_ms:
+        return voice.voiceToText(voice_file)
+    try:
+        audio = audio_convert.decode(voice_file)
+    except Exception as e:
+        logger.warning("[ChunkedASR] decode failed, recognize whole file: {}".format(e))
+        return voice.voiceToText(voice_file)
+    if audio.duration_ms <= max_segment_ms:
+        return voice.voiceToText(voice_file)
+
+    segments = find_segments(audio, max_segment_ms)
+    logger.info(
+        "[ChunkedASR] file={}, duration={}ms, segments={}, concurrency={}".format(voice_file, audio.duration_ms, len(segments), concurrency)
+    )
+    prefix = os.path.splitext(voice_file)[0]
+    paths = []
+    futures = []
+    try:
+        pool = _get_pool(provider, concurrency)
+        for i, (start, end) in enumerate(segments):
+            path = "{}_part{}.wav".format(prefix, i + 1)
+            with open(path, "wb") as f:
+                f.write(audio_convert.encode(audio.slice(start, end), "wav"))
+            paths.append(path)
+            futures.append(pool.submit(voice.voiceToText, path))
+        texts = []
+        for i, future in enumerate(futures):
+            reply = future.result()
+            if reply is None or reply.type != ReplyType.TEXT:
+                logger.warning("[ChunkedASR] segment {}/{} failed: {}".format(i + 1, len(futures), reply))
+                return reply or Reply(ReplyType.ERROR, "语音识别失败")
+            texts.append(reply.content or "")
+        return Reply(ReplyType.TEXT, join_texts(texts))
+    finally:
+        for future in futures:
+            future.cancel()
+        for path in paths:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
@@ -10,6 +10,8 @@ from voice.voice import Voice
 
 
 class EdgeVoice(Voice):
+    # 每次合成在调用线程中新建事件循环，互不影响
+    concurrent_synthesis = True
 
     def __init__(self):
         '''
@@ -37,6 +39,9 @@ class EdgeVoice(Voice):
     def voiceToText(self, voice_file):
         pass
 
+    def cache_params(self):
+        return {"voice": self.voice}
+
     async def gen_voice(self, text, fileName):
         communicate = edge_tts.Communicate(text, self.voice)
         await communicate.save(fileName)
@@ -20,6 +20,9 @@ class ElevenLabsVoice(Voice):
     def voiceToText(self, voice_file):
         pass
 
+    def cache_params(self):
+        return {"voice": name}
+
     def textToVoice(self, text):
         audio = client.generate(
             text=text,
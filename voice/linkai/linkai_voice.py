@@ -13,6 +13,9 @@ import os
 import datetime
 
 class LinkAIVoice(Voice):
+    # 与openai相同的transcriptions接口
+    asr_max_segment_ms = 120000
+
     def __init__(self):
         pass
 
@@ -11,11 +11,19 @@ from config import conf
 from voice.voice import Voice
 import requests
 from common import const
-import datetime, random
+import datetime
+import uuid
 
 class OpenaiVoice(Voice):
+    # 每次合成是独立的HTTP请求，可以并发
+    concurrent_synthesis = True
+    # 接口限制文件25MB，长语音分段后并发识别缩短等待时间
+    asr_max_segment_ms = 120000
+
     def __init__(self):
         openai.api_key = conf().get("open_ai_api_key")
+        # 复用连接，流式语音回复中连续合成多句时省去重复建连
+        self.session = requests.Session()
 
     def voiceToText(self, voice_file):
         logger.debug("[Openai] voice file name={}".format(voice_file))
@@ -57,8 +65,10 @@ class OpenaiVoice(Voice):
                 'input': text,
                 'voice': conf().get("tts_voice_id") or "alloy"
             }
-            response = requests.post(url, headers=headers, json=data)
-            file_name = "tmp/" + datetime.datetime.now().strftime('%Y%m%d%H%M%S') + str(random.randint(0, 1000)) + ".mp3"
+            response = self.session.post(url, headers=headers, json=data, timeout=(5, 60))
+            response.raise_for_status()
+            # 并发合成时同一秒内会生成多个文件，用uuid避免重名
+            file_name = "tmp/" + datetime.datetime.now().strftime('%Y%m%d%H%M%S') + uuid.uuid4().hex[:8] + ".mp3"
             logger.debug(f"[OPENAI] text_to_Voice file_name={file_name}, input={text}")
             with open(file_name, 'wb') as f:
                 f.write(response.content)
@@ -11,6 +11,9 @@ from bridge.reply import Reply, ReplyType
 from common.tmp_dir import TmpDir
 
 class TencentVoice(Voice):
+    # 一句话识别最长60秒
+    asr_max_segment_ms = 55000
+
     def __init__(self):
         super().__init__()
         self.secret_id = None
@@ -83,6 +86,9 @@ class TencentVoice(Voice):
             logger.error("[Tencent] Voice to text error: {}".format(e))
             return Reply(ReplyType.ERROR, "腾讯语音识别出错：{}".format(str(e)))
 
+    def cache_params(self):
+        return {"voice_type": self.voice_type}
+
     def textToVoice(self, text):
         """
         将文本转换为语音
@@ -0,0 +1,302 @@
+# encoding:utf-8
+
+import hashlib
+import itertools
+import json
+import os
+import shutil
+import threading
+import unicodedata
+from collections import OrderedDict
+
+from bridge.reply import Reply, ReplyType
+from common.expired_dict import ExpiredDict
+from common.log import logger
+from common.tmp_dir import TmpDir
+from config import conf, get_appdata_dir
+
+META_FILE = "meta.json"
+SOURCE_PREFIX = "source"
+VARIANT_PREFIX = "variant."
+
+
+def normalize_text(text):
+    """规范化文本：Unicode NFC，去掉首尾空白，连续空白合并为一个空格"""
+    return " ".join(unicodedata.normalize("NFC", text).split())
+
+
+def make_key(provider, params, text):
+    raw = json.dumps([provider, params, normalize_text(text)], ensure_ascii=False, sort_keys=True, default=str)
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+def _link_or_copy(src, dst):
+    # 硬链接不占额外空间，跨文件系统等情况下退回复制
+    try:
+        os.link(src, dst)
+    except OSError:
+        shutil.copyfile(src, dst)
+
+
+class TTSCache(object):
+    """
+    语音合成结果的磁盘缓存，按(引擎, 音色/模型等合成参数, 规范化后的文本)寻址
+
+    每个条目是 cache_dir/<sha256>/ 目录:
+    - source.<扩展名>: TTS引擎合成的原始音频
+    - variant.<格式>: audio_convert转码得到的mp3/amr/sil等，命中时连转码也一起跳过
+    - meta.json: 原始音频的文件名和转码函数的返回值(如sil的时长)
+    总大小超过max_bytes时按最近使用顺序整条淘汰；命中时更新目录的mtime，重启后按mtime恢复使用顺序。
+    交给channel的是tmp目录下的硬链接，channel发送后删除临时文件不影响缓存。
+    """
+
+    def __init__(self, cache_dir, max_bytes=200 * 1024 * 1024):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()  # key -> {"size": 总字节数, "meta": meta}
+        self._total = 0
+        self._lock = threading.Lock()
+        self._key_locks = {}
+        self._issued = ExpiredDict(3600, refresh_on_read=False)  # 交出去的临时文件 -> key，用于识别转码的输入
+        self._seq = itertools.count()
+        os.makedirs(cache_dir, exist_ok=True)
+        self._load()
+
+    def text_to_voice(self, provider, voice, text) -> Reply:
+        """
+        带缓存的 voice.textToVoice(text)
+        :param provider: 引擎名称，即text_to_voice配置
+        """
+        try:
+            params = voice.cache_params()
+        except Exception as e:
+            # 引擎初始化失败时参数可能不完整
+            logger.debug("[TTSCache] get cache params failed: {}".format(e))
+            params = None
+        if params is None:
+            return voice.textToVoice(text)
+        key = make_key(provider, params, text)
+        path = self._checkout(key)
+        if path:
+            logger.debug("[TTSCache] hit, key={}, file={}".format(key, path))
+            return Reply(ReplyType.VOICE, path)
+        # 同一段文本同时只合成一次
+        with self._key_lock(key):
+            path = self._checkout(key)
+            if path:
+                return Reply(ReplyType.VOICE, path)
+            reply = voice.textToVoice(text)
+            if reply and reply.type == ReplyType.VOICE and self._valid_file(reply.content):
+                try:
+                    self._store(key, reply.content)
+                    self._issued[reply.content] = key
+                except Exception as e:
+                    logger.warning("[TTSCache] store failed: {}".format(e))
+            return reply
+
+    def convert(self, src_path, dst_path, fmt, func):
+        """
+        转码，src_path是缓存交出的文件时复用缓存中的转码结果
+        :param func: audio_convert中的转码函数 func(src_path, dst_path)，返回值一并缓存
+        """
+        key = self._issued.get(src_path)
+        if key is None:
+            return func(src_path, dst_path)
+        variant = VARIANT_PREFIX + fmt
+        with self._lock:
+            entry = self._entries.get(key)
+            hit = entry is not None and variant in entry["meta"]["variants"]
+            if hit:
+                result = entry["meta"]["variants"][variant]
+                self._entries.move_to_end(key)
+        if hit:
+            try:
+                _link_or_copy(os.path.join(self.cache_dir, key, variant), dst_path)
+                logger.debug("[TTSCache] variant hit, key={}, fmt={}".format(key, fmt))
+                return result
+            except OSError:
+                pass
+        result = func(src_path, dst_path)
+        if self._valid_file(dst_path):
+            try:
+                self._add_variant(key, variant, dst_path, result)
+            except Exception as e:
+                logger.warning("[TTSCache] store variant failed: {}".format(e))
+        return result
+
+    def _checkout(self, key):
+        """命中时把原始音频链接到tmp目录并返回路径"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            self._entries.move_to_end(key)
+            source = entry["meta"]["source"]
+        entry_dir = os.path.join(self.cache_dir, key)
+        path = "{}tts-{}-{}{}".format(TmpDir().path(), key[:16], next(self._seq), os.path.splitext(source)[1])
+        try:
+            _link_or_copy(os.path.join(entry_dir, source), path)
+            os.utime(entry_dir)
+        except OSError as e:
+            # 缓存文件被外部删除
+            logger.warning("[TTSCache] read cache failed, key={}: {}".format(key, e))
+            self._remove(key)
+            return None
+        self._issued[path] = key
+        return path
+
+    def _store(self, key, src_path):
+        entry_dir = os.path.join(self.cache_dir, key)
+        os.makedirs(entry_dir, exist_ok=True)
+        source = SOURCE_PREFIX + os.path.splitext(src_path)[1]
+        _link_or_copy(src_path, os.path.join(entry_dir, source) + ".tmp")
+        os.replace(os.path.join(entry_dir, source) + ".tmp", os.path.join(entry_dir, source))
+        meta = {"source": source, "variants": {}}
+        self._write_meta(entry_dir, meta)
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old:
+                self._total -= old["size"]
+            size = os.path.getsize(os.path.join(entry_dir, source))
+            self._entries[key] = {"size": size, "meta": meta}
+            self._total += size
+            self._evict(key)
+
+    def _add_variant(self, key, variant, path, result):
+        entry_dir = os.path.join(self.cache_dir, key)
+        target = os.path.join(entry_dir, variant)
+        _link_or_copy(path, target + ".tmp")
+        os.replace(target + ".tmp", target)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or variant in entry["meta"]["variants"]:
+                return
+            entry["meta"]["variants"][variant] = result
+            entry["size"] += os.path.getsize(target)
+            self._total += os.path.getsize(target)
+            self._write_meta(entry_dir, entry["meta"])
+            self._evict(key)
+
+    def _evict(self, keep):
+        """超过容量时淘汰最久未使用的条目，调用方持有self._lock"""
+        while self._total > self.max_bytes and len(self._entries) > 1:
+            key, entry = next(iter(self._entries.items()))
+            if key == keep:
+                break
+            self._entries.pop(key)
+            self._total -= entry["size"]
+            shutil.rmtree(os.path.join(self.cache_dir, key), ignore_errors=True)
+            logger.debug("[TTSCache] evict key={}".format(key))
+
+    def _remove(self, key):
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            if entry:
+                self._total -= entry["size"]
+        shutil.rmtree(os.path.join(self.cache_dir, key), ignore_errors=True)
+
+    def _load(self):
+        """从磁盘恢复索引，按目录mtime排列使用顺序，不完整的条目直接删除"""
+        entries = []
+        for name in os.listdir(self.cache_dir):
+            entry_dir = os.path.join(self.cache_dir, name)
+            if len(name) != 64 or not os.path.isdir(entry_dir):
+                continue
+            meta = self._read_meta(entry_dir)
+            if not meta or not os.path.exists(os.path.join(entry_dir, meta.get("source", ""))):
+                shutil.rmtree(entry_dir, ignore_errors=True)
+                continue
+            size = 0
+            for file_name in [meta["source"]] + list(meta["variants"]):
+                try:
+                    size += os.path.getsize(os.path.join(entry_dir, file_name))
+                except OSError:
+                    meta["variants"].pop(file_name, None)
+            entries.append((os.path.getmtime(entry_dir), name, {"size": size, "meta": meta}))
+        entries.sort(key=lambda item: item[0])
+        with self._lock:
+            for _, name, entry in entries:
+                self._entries[name] = entry
+                self._total += entry["size"]
+            self._evict(None)
+        logger.info("[TTSCache] loaded {} entries, {} bytes".format(len(self._entries), self._total))
+
+    def _key_lock(self, key):
+        with self._lock:
+            lock = self._key_locks.get(key)
+            if lock is None:
+                lock = self._key_locks[key] = _KeyLock(self._key_locks, key, self._lock)
+            lock.users += 1
+            return lock
+
+    @staticmethod
+    def _valid_file(path):
+        try:
+            return os.path.getsize(path) > 0
+        except (OSError, TypeError):
+            return False
+
+    @staticmethod
+    def _read_meta(entry_dir):
+        try:
+            with open(os.path.join(entry_dir, META_FILE), "r", encoding="utf-8") as f:
+                return json.load(f)
+        except Exception:
+            return None
+
+    @staticmethod
+    def _write_meta(entry_dir, meta):
+        tmp_path = os.path.join(entry_dir, META_FILE + ".tmp")
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(meta, f)
+        os.replace(tmp_path, os.path.join(entry_dir, META_FILE))
+
+
+class _KeyLock(object):
+    """按key加锁，最后一个使用者释放时从表中移除，避免锁对象无限增长"""
+
+    def __init__(self, table, key, table_lock):
+        self.table = table
+        self.key = key
+        self.table_lock = table_lock
+        self.lock = threading.Lock()
+        self.users = 0
+
+    def __enter__(self):
+        self.lock.acquire()
+        return self
+
+    def __exit__(self, *args):
+        self.lock.release()
+        with self.table_lock:
+            self.users -= 1
+            if self.users == 0:
+                self.table.pop(self.key, None)
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def peek_tts_cache():
+    """已创建的全局缓存，未创建或已关闭时返回None，不会创建"""
+    if not conf().get("tts_cache_enabled", True):
+        return None
+    return _cache
+
+
+def get_tts_cache():
+    """按配置创建全局缓存，tts_cache_enabled关闭时返回None"""
+    global _cache
+    if not conf().get("tts_cache_enabled", True):
+        return None
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                cache_dir = conf().get("tts_cache_dir") or os.path.join(get_appdata_dir(), "tts_cache")
+                try:
+                    _cache = TTSCache(cache_dir, conf().get("tts_cache_max_bytes", 200 * 1024 * 1024))
+                except Exception as e:
+                    logger.warning("[TTSCache] init failed, cache disabled: {}".format(e))
+                    return None
+    return _cache
@@ -2,8 +2,17 @@
 Voice service abstract class
 """
 
+from config import conf
+
 
 class Voice(object):
+    # whether textToVoice can be called from several threads at once, streaming voice replies synthesize sentences concurrently if so
+    concurrent_synthesis = False
+    # longest audio voiceToText accepts in one request, longer voice is split and recognized in segments. None means no splitting
+    asr_max_segment_ms = None
+    # max concurrent voiceToText requests when recognizing segments
+    asr_concurrency = 3
+
     def voiceToText(self, voice_file):
         """
         Send voice to voice service and get text
@@ -15,3 +24,10 @@ class Voice(object):
         Send text to voice service and get voice
         """
         raise NotImplementedError
+
+    def cache_params(self):
+        """
+        parameters that affect the synthesized audio (voice, model, ...), used as part of the tts cache key.
+        return None if the result should not be cached
+        """
+        return {"voice": conf().get("tts_voice_id"), "model": conf().get("text_to_voice_model")}
@@ -34,6 +34,9 @@ from pydub import AudioSegment
 
 
 class XunfeiVoice(Voice):
+    # 语音听写最长60秒
+    asr_max_segment_ms = 55000
+
     def __init__(self):
         try:
             curdir = os.path.dirname(__file__)
@@ -73,6 +76,9 @@ class XunfeiVoice(Voice):
             reply = Reply(ReplyType.ERROR, "讯飞语音识别出错了；{0}")
         return reply
 
+    def cache_params(self):
+        return {"business_args": self.BusinessArgsTTS}
+
     def textToVoice(self, text):
         try:
             # Avoid the same filename under multithreading